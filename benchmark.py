@@ -0,0 +1,341 @@
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from message_store import MessageStore
+
+WORDS = (
+    "the a my we you they went saw said think like love hate today yesterday "
+    "dinner hiking painting music book movie trip friend sister brother dog "
+    "cat work school garden beach city mountain coffee weekend plan idea"
+).split()
+
+
+def make_synthetic_locomo(
+    path, conversations=10, sessions=20, messages_per_session=50, seed=0
+):
+    """Write a LoCoMo shaped chat history file with random messages"""
+    rng = random.Random(seed)
+    data = []
+    for conv in range(conversations):
+        conversation = {"speaker_a": "Alice", "speaker_b": "Bob"}
+        for num in range(1, sessions + 1):
+            # mostly real locomo formats, a few unparseable ones
+            conversation[f"session_{num}_date_time"] = (
+                f"{rng.randint(1, 12)}:{rng.randint(0, 59):02d} "
+                f"{rng.choice(['am', 'pm'])} on {rng.randint(1, 28)} "
+                f"{rng.choice(['Jan', 'May', 'August', 'October'])}, 2023"
+                if rng.random() > 0.01
+                else "sometime last spring"
+            )
+            conversation[f"session_{num}"] = [
+                {
+                    "speaker": "Alice" if i % 2 == 0 else "Bob",
+                    "dia_id": f"D{num}:{i + 1}",
+                    "text": " ".join(
+                        rng.choice(WORDS) for _ in range(rng.randint(5, 40))
+                    ),
+                }
+                for i in range(messages_per_session)
+            ]
+        data.append({"sample_id": f"conv-{conv}", "conversation": conversation})
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return path
+
+
+def measure(fn):
+    """Run fn and return (result, seconds, peak traced bytes)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def print_result(name, elapsed, peak=None, extra=""):
+    peak = "" if peak is None else f"peak {peak / 2**20:>8.2f} MiB  "
+    print(f"{name:<32} {elapsed * 1000:>10.1f} ms  {peak}{extra}")
+
+
+def bench_store(args, chat_file):
+    from process_chat_history import load_locomo, locomo_count_conversations
+
+    conv_count = locomo_count_conversations(chat_file)
+    per_conv = {
+        conv_id: load_locomo(chat_file, conv_num=conv_id)
+        for conv_id in range(1, conv_count + 1)
+    }
+    total = sum(len(m) for m in per_conv.values())
+    print(f"-> {conv_count} conversations, {total} messages")
+
+    def build_lists():
+        # copy the strings so both variants own their data
+        return {
+            k: [m.encode("utf-8").decode("utf-8") for m in v]
+            for k, v in per_conv.items()
+        }
+
+    def build_store():
+        store = MessageStore()
+        for k, v in per_conv.items():
+            store[k] = v
+        return store
+
+    _, elapsed, peak = measure(build_lists)
+    print_result("dict of lists", elapsed, peak)
+    store, elapsed, peak = measure(build_store)
+    print_result("MessageStore", elapsed, peak, f"nbytes={store.nbytes()}")
+
+    def iterate(store):
+        n = 0
+        for _, messages in store.items():
+            for _ in messages:
+                n += 1
+        return n
+
+    _, elapsed, peak = measure(lambda: iterate(store))
+    print_result("MessageStore iterate", elapsed, peak)
+
+    with tempfile.TemporaryDirectory() as spill_dir:
+        max_memory = max(1, args.spill_mb) * 2**20
+
+        def build_spill_store():
+            spill_store = MessageStore(max_memory=max_memory, spill_dir=spill_dir)
+            for k, v in per_conv.items():
+                spill_store[k] = v
+            return spill_store
+
+        spill_store, elapsed, peak = measure(build_spill_store)
+        print_result(
+            f"MessageStore spill {args.spill_mb} MiB",
+            elapsed,
+            peak,
+            f"nbytes={spill_store.nbytes()} spilled={spill_store.spilled_bytes()}",
+        )
+        _, elapsed, peak = measure(lambda: iterate(spill_store))
+        print_result("MessageStore spill iterate", elapsed, peak)
+
+    from migration import MigrationHack
+
+    with tempfile.TemporaryDirectory() as extract_dir:
+        hack = MigrationHack(chat_history_file=chat_file, extract_dir=extract_dir)
+        _, elapsed, peak = measure(hack.load)
+        print_result("MigrationHack.load (parse)", elapsed, peak)
+        hack = MigrationHack(chat_history_file=chat_file, extract_dir=extract_dir)
+        _, elapsed, peak = measure(hack.load)
+        print_result("MigrationHack.load (cached)", elapsed, peak)
+
+
+def _strptime_locomo_date(date_str):
+    # the two format parse load_locomo used before parse_locomo_date
+    for fmt in ("%I:%M %p on %d %b, %Y", "%I:%M %p on %d %B, %Y"):
+        try:
+            return datetime.datetime.strptime(date_str, fmt).timestamp()
+        except Exception:
+            pass
+    return None
+
+
+def bench_dates(args, chat_file):
+    from process_chat_history import (
+        _parse_locomo_date,
+        load_locomo,
+        new_locomo_date_stats,
+        parse_locomo_date,
+    )
+
+    with open(chat_file) as f:
+        data = json.load(f)
+    dates = [
+        value
+        for section in data
+        for key, value in section.get("conversation", {}).items()
+        if key.endswith("_date_time")
+    ]
+    # repeat to the size of a large export
+    dates = dates * max(1, 100000 // max(1, len(dates)))
+    print(f"-> {len(dates)} session dates, {len(set(dates))} distinct")
+
+    _, elapsed, peak = measure(lambda: [_strptime_locomo_date(d) for d in dates])
+    print_result("strptime x2 formats", elapsed, peak)
+    _parse_locomo_date.cache_clear()
+    _, elapsed, peak = measure(
+        lambda: [_parse_locomo_date.__wrapped__(d) for d in dates]
+    )
+    print_result("regex parser, no cache", elapsed, peak)
+    _parse_locomo_date.cache_clear()
+    _, elapsed, peak = measure(lambda: [parse_locomo_date(d) for d in dates])
+    print_result("regex parser, memoized", elapsed, peak)
+    mismatches = sum(
+        1 for d in set(dates) if parse_locomo_date(d) != _strptime_locomo_date(d)
+    )
+    print(f"-> {mismatches} dates parsed differently from strptime")
+
+    date_stats = new_locomo_date_stats()
+    _, elapsed, peak = measure(lambda: load_locomo(chat_file, date_stats=date_stats))
+    print_result("load_locomo", elapsed, peak, str(date_stats))
+
+
+def bench_summarize(args, chat_file, summarize_every=20):
+    from process_chat_history import load_locomo
+    from summarizer import ExtractiveSummarizer
+
+    messages = load_locomo(chat_file)
+    batches = [
+        "\n".join(messages[i:i + summarize_every])
+        for i in range(0, len(messages), summarize_every)
+    ]
+    print(f"-> {len(messages)} messages in {len(batches)} batches of {summarize_every}")
+    for method in ("textrank", "tfidf"):
+        summarizer = ExtractiveSummarizer(method=method)
+        _, elapsed, peak = measure(lambda: [summarizer.summarize(b) for b in batches])
+        rate = len(messages) / elapsed if elapsed else 0.0
+        print_result(
+            f"extractive {method}",
+            elapsed,
+            peak,
+            f"{rate:.0f} msgs/s, ~{1e6 / rate / 60 if rate else 0:.1f} min per 1M msgs",
+        )
+
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_FIRST_REQUEST = """
+import json, sys, time
+start = time.perf_counter()
+from restcli import MemMachineRestClient
+imported = time.perf_counter()
+client = MemMachineRestClient(base_url=sys.argv[1], statistic_file=sys.argv[2])
+created = time.perf_counter()
+client.post_episodic_memory("first request")
+first = time.perf_counter()
+client.post_episodic_memory("second request")
+second = time.perf_counter()
+print(json.dumps([imported - start, created - imported, first - created, second - first]))
+"""
+
+_IMPORT_TIME = (
+    "import time; s = time.perf_counter(); import %s; "
+    "print(time.perf_counter() - s)"
+)
+
+
+def run_python(argv, cwd):
+    """Wall seconds and stdout of a fresh interpreter running argv"""
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable] + argv, cwd=cwd, env=env, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if out.returncode != 0:
+        raise Exception(f"Error: {argv} failed: {out.stderr}")
+    return elapsed, out.stdout
+
+
+def bench_startup(args, chat_file, repeat=5):
+    from memmachine_standin import MemMachineStandIn
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        shutil.copy(os.path.join(REPO_DIR, "user_session.json"), work_dir)
+        elapsed, _ = run_python(["-c", "pass"], work_dir)
+        print_result("interpreter", elapsed)
+        for module in ("process_chat_history", "restcli", "migration", "loadgen"):
+            times = [
+                float(run_python(["-c", _IMPORT_TIME % module], work_dir)[1])
+                for _ in range(repeat)
+            ]
+            print_result(f"import {module}", statistics.median(times))
+        dry_run = [
+            os.path.join(REPO_DIR, "migration.py"),
+            "--chat_history",
+            chat_file,
+            "--how_many_conversations",
+        ]
+        elapsed, out = run_python(dry_run, work_dir)
+        print_result(
+            "dry run (no index)", elapsed, extra=f"{out.strip()} conversations"
+        )
+        times = [run_python(dry_run, work_dir)[0] for _ in range(repeat)]
+        print_result("dry run (index)", statistics.median(times))
+
+        with MemMachineStandIn() as standin:
+            statistic_file = os.path.join(work_dir, "statistic.csv")
+            timings = json.loads(
+                run_python(
+                    ["-c", _FIRST_REQUEST, standin.base_url, statistic_file],
+                    work_dir,
+                )[1]
+            )
+        for name, seconds in zip(
+            ("import restcli", "client init", "first request", "second request"),
+            timings,
+        ):
+            print_result(name, seconds)
+
+
+BENCHMARKS = {
+    "store": bench_store,
+    "dates": bench_dates,
+    "summarize": bench_summarize,
+    "startup": bench_startup,
+}
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Migration benchmarks")
+    parser.add_argument(
+        "--bench",
+        type=str,
+        default="all",
+        help=f"which benchmark to run: all or one of {', '.join(BENCHMARKS)}",
+    )
+    parser.add_argument(
+        "--chat_history",
+        type=str,
+        default=None,
+        help="LoCoMo file to use, default is a generated synthetic file",
+    )
+    parser.add_argument("--conversations", type=int, default=10)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--messages_per_session", type=int, default=50)
+    parser.add_argument(
+        "--spill_mb", type=int, default=1, help="MessageStore spill ceiling"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    names = list(BENCHMARKS) if args.bench == "all" else [args.bench]
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"ERROR: unknown benchmark {name}", file=sys.stderr)
+            sys.exit(1)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        chat_file = args.chat_history
+        if chat_file is None:
+            chat_file = make_synthetic_locomo(
+                os.path.join(tmp_dir, "synthetic_locomo.json"),
+                conversations=args.conversations,
+                sessions=args.sessions,
+                messages_per_session=args.messages_per_session,
+            )
+        for name in names:
+            print(f"== Benchmark {name}")
+            BENCHMARKS[name](args, chat_file)
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"== Peak RSS {max_rss / 1024:.1f} MiB")
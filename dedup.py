@@ -0,0 +1,113 @@
+import hashlib
+import re
+from collections import deque
+
+_WS_RE = re.compile(r"\s+")
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize_text(text):
+    return _WS_RE.sub(" ", text).strip().lower()
+
+
+def _hash64(data):
+    digest = hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def exact_fingerprint(text):
+    """64-bit fingerprint of the whitespace/case normalized text"""
+    return _hash64(normalize_text(text))
+
+
+def simhash(text, ngram=2):
+    """64-bit SimHash over word n-gram shingles"""
+    tokens = _TOKEN_RE.findall(text.lower())
+    if len(tokens) >= ngram:
+        features = [
+            " ".join(tokens[i:i + ngram]) for i in range(len(tokens) - ngram + 1)
+        ]
+    else:
+        features = tokens
+    if not features:
+        return 0
+    weights = [0] * 64
+    for feature in features:
+        h = _hash64(feature)
+        for bit in range(64):
+            if (h >> bit) & 1:
+                weights[bit] += 1
+            else:
+                weights[bit] -= 1
+    fingerprint = 0
+    for bit in range(64):
+        if weights[bit] > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+class MessageDeduplicator:
+    """Drop exact and (optionally) near-duplicate messages.
+
+    Only 64-bit fingerprints are kept, never the message strings: a set of
+    exact fingerprints per scope, plus a bounded window of recent SimHashes
+    per scope when near-duplicate detection is enabled.
+    """
+
+    def __init__(
+        self, near=False, window=50, max_distance=10, scope="session", user_of=None
+    ):
+        if scope not in ("session", "user"):
+            raise Exception(f"Error: Invalid dedup scope: {scope}")
+        self.near = near
+        self.window = window
+        self.max_distance = max_distance
+        self.scope = scope
+        # user_of(conv_id) -> user key, one user scope per key; all one user if None
+        self.user_of = user_of
+        self.exact_seen = {}  # key: scope key, value: set of fingerprints
+        self.near_seen = {}  # key: scope key, value: deque of simhashes
+        self.total = 0
+        self.exact_removed = 0
+        self.near_removed = 0
+
+    def _scope_key(self, conv_id):
+        if self.scope == "user":
+            return None if self.user_of is None else self.user_of(conv_id)
+        return conv_id
+
+    def is_duplicate(self, text, conv_id=None):
+        key = self._scope_key(conv_id)
+        self.total += 1
+        fingerprint = exact_fingerprint(text)
+        exact_seen = self.exact_seen.setdefault(key, set())
+        if fingerprint in exact_seen:
+            self.exact_removed += 1
+            return True
+        exact_seen.add(fingerprint)
+        if self.near:
+            recent = self.near_seen.get(key)
+            if recent is None:
+                recent = deque(maxlen=self.window)
+                self.near_seen[key] = recent
+            sh = simhash(text)
+            for other in recent:
+                if (sh ^ other).bit_count() <= self.max_distance:
+                    self.near_removed += 1
+                    return True
+            recent.append(sh)
+        return False
+
+    def filter(self, messages, conv_id=None):
+        return [m for m in messages if not self.is_duplicate(m, conv_id)]
+
+    @property
+    def removed(self):
+        return self.exact_removed + self.near_removed
+
+    def report(self):
+        pct = (self.removed * 100.0 / self.total) if self.total else 0.0
+        return (
+            f"removed {self.removed} of {self.total} messages ({pct:.1f}%): "
+            f"exact={self.exact_removed} near={self.near_removed}"
+        )
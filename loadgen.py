@@ -0,0 +1,318 @@
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from restcli import MemMachineRestClient, episodic_memory_contents
+from search_cache import SearchCache
+
+_CONV_FILE_RE = re.compile(r"_conv_(\d+)\.txt$")
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def load_query_file(query_file):
+    """Read queries, one per line: plain text or {"query": ..., "session_id": ...}"""
+    queries = []
+    with open(query_file, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                item = json.loads(line)
+                queries.append((item["query"], item.get("session_id")))
+            else:
+                queries.append((line, None))
+    return queries
+
+
+def derive_queries(hacks, num_queries=1000, query_words=8, seed=0):
+    """Build queries from the leading words of randomly sampled migrated messages.
+
+    hacks are the MigrationHacks of the migrated files, each query carries
+    the session its message was migrated to, from session_for(), so file
+    identities and session map rules apply as they did in the migration.
+    """
+    rng = random.Random(seed)
+    candidates = []
+    for hack in hacks:
+        pattern = os.path.join(
+            hack.extract_dir, f"{hack.chat_base_name}_extracted_conv_*.txt"
+        )
+        for extract_file in sorted(glob.glob(pattern)):
+            match = _CONV_FILE_RE.search(extract_file)
+            if not match:
+                continue
+            session = hack.session_for(int(match.group(1)))
+            candidates.extend(_leading_words(extract_file, session, query_words))
+    if not candidates:
+        return []
+    return [rng.choice(candidates) for _ in range(num_queries)]
+
+
+def _leading_words(extract_file, session, query_words):
+    candidates = []
+    with open(extract_file, "r") as f:
+        for line in f:
+            words = line.split()
+            if words:
+                candidates.append((" ".join(words[:query_words]), session))
+    return candidates
+
+
+class SearchLoadGenerator:
+    """Open-loop search load at a target rate.
+
+    Requests are scheduled on a fixed (or Poisson) arrival timeline that
+    does not wait for earlier responses, and latency is measured from the
+    scheduled arrival time, so server slowdowns show up as queueing delay
+    instead of silently lowering the offered load.
+    """
+
+    def __init__(
+        self,
+        client,
+        queries,
+        qps=10.0,
+        duration=10.0,
+        concurrency=32,
+        limit=5,
+        arrival="poisson",
+        seed=0,
+    ):
+        if not queries:
+            raise Exception("Error: no queries for load generation")
+        if arrival not in ("poisson", "uniform"):
+            raise Exception(f"Error: Invalid arrival process: {arrival}")
+        self.client = client
+        self.queries = queries
+        self.qps = qps
+        self.duration = duration
+        self.concurrency = concurrency
+        self.limit = limit
+        self.arrival = arrival
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.latencies_ms = []  # scheduled arrival -> response
+        self.service_ms = []  # request sent -> response
+        self.result_counts = []
+        self.errors = 0
+        self.elapsed_s = 0.0
+
+    def _session(self, session):
+        """Full session envelope of a query's session or session id"""
+        if session is None or isinstance(session, dict):
+            return session
+        return dict(self.client.session, session_id=session)
+
+    def _search(self, query, scheduled):
+        query_str, session = query
+        sent = time.perf_counter()
+        count = None
+        try:
+            results = self.client.search_episodic_memory(
+                query_str, limit=self.limit, session=self._session(session)
+            )
+            count = len(episodic_memory_contents(results))
+        except Exception:
+            pass
+        done = time.perf_counter()
+        with self.lock:
+            if count is None:
+                self.errors += 1
+            else:
+                self.result_counts.append(count)
+            self.latencies_ms.append((done - scheduled) * 1000)
+            self.service_ms.append((done - sent) * 1000)
+
+    def _arrival_offset(self, i, previous):
+        """Offset in seconds of the i-th arrival from the start of the run"""
+        if self.arrival == "poisson":
+            return previous + self.rng.expovariate(self.qps)
+        return i / self.qps
+
+    def run(self):
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            start = time.perf_counter()
+            offset = 0.0
+            i = 0
+            while offset < self.duration:
+                scheduled = start + offset
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                query = self.queries[i % len(self.queries)]
+                futures.append(executor.submit(self._search, query, scheduled))
+                i += 1
+                offset = self._arrival_offset(i, offset)
+            wait(futures)
+            self.elapsed_s = time.perf_counter() - start
+        return self.report()
+
+    def report(self):
+        latencies = sorted(self.latencies_ms)
+        service = sorted(self.service_ms)
+        sent = len(latencies)
+        counts = self.result_counts
+        return {
+            "sent": sent,
+            "errors": self.errors,
+            "error_rate": self.errors / sent if sent else 0.0,
+            "offered_qps": self.qps,
+            "achieved_qps": sent / self.elapsed_s if self.elapsed_s else 0.0,
+            "latency_ms": {
+                p: percentile(latencies, p) for p in (50, 90, 99, 99.9)
+            },
+            "latency_ms_max": latencies[-1] if latencies else 0.0,
+            "service_ms": {p: percentile(service, p) for p in (50, 90, 99, 99.9)},
+            "results_avg": sum(counts) / len(counts) if counts else 0.0,
+            "results_zero": sum(1 for c in counts if c == 0),
+            "client": self.client.statistics(),
+            "cache": (
+                self.client.search_cache.statistics()
+                if getattr(self.client, "search_cache", None) is not None
+                else None
+            ),
+        }
+
+
+def print_report(report):
+    print(
+        f"== sent {report['sent']} searches, {report['errors']} errors "
+        f"({report['error_rate'] * 100:.2f}%), offered {report['offered_qps']:.1f} qps, "
+        f"achieved {report['achieved_qps']:.1f} qps"
+    )
+    for name in ("latency_ms", "service_ms"):
+        values = " ".join(f"p{p:g}={v:.1f}" for p, v in report[name].items())
+        print(f"   {name}: {values}")
+    print(f"   latency_ms max={report['latency_ms_max']:.1f}")
+    print(
+        f"   results: avg {report['results_avg']:.2f} per search, "
+        f"{report['results_zero']} searches with no results"
+    )
+    cache = report.get("cache")
+    if cache is not None:
+        print(
+            f"   cache: {cache['hits']} hits, {cache['misses']} misses "
+            f"({cache['hit_rate'] * 100:.1f}%), {cache['entries']} entries, "
+            f"{cache['bytes']} bytes, ~{cache['saved_ms_estimate']:.0f} ms saved"
+        )
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="MemMachine search load generator")
+    parser.add_argument("--base_url", type=str, default="http://127.0.0.1:8080")
+    parser.add_argument(
+        "--user_session_file", type=str, default="user_session.json"
+    )
+    parser.add_argument(
+        "--queries", type=str, default=None, help="query file, one query per line"
+    )
+    parser.add_argument(
+        "--extract_dir",
+        type=str,
+        default="extracted",
+        help="derive queries from migrated messages in this dir",
+    )
+    parser.add_argument(
+        "--chat_history",
+        type=str,
+        default="data/locomo10.json",
+        help="chat history file, dir or glob whose extracted messages are used for queries",
+    )
+    parser.add_argument(
+        "--session_map",
+        type=str,
+        default=None,
+        help="session map rules the chat history was migrated with",
+    )
+    parser.add_argument("--num_queries", type=int, default=1000)
+    parser.add_argument("--qps", type=float, default=10.0, help="target searches/sec")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--limit", type=int, default=5)
+    parser.add_argument(
+        "--arrival", type=str, default="poisson", help="poisson or uniform"
+    )
+    parser.add_argument(
+        "--cache",
+        default=False,
+        action="store_true",
+        help="enable the client side search result cache",
+    )
+    parser.add_argument("--cache_entries", type=int, default=10000)
+    parser.add_argument("--cache_mb", type=float, default=64.0)
+    parser.add_argument("--cache_ttl", type=float, default=300.0, help="seconds")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    if args.queries:
+        queries = load_query_file(args.queries)
+    else:
+        from migration import MigrationHack
+        from multi_migration import MultiFileMigration, is_multi_file
+
+        if is_multi_file(args.chat_history):
+            multi = MultiFileMigration(
+                args.chat_history,
+                user_session_file=args.user_session_file,
+                extract_dir=args.extract_dir,
+                session_map=args.session_map,
+            )
+            hacks = [multi._hack_for(f) for f in multi.chat_files()]
+        else:
+            hacks = [
+                MigrationHack(
+                    user_session_file=args.user_session_file,
+                    chat_history_file=args.chat_history,
+                    extract_dir=args.extract_dir,
+                    session_map=args.session_map,
+                )
+            ]
+        queries = derive_queries(hacks, args.num_queries)
+    if not queries:
+        print("ERROR: no queries found", file=sys.stderr)
+        sys.exit(1)
+    with open(args.user_session_file, "r") as f:
+        user_session = json.load(f)
+    search_cache = None
+    if args.cache:
+        search_cache = SearchCache(
+            max_entries=args.cache_entries,
+            max_bytes=int(args.cache_mb * 2**20),
+            ttl_s=args.cache_ttl,
+        )
+    client = MemMachineRestClient(
+        base_url=args.base_url,
+        session=user_session,
+        pool_size=args.concurrency,
+        search_cache=search_cache,
+    )
+    generator = SearchLoadGenerator(
+        client,
+        queries,
+        qps=args.qps,
+        duration=args.duration,
+        concurrency=args.concurrency,
+        limit=args.limit,
+        arrival=args.arrival,
+    )
+    print(f"== Load generation starts: {len(queries)} queries at {args.qps} qps")
+    print_report(generator.run())
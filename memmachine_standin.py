@@ -0,0 +1,124 @@
+import argparse
+import json
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class MemMachineStandIn:
+    """Local stand-in for the MemMachine episodic memory endpoints.
+
+    Episodes are kept in memory per session id, a search returns the
+    episodes of the session sharing the most words with the query. Every
+    response waits latency_ms first, to stand in for server side work.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0.0):
+        self.latency_ms = latency_ms
+        self.lock = threading.Lock()
+        self.episodes = {}  # key: session id, value: list of episode contents
+        self.requests = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def add(self, payload):
+        with self.lock:
+            self.episodes.setdefault(payload["session"]["session_id"], []).append(
+                payload["episode_content"]
+            )
+
+    def search(self, payload):
+        with self.lock:
+            episodes = list(self.episodes.get(payload["session"]["session_id"], ()))
+        words = set(_TOKEN_RE.findall(payload["query"].lower()))
+        scored = []
+        for i, content in enumerate(episodes):
+            score = len(words & set(_TOKEN_RE.findall(content.lower())))
+            if score:
+                scored.append((-score, i, content))
+        scored.sort()
+        memories = [{"content": c} for _, _, c in scored[: payload.get("limit", 5)]]
+        return {"status": 0, "content": {"episodic_memory": [memories]}}
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # headers and body go out in separate writes
+            disable_nagle_algorithm = True
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body):
+                body = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                payload = json.loads(
+                    self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                )
+                with standin.lock:
+                    standin.requests += 1
+                if standin.latency_ms:
+                    time.sleep(standin.latency_ms / 1000)
+                if self.path == "/v1/memories/episodic":
+                    standin.add(payload)
+                    return self._reply(200, {"status": 0, "content": None})
+                if self.path == "/v1/memories/episodic/search":
+                    return self._reply(200, standin.search(payload))
+                self._reply(404, {"detail": f"no route {self.path}"})
+
+        return Handler
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the MemMachine episodic memory API"
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--latency_ms", type=float, default=0.0, help="added to every response"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    standin = MemMachineStandIn(args.host, args.port, latency_ms=args.latency_ms)
+    print(f"== MemMachine stand-in listening on {standin.base_url}")
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        standin.server.server_close()
@@ -0,0 +1,289 @@
+import os
+import math
+import mmap
+import tempfile
+from array import array
+
+from process_chat_history import Message
+
+
+class SpillBuffer:
+    """Append-only byte buffer that moves its contents to disk past max_memory.
+
+    Appended bytes collect in memory; once more than max_memory bytes are
+    held they are written as one chunk to an anonymous file in spill_dir
+    and read back through a read-only memory map. Every append is a whole
+    message, so a message is either fully spilled or fully in memory.
+    """
+
+    def __init__(self, max_memory, spill_dir=None):
+        self.max_memory = max_memory
+        self.spill_dir = spill_dir
+        self.memory = bytearray()
+        self.spilled = 0
+        self.file = None
+        self.map = None
+
+    def __len__(self):
+        return self.spilled + len(self.memory)
+
+    def __iadd__(self, data):
+        self.memory += data
+        if len(self.memory) > self.max_memory:
+            self.spill()
+        return self
+
+    def spill(self):
+        if not self.memory:
+            return
+        if self.file is None:
+            if self.spill_dir:
+                os.makedirs(self.spill_dir, exist_ok=True)
+            self.file = tempfile.TemporaryFile(
+                dir=self.spill_dir, prefix="message_store_spill_"
+            )
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(self.memory)
+        self.file.flush()
+        self.spilled += len(self.memory)
+        self.memory = bytearray()
+        # the old map stays valid for readers still holding it
+        self.map = mmap.mmap(
+            self.file.fileno(), self.spilled, access=mmap.ACCESS_READ
+        )
+
+    def __getitem__(self, index):
+        start, stop = index.start, index.stop
+        if start >= self.spilled:
+            return self.memory[start - self.spilled:stop - self.spilled]
+        return self.map[start:stop]
+
+
+class ConversationView:
+    """Lazy, read-only sequence of the messages of one conversation.
+
+    Messages are decoded from the store's UTF-8 buffer only when accessed,
+    slicing returns another view without copying.
+    """
+
+    __slots__ = ("_store", "_start", "_stop")
+
+    def __init__(self, store, start, stop):
+        self._store = store
+        self._start = start
+        self._stop = stop
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __iter__(self):
+        decode = self._store._decode
+        for i in range(self._start, self._stop):
+            yield decode(i)
+
+    def records(self):
+        """Iterate Message records carrying timestamp, speaker and source id"""
+        record = self._store._record
+        for i in range(self._start, self._stop):
+            yield record(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise Exception("Error: ConversationView only supports step 1 slices")
+            stop = max(start, stop)
+            return ConversationView(
+                self._store, self._start + start, self._start + stop
+            )
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("ConversationView index out of range")
+        return self._store._decode(self._start + index)
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(
+                a == b for a, b in zip(self, other)
+            )
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return f"ConversationView({len(self)} messages)"
+
+
+class MessageStore:
+    """Compact mapping of conversation id -> messages.
+
+    All messages live in one contiguous UTF-8 bytearray with a single offsets
+    array marking message boundaries, so the per-message cost is the encoded
+    text plus 8 bytes instead of a Python str object and list slot. Message
+    metadata is kept the same way: a float timestamp (NaN when unknown), an
+    index into the interned speakers, and the source id in a second buffer.
+    Conversations are append-only: assigning a conversation id again adds a
+    new range and leaves the old bytes in place.
+
+    With max_memory > 0 both buffers are SpillBuffers: past max_memory bytes
+    each, text and source ids move to files in spill_dir and are read back
+    memory-mapped, so only the per-message arrays stay in memory.
+    """
+
+    def __init__(self, max_memory=0, spill_dir=None):
+        self._buffer = bytearray()
+        self._source_buffer = bytearray()
+        if max_memory > 0:
+            self._buffer = SpillBuffer(max_memory, spill_dir)
+            self._source_buffer = SpillBuffer(max_memory, spill_dir)
+        self._offsets = array("Q", [0])  # message i spans offsets[i]:offsets[i+1]
+        self._timestamps = array("d")
+        self._speaker_index = array("I")
+        self._speakers = [None]  # interned speakers, index 0 is unknown
+        self._speaker_ids = {None: 0}
+        self._source_offsets = array("Q", [0])
+        self._ranges = {}  # key: conversation id, value: (first, last + 1) message index
+        self._last_conv_id = None
+
+    def _decode(self, i):
+        return self._buffer[self._offsets[i]:self._offsets[i + 1]].decode("utf-8")
+
+    def _record(self, i):
+        timestamp = self._timestamps[i]
+        source_id = self._source_buffer[
+            self._source_offsets[i]:self._source_offsets[i + 1]
+        ].decode("utf-8")
+        return Message(
+            self._decode(i),
+            None if math.isnan(timestamp) else timestamp,
+            self._speakers[self._speaker_index[i]],
+            source_id or None,
+        )
+
+    def _add(self, message):
+        if isinstance(message, str):
+            text, timestamp, speaker, source_id = message, None, None, None
+        else:
+            text, timestamp, speaker, source_id = message
+        self._buffer += text.encode("utf-8")
+        self._offsets.append(len(self._buffer))
+        self._timestamps.append(math.nan if timestamp is None else float(timestamp))
+        speaker_id = self._speaker_ids.get(speaker)
+        if speaker_id is None:
+            speaker_id = len(self._speakers)
+            self._speakers.append(speaker)
+            self._speaker_ids[speaker] = speaker_id
+        self._speaker_index.append(speaker_id)
+        if source_id is not None:
+            self._source_buffer += str(source_id).encode("utf-8")
+        self._source_offsets.append(len(self._source_buffer))
+
+    def __setitem__(self, conv_id, messages):
+        start = len(self._offsets) - 1
+        for message in messages:
+            self._add(message)
+        self._ranges[conv_id] = (start, len(self._offsets) - 1)
+        self._last_conv_id = conv_id
+
+    def append(self, conv_id, message):
+        """Append a message to the most recently stored conversation"""
+        if conv_id not in self._ranges:
+            self[conv_id] = [message]
+            return
+        if conv_id != self._last_conv_id:
+            raise Exception(
+                f"Error: can only append to the last stored conversation {self._last_conv_id}"
+            )
+        start, _ = self._ranges[conv_id]
+        self._add(message)
+        self._ranges[conv_id] = (start, len(self._offsets) - 1)
+
+    def __getitem__(self, conv_id):
+        start, stop = self._ranges[conv_id]
+        return ConversationView(self, start, stop)
+
+    def __contains__(self, conv_id):
+        return conv_id in self._ranges
+
+    def __iter__(self):
+        return iter(self._ranges)
+
+    def __len__(self):
+        return len(self._ranges)
+
+    def keys(self):
+        return self._ranges.keys()
+
+    def items(self):
+        for conv_id in self._ranges:
+            yield conv_id, self[conv_id]
+
+    def total_messages(self):
+        return sum(stop - start for start, stop in self._ranges.values())
+
+    def nbytes(self):
+        """Bytes held in memory, spilled bytes are not counted"""
+        return (
+            len(getattr(self._buffer, "memory", self._buffer))
+            + len(getattr(self._source_buffer, "memory", self._source_buffer))
+            + sum(
+                a.itemsize * len(a)
+                for a in (
+                    self._offsets,
+                    self._timestamps,
+                    self._speaker_index,
+                    self._source_offsets,
+                )
+            )
+        )
+
+    def spilled_bytes(self):
+        return getattr(self._buffer, "spilled", 0) + getattr(
+            self._source_buffer, "spilled", 0
+        )
+
+
+def _meta_field(value):
+    if value is None:
+        return ""
+    return str(value).replace("\t", " ").replace("\n", " ")
+
+
+def extract_meta_file(extract_file):
+    """Metadata sidecar of an extract file, one line per extracted message"""
+    return f"{os.path.splitext(extract_file)[0]}.meta.tsv"
+
+
+def write_extract_file(extract_file, messages):
+    """Write message text lines plus a timestamp/speaker/source_id sidecar"""
+    with open(extract_file, "w") as f, open(extract_meta_file(extract_file), "w") as m:
+        for message in messages:
+            if isinstance(message, str):
+                message = Message(message, None, None, None)
+            text, timestamp, speaker, source_id = message
+            # one message per line, the cache is read back line by line
+            f.write(text.replace("\n", " ") + "\n")
+            m.write(
+                f"{_meta_field(timestamp)}\t{_meta_field(speaker)}\t"
+                f"{_meta_field(source_id)}\n"
+            )
+
+
+def read_extract_file(extract_file):
+    """Yield Message records from an extract file and its sidecar if present"""
+    meta_file = extract_meta_file(extract_file)
+    if not os.path.exists(meta_file):
+        # cache written before metadata was kept
+        with open(extract_file, "r") as f:
+            for line in f:
+                yield line.strip()
+        return
+    with open(extract_file, "r") as f, open(meta_file, "r") as m:
+        for line, meta in zip(f, m):
+            timestamp, speaker, source_id = meta.rstrip("\n").split("\t")
+            yield Message(
+                line.strip(),
+                float(timestamp) if timestamp else None,
+                speaker or None,
+                source_id or None,
+            )
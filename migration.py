@@ -2,16 +2,35 @@ import json
 import os
 import argparse
 import sys
+import threading
+import time
 
-from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from restcli import MemMachineRestClient
 from process_chat_history import locomo_count_conversations
 from process_chat_history import openai_count_conversations
 from process_chat_history import load_locomo
 from process_chat_history import load_openai
-from openai import OpenAISummary
+from process_chat_history import detect_chat_type
+from process_chat_history import new_locomo_date_stats
+from process_chat_history import OPENAI_ROLES
+from process_chat_history import OPENAI_CONTENT_TYPES
+from summarizer import SummaryBackend
+from summarizer import SUMMARY_BACKENDS
+from summarizer import make_summary_backend
+from dedup import MessageDeduplicator
+from message_store import MessageStore
+from message_store import read_extract_file
+from message_store import write_extract_file
+from profiling import StageTimer
+from profiling import print_stage_table
+from profiling import profiled
+from profiling import timed
+from session_map import SESSION_FIELDS
+from session_map import make_session_mapper
+
+# tqdm, requests (restcli) and verify are imported where they are used,
+# a dry run or a small job should not pay for them at startup
 
 
 class MigrationHack:
@@ -25,14 +44,82 @@ class MigrationHack:
         max_messages=0,
         extract_dir="extracted",
         api_key_file="api_key.json",
+        dedup=False,
+        dedup_near=False,
+        dedup_window=50,
+        dedup_distance=10,
+        dedup_scope="session",
+        identity=None,
+        client=None,
+        executor=None,
+        progress=True,
+        max_workers=10,
+        conv_filter=None,
+        checkpoint=None,
+        on_progress=None,
+        verify=False,
+        verify_samples=10,
+        verify_k=5,
+        verify_exhaustive=False,
+        openai_roles=OPENAI_ROLES,
+        openai_content_types=OPENAI_CONTENT_TYPES,
+        merge_consecutive=False,
+        openai_branches=False,
+        summarizer="openai",
+        summarizer_url=None,
+        summarizer_model=None,
+        summary_fanout=0,
+        summary_levels="top",
+        record_file=None,
+        record_bodies=False,
+        profile=False,
+        profile_interval=0.005,
+        profile_dir="output",
+        max_memory_mb=0,
+        rate_limits=None,
+        rate_limit_dir=None,
+        session_map=None,
+        shard_name=None,
     ):
         self.user_session_file = user_session_file
         with open(self.user_session_file, "r") as f:
             self.user_session = json.load(f)
+        # identity: per source file user id and session prefix in multi-file mode
+        self.identity = identity
+        if self.identity is not None:
+            self.user_session["user_id"] = [self.identity]
+        # session_map(chat_file, conv_id, session) -> session envelope of a
+        # conversation, or a session_map.SessionMapper rules list / file
+        self.session_map = make_session_mapper(session_map)
         self.base_url = base_url
-        self.client = MemMachineRestClient(
-            base_url=self.base_url, session=self.user_session, verbose=False
-        )
+        # client is created on first use, see the client property
+        self._client = client
+        # record_file: replay.TrafficRecorder file for the requests of the client
+        self.record_file = record_file
+        self.record_bodies = record_bodies
+        self.recorder = None
+        # rate_limits: rate_limit.RateLimiter rules dict or JSON file, buckets
+        # are files in rate_limit_dir when set, shared with other processes
+        self.rate_limits = rate_limits
+        self.rate_limit_dir = rate_limit_dir
+        self.client_lock = threading.Lock()
+        # shared thread pool for inserts, own pool per insert_memories() if None
+        self.executor = executor
+        self.progress = progress
+        self.max_workers = max_workers
+        # conv_filter(conv_id) -> bool selects the conversations to load
+        self.conv_filter = conv_filter
+        # shard_name: the conv_filter's shard, keeps shared work files apart
+        self.shard_name = shard_name
+        # checkpoint records how many messages of each session were posted
+        self.checkpoint = checkpoint
+        # on_progress(conv_id, n) is called after every posted message
+        self.on_progress = on_progress
+        self.verify = verify
+        self.verify_samples = verify_samples
+        self.verify_k = verify_k
+        self.verify_exhaustive = verify_exhaustive
+        self.verify_report = None
         self.chat_history_file = chat_history_file
         self.chat_type = chat_type
         self.start_time = start_time
@@ -41,30 +128,164 @@ class MigrationHack:
         self.chat_base_name = os.path.splitext(
             os.path.basename(self.chat_history_file)
         )[0]
+        if self.identity is not None:
+            self.chat_base_name = self.identity
+        self.openai_roles = tuple(openai_roles)
+        self.openai_content_types = tuple(openai_content_types)
+        self.merge_consecutive = merge_consecutive
+        self.openai_branches = openai_branches
+        if self.chat_type == "openai" and (
+            self.openai_roles != OPENAI_ROLES
+            or self.openai_content_types != OPENAI_CONTENT_TYPES
+            or self.merge_consecutive
+            or self.openai_branches
+        ):
+            # keep caches of different selections apart
+            self.chat_base_name += (
+                f"_{'-'.join(self.openai_roles)}_{'-'.join(self.openai_content_types)}"
+            )
+            if self.merge_consecutive:
+                self.chat_base_name += "_merged"
+            if self.openai_branches:
+                self.chat_base_name += "_branches"
         self.extract_dir = extract_dir
+        # max_memory_mb > 0 spills message text past this size per store to
+        # extract_dir and reads it back memory-mapped
+        self.max_memory_mb = max_memory_mb
         # list of messages in conversations loaded from file
         self.num_conversations = 0
-        self.messages = {}  # key: conversation id, value: list of messages
+        self.messages = self.new_store()  # key: conversation id, value: messages
+        # api_key.json is only read when a summarizer needs it
         self.api_key_file = api_key_file
-        with open(self.api_key_file, "r") as f:
-            self.api_key = json.load(f)["api_key"]
-        self.summaries = {}  # key: conversation id, value: list of summaries
+        self._api_key = None
+        self.summaries = self.new_store()  # key: conversation id, value: summaries
+        # summarizer: a SummaryBackend or one of SUMMARY_BACKENDS
+        self.summarizer = summarizer
+        self.summarizer_url = summarizer_url
+        self.summarizer_model = summarizer_model
+        # summary_fanout > 1 combines every summary_fanout summaries of a level
+        # into one summary of the next level, 0 keeps summaries flat
+        if summary_fanout == 1 or summary_fanout < 0:
+            raise Exception(f"Error: Invalid summary fanout: {summary_fanout}")
+        self.summary_fanout = summary_fanout
+        # summary_levels: top, all or the level numbers to insert
+        if isinstance(summary_levels, str) and summary_levels not in ("top", "all"):
+            summary_levels = tuple(int(l) for l in summary_levels.split(",") if l)
+        self.summary_levels = summary_levels
+        self.summary_tree = {}  # key: level, value: MessageStore of summaries
+        # conversations with a failed summary, left out of the insert
+        self.summary_failed = set()
+        # wall / cpu time per stage, always on; profile adds stack sampling
+        self.timer = StageTimer()
+        self.profile = profile
+        self.profile_interval = profile_interval
+        self.profile_dir = profile_dir
+        self.dedup = dedup
+        self.dedup_near = dedup_near
+        self.dedup_window = dedup_window
+        self.dedup_distance = dedup_distance
+        self.dedup_scope = dedup_scope
+
+    def new_store(self):
+        return MessageStore(
+            max_memory=int(self.max_memory_mb * 2**20), spill_dir=self.extract_dir
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self.client_lock:
+                if self._client is None:
+                    from restcli import MemMachineRestClient
+
+                    if self.record_file:
+                        from replay import TrafficRecorder
+
+                        self.recorder = TrafficRecorder(
+                            self.record_file, bodies=self.record_bodies
+                        )
+                    from rate_limit import make_rate_limiter
+
+                    self._client = MemMachineRestClient(
+                        base_url=self.base_url,
+                        session=self.user_session,
+                        verbose=False,
+                        recorder=self.recorder,
+                        rate_limiter=make_rate_limiter(
+                            self.rate_limits, self.rate_limit_dir
+                        ),
+                    )
+        return self._client
 
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    @property
+    def api_key(self):
+        if self._api_key is None:
+            with open(self.api_key_file, "r") as f:
+                self._api_key = json.load(f)["api_key"]
+        return self._api_key
+
+    def index_file(self):
+        return os.path.join(self.extract_dir, f"{self.chat_base_name}_index.json")
+
+    @timed("load.count")
+    def count_conversations(self):
+        """Number of conversations in the chat history file.
+
+        The count is kept in a small index file in extract_dir, keyed on the
+        chat file size and mtime, so later runs and dry runs skip parsing the
+        whole file just to count.
+        """
+        stat = os.stat(self.chat_history_file)
+        fingerprint = [stat.st_size, stat.st_mtime_ns]
+        index_file = self.index_file()
+        try:
+            with open(index_file, "r") as f:
+                index = json.load(f)
+            if (
+                index["fingerprint"] == fingerprint
+                and index["chat_type"] == self.chat_type
+            ):
+                return index["conversations"]
+        except (OSError, ValueError, KeyError, TypeError):
+            # missing or unreadable index: count again
+            pass
+        if self.chat_type == "locomo":
+            conv_count = locomo_count_conversations(
+                self.chat_history_file, verbose=False
+            )
+        elif self.chat_type == "openai":
+            conv_count = openai_count_conversations(
+                self.chat_history_file, verbose=False
+            )
+        else:
+            raise Exception(f"Error: Invalid chat type: {self.chat_type}")
+        os.makedirs(self.extract_dir, exist_ok=True)
+        # sharded workers count at the same time, readers never see a partial index
+        tmp_file = f"{index_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(
+                {
+                    "chat_history_file": self.chat_history_file,
+                    "chat_type": self.chat_type,
+                    "fingerprint": fingerprint,
+                    "conversations": conv_count,
+                },
+                f,
+            )
+        os.replace(tmp_file, index_file)
+        return conv_count
+
+    @timed("load")
     def load(self):
         total_messages = 0
         if self.chat_history_file is not None:
             print(f"-> loading chat history file {self.chat_history_file}")
             print("-> counting conversations...")
-            if self.chat_type == "locomo":
-                conv_count = locomo_count_conversations(
-                    self.chat_history_file, verbose=False
-                )
-            elif self.chat_type == "openai":
-                conv_count = openai_count_conversations(
-                    self.chat_history_file, verbose=False
-                )
-            else:
-                raise Exception(f"Error: Invalid chat type: {self.chat_type}")
+            conv_count = self.count_conversations()
             print(
                 f"-> loaded {conv_count} conversations from {self.chat_type} file {self.chat_history_file}"
             )
@@ -73,129 +294,447 @@ class MigrationHack:
         os.makedirs(self.extract_dir, exist_ok=True)
         # Create the extract file name with timestamp
         extract_file_prefix = f"{self.chat_base_name}_extracted"
+        # per load, concurrent loads of other files keep their own counts
+        date_stats = new_locomo_date_stats()
         for conv_id in range(1, self.num_conversations + 1):
+            if self.conv_filter is not None and not self.conv_filter(conv_id):
+                continue
             extract_file = f"{extract_file_prefix}_conv_{conv_id}.txt"
             extract_file = os.path.join(self.extract_dir, extract_file)
             if os.path.exists(extract_file):
                 print(f"== Extract file {extract_file} already cached, load from file")
-                messages = []
-                with open(extract_file, "r") as f:
-                    for line in f:
-                        messages.append(line.strip())
-                self.messages[conv_id] = messages
+                with self.timer.stage("load.cache_read"):
+                    self.messages[conv_id] = read_extract_file(extract_file)
             else:
                 print(f"---> loading messages from conversation {conv_id}...")
-                if self.chat_type == "locomo":
-                    messages = load_locomo(
-                        self.chat_history_file,
-                        start_time=0,
-                        conv_num=conv_id,
-                        max_messages=0,
-                        verbose=False,
-                    )
-                elif self.chat_type == "openai":
-                    messages = load_openai(
-                        self.chat_history_file,
-                        start_time=0,
-                        conv_num=conv_id,
-                        max_messages=0,
-                        verbose=False,
-                    )
-                else:
-                    raise Exception(f"Error: Invalid chat type: {self.chat_type}")
+                with self.timer.stage("load.parse"):
+                    if self.chat_type == "locomo":
+                        messages = load_locomo(
+                            self.chat_history_file,
+                            start_time=0,
+                            conv_num=conv_id,
+                            max_messages=0,
+                            verbose=False,
+                            records=True,
+                            date_stats=date_stats,
+                        )
+                    elif self.chat_type == "openai":
+                        messages = load_openai(
+                            self.chat_history_file,
+                            start_time=0,
+                            conv_num=conv_id,
+                            max_messages=0,
+                            verbose=False,
+                            records=True,
+                            roles=self.openai_roles,
+                            content_types=self.openai_content_types,
+                            merge_consecutive=self.merge_consecutive,
+                            branches=self.openai_branches,
+                        )
+                    else:
+                        raise Exception(f"Error: Invalid chat type: {self.chat_type}")
                 print(
                     f"---> loaded {len(messages)} messages from conversation {conv_id}"
                 )
                 total_messages += len(messages)
                 self.messages[conv_id] = messages
-                with open(extract_file, "w") as f:
-                    # Write each message line by line to the extract file
-                    for message in self.messages[conv_id]:
-                        f.write(message + "\n")
+                # Write each message line by line to the extract file
+                with self.timer.stage("load.cache_write"):
+                    write_extract_file(extract_file, messages)
+        if date_stats["failed"] or date_stats["missing"]:
+            print(
+                f"-> WARNING: session dates failed={date_stats['failed']} missing={date_stats['missing']}, those messages have no timestamp"
+            )
+
+    @timed("dedup")
+    def dedup_messages(self):
+        print("== Deduplicating messages starts")
+        users = {}  # key: conversation id, value: user scope key
+        if self.dedup_scope == "user":
+            # mapped once per conversation, the deduplicator asks per message
+            users = {
+                conv_id: json.dumps(self.session_for(conv_id)["user_id"])
+                for conv_id in self.messages
+            }
+        deduplicator = MessageDeduplicator(
+            near=self.dedup_near,
+            window=self.dedup_window,
+            max_distance=self.dedup_distance,
+            scope=self.dedup_scope,
+            user_of=users.get,
+        )
+        deduped = self.new_store()
+        for conv_id, messages in self.messages.items():
+            deduped[conv_id] = (
+                m
+                for m in messages.records()
+                if not deduplicator.is_duplicate(m.text, conv_id)
+            )
+        self.messages = deduped
+        print(f"== Deduplicating messages done, {deduplicator.report()}")
+        return deduplicator
+
+    def summary_backend(self):
+        if isinstance(self.summarizer, SummaryBackend):
+            return self.summarizer
+        # only the OpenAI backends need api_key.json, compatible uses it if present
+        api_key = None
+        if self.summarizer in ("openai", "batch"):
+            api_key = self.api_key
+        elif self.summarizer == "compatible" and os.path.exists(self.api_key_file):
+            api_key = self.api_key
+        return make_summary_backend(
+            self.summarizer,
+            api_key=api_key,
+            base_url=self.summarizer_url,
+            model=self.summarizer_model,
+        )
 
+    def summarized_file_prefix(self, backend):
+        prefix = f"{self.chat_base_name}_summarized"
+        if backend.name != "openai":
+            # keep summaries of different backends apart
+            prefix += f"_{backend.name}"
+        return prefix
+
+    @timed("summarize")
     def summarize_messages(self, summarize_every=20):
         print("== Summarizing messages starts")
-        if not self.api_key:
-            raise Exception("Error: API key not found, please configure api_key.json")
-        openai_summary = OpenAISummary(api_key=self.api_key)
+        backend = self.summary_backend()
+        self.summary_failed = set()
 
-        summarized_file_prefix = f"{self.chat_base_name}_summarized"
-        batch_num = 1
+        summarized_file_prefix = self.summarized_file_prefix(backend)
+        # (conversation id, summarized file, batch count or None if cached)
+        plan = []
         for conv_id in self.messages:
-            messages = self.messages[conv_id]
             summarized_file = f"{summarized_file_prefix}_conv_{conv_id}.txt"
             summarized_file = os.path.join(self.extract_dir, summarized_file)
             if os.path.exists(summarized_file):
+                plan.append((conv_id, summarized_file, None))
+            else:
+                num_batches = -(-len(self.messages[conv_id]) // summarize_every)
+                plan.append((conv_id, summarized_file, num_batches))
+
+        def pending_batches():
+            for conv_id, _, num_batches in plan:
+                if num_batches is None:
+                    continue
+                messages = self.messages[conv_id]
+                for n in range(num_batches):
+                    i = n * summarize_every
+                    batch = messages[i:i + summarize_every]
+                    yield f"conv-{conv_id}-batch-{n + 1}", "\n".join(batch)
+
+        # summaries come back lazily in batch order, cached as they arrive
+        job_name = f"{summarized_file_prefix}_batch"
+        if self.shard_name:
+            # one batch job per shard, shards summarize different conversations
+            job_name += f"_{self.shard_name}"
+        results = backend.summarize_all(
+            pending_batches(), job_name=os.path.join(self.extract_dir, job_name)
+        )
+        for conv_id, summarized_file, num_batches in plan:
+            if num_batches is None:
                 print(
                     f"== Summarized file {summarized_file} already cached, load from file"
                 )
-                if conv_id not in self.summaries or self.summaries[conv_id] is None:
-                    self.summaries[conv_id] = []
-                with open(summarized_file, "r") as f:
-                    for line in f:
-                        summary = line.strip()
-                        if summary:
-                            self.summaries[conv_id].append(summary)
-            else:
+                with self.timer.stage("summarize.cache_read"), open(
+                    summarized_file, "r"
+                ) as f:
+                    self.summaries[conv_id] = (
+                        summary for summary in (line.strip() for line in f) if summary
+                    )
+                continue
+            summaries = []
+            for _ in range(num_batches):
+                with self.timer.stage("summarize.backend"):
+                    summaries.append(next(results))
+            if not all(summaries):
+                # a partial cache file would hide the failed batches from a rerun
+                failed = sum(1 for summary in summaries if not summary)
+                print(
+                    f"-> WARNING: conv {conv_id}: {failed} of {num_batches} summaries failed, not cached or inserted, rerun to resubmit"
+                )
+                self.summary_failed.add(conv_id)
                 self.summaries[conv_id] = []
-                for i in range(0, len(messages), summarize_every):
-                    batch = messages[i:i + summarize_every]
-                    batch_text = "\n".join(batch)
-                    summary = ""
-                    try:
-                        # Get summary from OpenAI
-                        response = openai_summary.summarize(batch_text)
-                        if "choices" in response and len(response["choices"]) > 0:
-                            summary = response["choices"][0]["message"]["content"]
-                        else:
-                            print(f"Error: No summary generated for batch {batch_num}")
-                            print(f"Response: {response}")
-                    except Exception as e:
-                        print(f"Error processing batch {batch_num}: {e}")
-                    if summary:
-                        self.summaries[conv_id].append(summary)
-                        with open(summarized_file, "a") as f:
-                            text = summary.replace("\n", "")
-                            f.write(text + "\n")
-                    batch_num += 1
+                continue
+            self.summaries[conv_id] = summaries
+            with self.timer.stage("summarize.cache_write"):
+                self._write_summaries(
+                    summarized_file, (s.replace("\n", "") for s in summaries)
+                )
         print("== Summarizing messages done")
+        if self.summary_fanout:
+            self.summarize_hierarchy(backend)
+
+    def _write_summaries(self, summarized_file, summaries):
+        """Write a summary cache file whole or not at all"""
+        tmp_file = f"{summarized_file}.tmp"
+        with open(tmp_file, "w") as f:
+            f.writelines(summary + "\n" for summary in summaries)
+        os.replace(tmp_file, summarized_file)
+
+    @timed("summarize.hierarchy.group")
+    def _summarize_group(self, backend, conv_id, level, group):
+        if len(group) == 1:
+            # a lone summary moves up a level unchanged
+            return group[0]
+        try:
+            return backend.summarize("\n".join(group)).replace("\n", " ")
+        except Exception as e:
+            print(f"Error summarizing conv {conv_id} level {level}: {e}")
+            return None
+
+    @timed("summarize.hierarchy")
+    def summarize_hierarchy(self, backend):
+        """Map-reduce the batch summaries into session and conversation summaries.
+
+        Level 1 holds the batch summaries, every summary_fanout summaries of a
+        level are summarized into one summary of the next level until each
+        conversation is down to a single summary. All groups of a level are
+        summarized in parallel and each level is cached per conversation.
+        """
+        print(f"== Hierarchical summarizing starts, fanout={self.summary_fanout}")
+        summarized_file_prefix = (
+            f"{self.summarized_file_prefix(backend)}_f{self.summary_fanout}"
+        )
+        self.summary_tree = {1: self.summaries}
+        level = 1
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            while True:
+                below = self.summary_tree[level]
+                conv_ids = [conv_id for conv_id in below if len(below[conv_id]) > 1]
+                if not conv_ids:
+                    break
+                level += 1
+                store = self.new_store()
+                futures = {}  # key: conversation id, value: group summary futures
+                for conv_id in conv_ids:
+                    summarized_file = os.path.join(
+                        self.extract_dir,
+                        f"{summarized_file_prefix}_L{level}_conv_{conv_id}.txt",
+                    )
+                    if os.path.exists(summarized_file):
+                        with open(summarized_file, "r") as f:
+                            futures[conv_id] = [line.strip() for line in f]
+                        continue
+                    summaries = list(below[conv_id])
+                    futures[conv_id] = [
+                        executor.submit(
+                            self._summarize_group,
+                            backend,
+                            conv_id,
+                            level,
+                            summaries[i:i + self.summary_fanout],
+                        )
+                        for i in range(0, len(summaries), self.summary_fanout)
+                    ]
+                for conv_id, results in futures.items():
+                    summaries = [
+                        r if isinstance(r, str) else r.result() for r in results
+                    ]
+                    if not all(summaries):
+                        # no level file and no levels above an incomplete level
+                        print(
+                            f"-> WARNING: conv {conv_id}: level {level} summary failed, not cached or inserted, rerun to resubmit"
+                        )
+                        self.summary_failed.add(conv_id)
+                        continue
+                    store[conv_id] = summaries
+                    summarized_file = os.path.join(
+                        self.extract_dir,
+                        f"{summarized_file_prefix}_L{level}_conv_{conv_id}.txt",
+                    )
+                    if not os.path.exists(summarized_file):
+                        self._write_summaries(summarized_file, summaries)
+                self.summary_tree[level] = store
+                print(
+                    f"== Level {level}: {store.total_messages()} summaries of {len(store)} conversations"
+                )
+        print(f"== Hierarchical summarizing done, {level} levels")
+
+    def insert_contents(self, summary=False):
+        """List of (summary level, MessageStore) to insert, level None for flat"""
+        if not summary:
+            return [(None, self.messages)]
+        if not self.summary_tree:
+            return [(None, self.summaries)]
+        tree = self.summary_tree
+        if self.summary_failed:
+            # conversations with a failed level are not inserted at any level
+            tree = {}
+            for level, store in self.summary_tree.items():
+                tree[level] = self.new_store()
+                for conv_id in store:
+                    if conv_id not in self.summary_failed:
+                        tree[level][conv_id] = store[conv_id]
+        if self.summary_levels == "all":
+            return sorted(tree.items())
+        if self.summary_levels != "top":
+            return [
+                (level, tree[level])
+                for level in self.summary_levels
+                if level in tree
+            ]
+        # top: the single summary each conversation ends with
+        top = {}
+        for level, store in sorted(tree.items()):
+            for conv_id in store:
+                top[conv_id] = level
+        contents = []
+        for level, store in sorted(tree.items()):
+            conv_ids = [conv_id for conv_id in store if top[conv_id] == level]
+            if conv_ids:
+                top_store = self.new_store()
+                for conv_id in conv_ids:
+                    top_store[conv_id] = store[conv_id]
+                contents.append((level, top_store))
+        return contents
+
+    def content_name(self, summarize=False, summarize_every=20):
+        """Name of what insert_contents() yields with these options.
+
+        Like the extract and summary caches it covers every option that
+        changes the messages, so checkpoints keyed on it are never reused
+        by a run inserting different content.
+        """
+        name = self.chat_base_name
+        if self.dedup:
+            name += f"_dedup-{self.dedup_scope}"
+            if self.dedup_near:
+                name += f"-near-{self.dedup_window}-{self.dedup_distance}"
+        if not summarize:
+            return f"{name}_messages"
+        summarizer = getattr(self.summarizer, "name", self.summarizer)
+        name += f"_summarized_{summarizer}_{summarize_every}"
+        if self.summary_fanout:
+            levels = self.summary_levels
+            if not isinstance(levels, str):
+                levels = "-".join(str(level) for level in levels)
+            name += f"_f{self.summary_fanout}_{levels}"
+        return name
+
+    def checkpoint_key(self, conv_id, level=None):
+        session_id = self.session_for(conv_id)["session_id"]
+        if level is None:
+            return session_id
+        return f"{session_id}_L{level}"
 
-    def _process_conversation(self, conv_id, messages):
+    def session_for(self, conv_id):
+        """Session envelope used for the memories of one conversation"""
+        session_id = f"conversation_{conv_id}"
+        if self.identity is not None:
+            session_id = f"{self.identity}_{session_id}"
+        session = dict(self.user_session, session_id=session_id)
+        if self.session_map is not None:
+            session = self.session_map(self.chat_history_file, conv_id, session)
+            missing = [f for f in SESSION_FIELDS if not session.get(f)]
+            if missing:
+                raise Exception(
+                    f"Error: session map left {', '.join(missing)} empty for conversation {conv_id}"
+                )
+        return session
+
+    def episode_for(self, record, session=None):
+        """producer, produced_for and metadata for one Message record"""
+        _, timestamp, speaker, source_id = record
+        if speaker is None:
+            # client defaults
+            return None, None, {}
+        if session is None:
+            session = self.user_session
+        user = session["user_id"]
+        agent = session["agent_id"]
+        user = user[0] if isinstance(user, list) else user
+        agent = agent[0] if isinstance(agent, list) else agent
+        if speaker == "user":
+            producer, produced_for = user, agent
+        elif speaker in ("assistant", "tool", "system"):
+            producer, produced_for = agent, user
+        else:
+            # locomo speakers are people's names
+            producer, produced_for = speaker, agent
+        metadata = {"speaker": speaker}
+        if timestamp is not None:
+            metadata["timestamp"] = timestamp
+        if source_id is not None:
+            metadata["source_id"] = source_id
+        return producer, produced_for, metadata
+
+    @timed("insert.conversation")
+    def _process_conversation(self, conv_id, messages, level=None):
         """Process a single conversation with its own progress bar"""
+        from tqdm import tqdm
+
+        session = self.session_for(conv_id)
+        checkpoint_key = self.checkpoint_key(conv_id, level)
+        start = 0
+        if self.checkpoint is not None:
+            # resume after the messages posted before a restart
+            start = self.checkpoint.offset(checkpoint_key)
+            messages = messages[start:]
         # Create a progress bar for this conversation
         pos = conv_id - 1
         msg_pbar = tqdm(
-            messages, desc=f"Conv {conv_id}", unit="msg", position=pos, leave=True
+            messages.records(),
+            total=len(messages),
+            desc=f"Conv {conv_id}",
+            unit="msg",
+            position=pos,
+            leave=True,
+            disable=not self.progress,
         )
-        for message in msg_pbar:
-            # TODO: insert messages into episodic memory
-            self.client.post_episodic_memory(
-                message, session_id=f"conversation_{conv_id}"
-            )
+        for posted, record in enumerate(msg_pbar, start + 1):
+            producer, produced_for, metadata = self.episode_for(record, session)
+            if level is not None:
+                metadata = dict(metadata, summary_level=level)
+            with self.timer.stage("insert.post"):
+                self.client.post_episodic_memory(
+                    record.text,
+                    session=session,
+                    producer=producer,
+                    produced_for=produced_for,
+                    metadata=metadata,
+                )
+            if self.checkpoint is not None:
+                with self.timer.stage("insert.checkpoint"):
+                    self.checkpoint.update(checkpoint_key, posted)
+            if self.on_progress is not None:
+                self.on_progress(conv_id, 1)
 
         msg_pbar.close()
+        if self.checkpoint is not None:
+            self.checkpoint.flush()
         return conv_id, len(messages)
 
+    @timed("insert")
     def insert_memories(self, summary=False):
         print(f"--- Inserting memories starts, summary={summary}")
+        from tqdm import tqdm
 
         # Process conversations concurrently using ThreadPoolExecutor
-        with ThreadPoolExecutor(
-            max_workers=min(self.num_conversations, 10)
-        ) as executor:
-            if summary:
-                contents = self.summaries
-            else:
-                contents = self.messages
+        executor = self.executor
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=max(1, min(self.num_conversations, self.max_workers))
+            )
+        try:
+            contents = self.insert_contents(summary)
             # Submit all conversation processing tasks
             future_to_conv = {
-                executor.submit(self._process_conversation, conv_id, messages): conv_id
-                for conv_id, messages in contents.items()
+                executor.submit(
+                    self._process_conversation, conv_id, messages, level
+                ): conv_id
+                for level, store in contents
+                for conv_id, messages in store.items()
             }
 
             # Create a progress bar for completed conversations
             completed_pbar = tqdm(
-                total=len(contents), desc="Completed conversations", unit="conv"
+                total=len(future_to_conv),
+                desc="Completed conversations",
+                unit="conv",
+                disable=not self.progress,
             )
 
             # Process completed tasks
@@ -207,31 +746,140 @@ class MigrationHack:
                 completed_pbar.update(1)
 
             completed_pbar.close()
+        finally:
+            if executor is not self.executor:
+                executor.shutdown()
 
         print("--- Inserting memories done")
 
+    @timed("verify")
+    def verify_memories(self, summary=False):
+        print(f"--- Verifying memories starts, summary={summary}")
+        from verify import MigrationVerifier
+        from verify import print_report as print_verify_report
+
+        verifier = MigrationVerifier(
+            self.client,
+            self.session_for,
+            k=self.verify_k,
+            samples_per_conversation=self.verify_samples,
+            exhaustive=self.verify_exhaustive,
+            concurrency=self.max_workers,
+        )
+        start = time.perf_counter()
+        for _, contents in self.insert_contents(summary):
+            verifier.run(contents)
+        self.verify_report = verifier.report(time.perf_counter() - start)
+        print_verify_report(self.verify_report)
+        report_file = os.path.splitext(self.client.statistic_file)[0]
+        report_file = f"{report_file}_{self.chat_base_name}_verify.json"
+        os.makedirs(os.path.dirname(report_file) or ".", exist_ok=True)
+        with open(report_file, "w") as f:
+            json.dump(self.verify_report, f, indent=2)
+        print(f"--- Verifying memories done, report in {report_file}")
+        return self.verify_report
+
+    def profiling(self, name):
+        """Context sampling all thread stacks while profile is on"""
+        return profiled(
+            name,
+            profile_dir=self.profile_dir,
+            interval=self.profile_interval,
+            timer=self.timer,
+            enabled=self.profile,
+        )
+
+    def close(self):
+        """Flush and close the request recording of the client created here"""
+        if self.recorder is not None:
+            # later requests of the client are no longer recorded
+            self._client.recorder = None
+            self.recorder.close()
+            self.recorder = None
+
     def migrate(self, summarize=False, summarize_every=20):
-        print("== Loading starts")
-        self.load()
-        print("== Loading done")
-        if summarize:
-            print("== Summarizing starts")
-            self.summarize_messages(summarize_every)
-            print("== Summarizing done")
-        print("== Migration starts")
-        self.insert_memories(summarize)
-        print("== Migration done")
+        try:
+            with self.profiling(self.chat_base_name):
+                print("== Loading starts")
+                self.load()
+                print("== Loading done")
+                if self.dedup:
+                    self.dedup_messages()
+                if summarize:
+                    print("== Summarizing starts")
+                    self.summarize_messages(summarize_every)
+                    print("== Summarizing done")
+                print("== Migration starts")
+                self.insert_memories(summarize)
+                print("== Migration done")
+                if self.verify:
+                    self.verify_memories(summarize)
+        finally:
+            self.close()
+        print_stage_table(
+            self.timer.report(), f"Stage timings of {self.chat_base_name}"
+        )
 
 
 def usage():
     print(
-        "Usage: python migration.py [--base_url <url>] [--chat_history <file>] [--summarize] [--summarize_every <n>]"
+        "Usage: python migration.py [--base_url <url>] [--chat_history <file|dir|glob>] [--chat_type <auto|locomo|openai>] [--summarize] [--summarize_every <n>]"
     )
+    print(
+        "       [--summarizer <openai|batch|compatible|extractive>] [--summarizer_url <url>] [--summarizer_model <model>]"
+    )
+    print("       [--summary_fanout <n>] [--summary_levels <top|all|1,2,...>]")
+    print("       [--record <file>] [--record_bodies] [--profile] [--profile_dir <dir>]")
+    print("       [--max_memory_mb <n>] [--rate_limits <file>] [--rate_limit_dir <dir>]")
+    print("       [--session_map <file>]")
+    print(
+        "       [--dedup] [--dedup_near] [--dedup_window <n>] [--dedup_distance <n>] [--dedup_scope <session|user>] [--max_files <n>] [--max_workers <n>]"
+    )
+    print("       [--workers <n> [--shard <i>] [--checkpoint_dir <dir>]] [--how_many_conversations]")
+    print(
+        "       [--verify] [--verify_samples <n>] [--verify_k <k>] [--verify_exhaustive]"
+    )
+    print("       [--roles <r1,r2>] [--content_types <t1,t2>] [--merge_consecutive] [--branches]")
     print("")
     print("base_url: Base URL of the MemMachine API")
-    print("chat_history: Chat history file")
+    print("chat_history: Chat history file, or a directory / glob of files")
+    print("chat_type: locomo, openai or auto to detect from the file")
     print("summarize: Summarize messages")
     print("summarize_every: Summarize every n messages")
+    print(f"summarizer: Summary backend: {', '.join(SUMMARY_BACKENDS)}")
+    print("summarizer_url: Base URL of an OpenAI compatible summary endpoint")
+    print("summarizer_model: Model name for the summary endpoint")
+    print("summary_fanout: Summarize every n summaries again up to one per conversation")
+    print("summary_levels: Summary levels to insert with --summary_fanout")
+    print("dedup: Drop exact duplicate messages before insertion")
+    print("dedup_near: Also drop near-duplicate messages (SimHash)")
+    print("dedup_window: Number of recent messages compared for near-duplicates")
+    print("dedup_distance: Max SimHash bit distance counted as near-duplicate")
+    print("dedup_scope: Deduplicate per session or per user")
+    print("max_files: Files migrated concurrently in directory / glob mode")
+    print("max_workers: Concurrent conversation inserts")
+    print(
+        "workers: Shard conversations over this many worker processes, single file only"
+    )
+    print("shard: With --workers, run (or restart) only this shard")
+    print("checkpoint_dir: Per shard checkpoint files for --workers")
+    print("how_many_conversations: Dry run, print the conversation count and exit")
+    print("record: Record the MemMachine request stream for replay.py")
+    print("record_bodies: Record full request payloads instead of digests")
+    print("profile: Sample thread stacks and write flamegraph folded stacks")
+    print("profile_dir: Directory of the --profile output")
+    print("max_memory_mb: Spill message text past this many MiB per store to disk")
+    print("rate_limits: JSON rules of requests/s and bytes/s per endpoint, group_id, user_id")
+    print("rate_limit_dir: Share rate limit buckets through files in this directory")
+    print("session_map: JSON rules mapping source files / conversations to sessions")
+    print("verify: Search back migrated messages and report hit-rate@k")
+    print("verify_samples: Messages sampled per conversation for --verify")
+    print("verify_k: Search result limit k for --verify")
+    print("verify_exhaustive: Verify every message instead of a sample")
+    print("roles: OpenAI author roles to load: user,assistant,tool")
+    print("content_types: OpenAI content types to load: text,code,multimodal_text")
+    print("merge_consecutive: Merge consecutive same role OpenAI messages")
+    print("branches: Also load edited / regenerated OpenAI branches")
 
 
 def get_args():
@@ -249,7 +897,10 @@ def get_args():
         help="Chat history file",
     )
     parser.add_argument(
-        "--chat_type", type=str, default="locomo", help="Chat type: locomo or openai"
+        "--chat_type",
+        type=str,
+        default="auto",
+        help="Chat type: auto, locomo or openai",
     )
     parser.add_argument(
         "--start_time",
@@ -266,11 +917,203 @@ def get_args():
     parser.add_argument(
         "--summarize_every", type=int, default=20, help="Summarize every n messages"
     )
+    parser.add_argument(
+        "--dedup",
+        default=False,
+        action="store_true",
+        help="Drop exact duplicate messages before insertion",
+    )
+    parser.add_argument(
+        "--dedup_near",
+        default=False,
+        action="store_true",
+        help="Also drop near-duplicate messages (SimHash)",
+    )
+    parser.add_argument(
+        "--dedup_window",
+        type=int,
+        default=50,
+        help="Number of recent messages compared for near-duplicates",
+    )
+    parser.add_argument(
+        "--dedup_distance",
+        type=int,
+        default=10,
+        help="Max SimHash bit distance counted as near-duplicate",
+    )
+    parser.add_argument(
+        "--dedup_scope",
+        type=str,
+        default="session",
+        choices=["session", "user"],
+        help="Deduplicate per session or per user",
+    )
+    parser.add_argument(
+        "--max_files",
+        type=int,
+        default=4,
+        help="Files migrated concurrently in directory / glob mode",
+    )
+    parser.add_argument(
+        "--max_workers", type=int, default=10, help="Concurrent conversation inserts"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Shard conversations over this many worker processes",
+    )
+    parser.add_argument(
+        "--shard",
+        type=int,
+        default=None,
+        help="With --workers, run (or restart) only this shard",
+    )
+    parser.add_argument(
+        "--checkpoint_dir",
+        type=str,
+        default="checkpoints",
+        help="Per shard checkpoint files for --workers",
+    )
+    parser.add_argument(
+        "--verify",
+        default=False,
+        action="store_true",
+        help="Search back migrated messages and report hit-rate@k",
+    )
+    parser.add_argument(
+        "--verify_samples",
+        type=int,
+        default=10,
+        help="Messages sampled per conversation for --verify",
+    )
+    parser.add_argument(
+        "--verify_k", type=int, default=5, help="Search result limit k for --verify"
+    )
+    parser.add_argument(
+        "--verify_exhaustive",
+        default=False,
+        action="store_true",
+        help="Verify every message instead of a sample",
+    )
+    parser.add_argument(
+        "--roles",
+        type=str,
+        default=",".join(OPENAI_ROLES),
+        help="OpenAI author roles to load: user,assistant,tool",
+    )
+    parser.add_argument(
+        "--content_types",
+        type=str,
+        default=",".join(OPENAI_CONTENT_TYPES),
+        help="OpenAI content types to load: text,code,multimodal_text",
+    )
+    parser.add_argument(
+        "--merge_consecutive",
+        default=False,
+        action="store_true",
+        help="Merge consecutive same role OpenAI messages",
+    )
+    parser.add_argument(
+        "--branches",
+        default=False,
+        action="store_true",
+        help="Also load edited / regenerated OpenAI branches",
+    )
+    parser.add_argument(
+        "--summarizer",
+        type=str,
+        default="openai",
+        help=f"Summary backend: {', '.join(SUMMARY_BACKENDS)}",
+    )
+    parser.add_argument(
+        "--summarizer_url",
+        type=str,
+        default=None,
+        help="Base URL of an OpenAI compatible summary endpoint",
+    )
+    parser.add_argument(
+        "--summarizer_model",
+        type=str,
+        default=None,
+        help="Model name for the summary endpoint",
+    )
+    parser.add_argument(
+        "--summary_fanout",
+        type=int,
+        default=0,
+        help="Summarize every n summaries again up to one per conversation",
+    )
+    parser.add_argument(
+        "--summary_levels",
+        type=str,
+        default="top",
+        help="Summary levels to insert with --summary_fanout",
+    )
+    parser.add_argument(
+        "--record",
+        type=str,
+        default=None,
+        help="Record the MemMachine request stream for replay.py",
+    )
+    parser.add_argument(
+        "--record_bodies",
+        default=False,
+        action="store_true",
+        help="Record full request payloads instead of digests",
+    )
+    parser.add_argument(
+        "--profile",
+        default=False,
+        action="store_true",
+        help="Sample thread stacks and write flamegraph folded stacks",
+    )
+    parser.add_argument(
+        "--profile_dir",
+        type=str,
+        default="output",
+        help="Directory of the --profile output",
+    )
+    parser.add_argument(
+        "--max_memory_mb",
+        type=float,
+        default=0,
+        help="Spill message text past this many MiB per store to disk",
+    )
+    parser.add_argument(
+        "--rate_limits",
+        type=str,
+        default=None,
+        help="JSON rules of requests/s and bytes/s per endpoint, group_id, user_id",
+    )
+    parser.add_argument(
+        "--rate_limit_dir",
+        type=str,
+        default=None,
+        help="Share rate limit buckets through files in this directory",
+    )
+    parser.add_argument(
+        "--session_map",
+        type=str,
+        default=None,
+        help="JSON rules mapping source files / conversations to sessions",
+    )
+    parser.add_argument(
+        "--how_many_conversations",
+        default=False,
+        action="store_true",
+        help="Dry run, print the conversation count and exit",
+    )
     parser.add_argument("-h", "--help", action="store_true", help="Print usage")
     args = parser.parse_args()
     if args.help:
         usage()
         sys.exit(0)
+    from multi_migration import is_multi_file
+
+    if args.workers > 0 and is_multi_file(args.chat_history):
+        # sharding splits the conversations of one file over processes
+        parser.error("--workers needs a single --chat_history file")
     return args
 
 
@@ -284,6 +1127,98 @@ if __name__ == "__main__":
     # use summarized messages when summarize is true
     summarize = args.summarize
     summarize_every = args.summarize_every
+    stage_kwargs = dict(
+        dedup=args.dedup or args.dedup_near,
+        dedup_near=args.dedup_near,
+        dedup_window=args.dedup_window,
+        dedup_distance=args.dedup_distance,
+        dedup_scope=args.dedup_scope,
+        verify=args.verify or args.verify_exhaustive,
+        verify_samples=args.verify_samples,
+        verify_k=args.verify_k,
+        verify_exhaustive=args.verify_exhaustive,
+        openai_roles=tuple(r for r in args.roles.split(",") if r),
+        openai_content_types=tuple(t for t in args.content_types.split(",") if t),
+        merge_consecutive=args.merge_consecutive,
+        openai_branches=args.branches,
+        summarizer=args.summarizer,
+        summarizer_url=args.summarizer_url,
+        summarizer_model=args.summarizer_model,
+        summary_fanout=args.summary_fanout,
+        summary_levels=args.summary_levels,
+        record_file=args.record,
+        record_bodies=args.record_bodies,
+        profile=args.profile,
+        profile_dir=args.profile_dir,
+        max_memory_mb=args.max_memory_mb,
+        rate_limits=args.rate_limits,
+        rate_limit_dir=args.rate_limit_dir,
+        session_map=args.session_map,
+    )
+    from multi_migration import is_multi_file
+
+    if is_multi_file(chat_history):
+        from multi_migration import MultiFileMigration
+
+        multi_migration = MultiFileMigration(
+            chat_history,
+            base_url=base_url,
+            user_session_file="user_session.json",
+            chat_type=None if chat_type == "auto" else chat_type,
+            max_files=args.max_files,
+            max_workers=args.max_workers,
+            start_time=start_time,
+            max_messages=max_messages,
+            **stage_kwargs,
+        )
+        if args.how_many_conversations:
+            counts = multi_migration.count_conversations()
+            for chat_file, count in counts.items():
+                print(f"{count} {chat_file}")
+            print(f"{sum(counts.values())} total")
+            sys.exit(0)
+        multi_migration.migrate(summarize=summarize, summarize_every=summarize_every)
+        if multi_migration.failed_files():
+            sys.exit(1)
+        print("== All completed successfully")
+        sys.exit(0)
+
+    if chat_type == "auto":
+        chat_type = detect_chat_type(chat_history)
+        if chat_type is None:
+            print(f"ERROR: cannot detect chat type of {chat_history}", file=sys.stderr)
+            sys.exit(1)
+    if args.how_many_conversations:
+        # dry run: no client, api key or message loading
+        migration_hack = MigrationHack(
+            user_session_file="user_session.json",
+            chat_history_file=chat_history,
+            chat_type=chat_type,
+            **stage_kwargs,
+        )
+        print(migration_hack.count_conversations())
+        sys.exit(0)
+    if args.workers > 0:
+        from sharded_migration import ShardedMigration
+
+        sharded_migration = ShardedMigration(
+            args.workers,
+            checkpoint_dir=args.checkpoint_dir,
+            shards=None if args.shard is None else [args.shard],
+            base_url=base_url,
+            user_session_file="user_session.json",
+            chat_history_file=chat_history,
+            chat_type=chat_type,
+            start_time=start_time,
+            max_messages=max_messages,
+            max_workers=args.max_workers,
+            **stage_kwargs,
+        )
+        sharded_migration.migrate(summarize=summarize, summarize_every=summarize_every)
+        if sharded_migration.failed_shards():
+            sys.exit(1)
+        print("== All completed successfully")
+        sys.exit(0)
     migration_hack = MigrationHack(
         base_url=base_url,
         user_session_file="user_session.json",
@@ -291,6 +1226,8 @@ if __name__ == "__main__":
         chat_type=chat_type,
         start_time=start_time,
         max_messages=max_messages,
+        max_workers=args.max_workers,
+        **stage_kwargs,
     )
 
     migration_hack.migrate(summarize=summarize, summarize_every=summarize_every)
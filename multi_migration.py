@@ -0,0 +1,239 @@
+import fnmatch
+import glob
+import os
+import re
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from restcli import MemMachineRestClient
+from process_chat_history import detect_chat_type
+from migration import MigrationHack
+from profiling import profiled
+from rate_limit import make_rate_limiter
+from session_map import glob_base
+from session_map import make_session_mapper
+
+_IDENTITY_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+def is_multi_file(chat_history):
+    """True when chat_history names a directory or a glob pattern"""
+    return os.path.isdir(chat_history) or glob.has_magic(chat_history)
+
+
+# JSON files the migration itself writes: conversation indexes, batch
+# summary state, verify reports, profile stages and shard checkpoints
+OUTPUT_PATTERNS = (
+    "*_index.json",
+    "*_state.json",
+    "*_verify.json",
+    "profile_*_stages.json",
+    "*_shard_*_of_*.json",
+)
+
+
+def _is_output_file(chat_file, exclude_dirs):
+    name = os.path.basename(chat_file)
+    if any(fnmatch.fnmatch(name, p) for p in OUTPUT_PATTERNS):
+        return True
+    path = os.path.abspath(chat_file)
+    return any(
+        path.startswith(os.path.join(os.path.abspath(d), "")) for d in exclude_dirs
+    )
+
+
+def discover_chat_files(chat_history, pattern="*.json", exclude_dirs=()):
+    """List chat history files under a directory or matching a glob.
+
+    Files the migration writes itself and anything under exclude_dirs
+    (e.g. extract_dir when it lies inside the migrated directory) are
+    skipped.
+    """
+    if os.path.isdir(chat_history):
+        files = glob.glob(os.path.join(chat_history, "**", pattern), recursive=True)
+    else:
+        files = glob.glob(chat_history, recursive=True)
+    return sorted(
+        f
+        for f in files
+        if os.path.isfile(f) and not _is_output_file(f, [d for d in exclude_dirs if d])
+    )
+
+
+def file_identity(chat_file, root=None):
+    """Stable per file identity used as user id and session prefix.
+
+    The path relative to root, a directory or the base directory of a glob,
+    so same named files in different directories stay apart.
+    """
+    if root and os.path.isdir(root):
+        name = os.path.relpath(chat_file, root)
+    elif root and glob.has_magic(root):
+        name = os.path.relpath(chat_file, glob_base(root))
+    else:
+        name = os.path.basename(chat_file)
+    name = os.path.splitext(name)[0]
+    return _IDENTITY_RE.sub("_", name.replace(os.sep, "_")).strip("_")
+
+
+class MultiFileMigration:
+    """Migrate many chat history files in one process.
+
+    Files are migrated concurrently by a file level thread pool while every
+    file's conversation inserts go through one shared insert thread pool and
+    one shared MemMachineRestClient connection pool. A failing file is
+    recorded and does not stop the others.
+    """
+
+    def __init__(
+        self,
+        chat_history,
+        base_url="http://127.0.0.1:8080",
+        user_session_file="user_session.json",
+        chat_type=None,
+        extract_dir="extracted",
+        max_files=4,
+        max_workers=10,
+        **hack_kwargs,
+    ):
+        self.chat_history = chat_history
+        self.base_url = base_url
+        self.user_session_file = user_session_file
+        # None means detect per file
+        self.chat_type = chat_type
+        self.extract_dir = extract_dir
+        self.max_files = max_files
+        self.max_workers = max_workers
+        # one profiler for all files, their hacks share the process threads
+        self.profile = hack_kwargs.pop("profile", False)
+        self.profile_dir = hack_kwargs.get("profile_dir", "output")
+        self.profile_interval = hack_kwargs.get("profile_interval", 0.005)
+        # rules are read once, their file globs also match relative to chat_history
+        hack_kwargs["session_map"] = make_session_mapper(
+            hack_kwargs.get("session_map"), root=chat_history
+        )
+        self.hack_kwargs = hack_kwargs
+        self.recorder = None
+        if hack_kwargs.get("record_file"):
+            from replay import TrafficRecorder
+
+            # one recording of the shared client for all files
+            self.recorder = TrafficRecorder(
+                hack_kwargs["record_file"],
+                bodies=hack_kwargs.get("record_bodies", False),
+            )
+        # one limiter for all files, per user buckets keep the files apart
+        rate_limiter = make_rate_limiter(
+            hack_kwargs.get("rate_limits"), hack_kwargs.get("rate_limit_dir")
+        )
+        self.client = MemMachineRestClient(
+            base_url=self.base_url,
+            verbose=False,
+            pool_size=self.max_workers,
+            recorder=self.recorder,
+            rate_limiter=rate_limiter,
+        )
+        self.results = {}  # key: chat file, value: (status, detail)
+
+    def _hack_for(self, chat_file, executor=None):
+        chat_type = self.chat_type or detect_chat_type(chat_file)
+        if chat_type is None:
+            raise Exception(f"Error: cannot detect chat type of {chat_file}")
+        return MigrationHack(
+            base_url=self.base_url,
+            user_session_file=self.user_session_file,
+            chat_history_file=chat_file,
+            chat_type=chat_type,
+            extract_dir=self.extract_dir,
+            identity=file_identity(chat_file, self.chat_history),
+            client=self.client,
+            executor=executor,
+            progress=False,
+            **self.hack_kwargs,
+        )
+
+    def _migrate_file(self, chat_file, executor, summarize, summarize_every):
+        hack = self._hack_for(chat_file, executor)
+        hack.migrate(summarize=summarize, summarize_every=summarize_every)
+        contents = hack.insert_contents(summarize)
+        return sum(store.total_messages() for _, store in contents)
+
+    def chat_files(self):
+        """Chat history files to migrate, each with its own identity"""
+        files = discover_chat_files(
+            self.chat_history, exclude_dirs=[self.extract_dir]
+        )
+        seen = {}  # key: identity, value: chat file
+        for chat_file in files:
+            identity = file_identity(chat_file, self.chat_history)
+            if identity in seen:
+                raise Exception(
+                    f"Error: {seen[identity]} and {chat_file} share identity {identity}"
+                )
+            seen[identity] = chat_file
+        return files
+
+    def count_conversations(self):
+        """Conversation count of every file, from the file indexes when current"""
+        return {
+            chat_file: self._hack_for(chat_file).count_conversations()
+            for chat_file in self.chat_files()
+        }
+
+    def migrate(self, summarize=False, summarize_every=20):
+        from tqdm import tqdm
+
+        try:
+            with profiled(
+                "multi",
+                profile_dir=self.profile_dir,
+                interval=self.profile_interval,
+                enabled=self.profile,
+            ):
+                files = self.chat_files()
+                print(f"== Found {len(files)} chat history files in {self.chat_history}")
+                with ThreadPoolExecutor(
+                    max_workers=self.max_workers
+                ) as executor, ThreadPoolExecutor(
+                    max_workers=max(1, self.max_files)
+                ) as file_executor:
+                    future_to_file = {
+                        file_executor.submit(
+                            self._migrate_file, f, executor, summarize, summarize_every
+                        ): f
+                        for f in files
+                    }
+                    files_pbar = tqdm(
+                        total=len(files), desc="Completed files", unit="file"
+                    )
+                    for future in as_completed(future_to_file):
+                        chat_file = future_to_file[future]
+                        try:
+                            count = future.result()
+                            self.results[chat_file] = ("ok", count)
+                            files_pbar.set_description(
+                                f"Completed {os.path.basename(chat_file)} ({count} msgs)"
+                            )
+                        except Exception as e:
+                            self.results[chat_file] = ("failed", str(e))
+                            print(f"Error migrating {chat_file}: {e}")
+                            print(traceback.format_exc())
+                        files_pbar.update(1)
+                    files_pbar.close()
+        finally:
+            if self.recorder is not None:
+                self.client.recorder = None
+                self.recorder.close()
+                self.recorder = None
+        failed = self.failed_files()
+        print(
+            f"== Migrated {len(files) - len(failed)} of {len(files)} files, "
+            f"{len(failed)} failed"
+        )
+        for chat_file in failed:
+            print(f"   failed: {chat_file}: {self.results[chat_file][1]}")
+        return self.results
+
+    def failed_files(self):
+        return [f for f, (status, _) in self.results.items() if status != "ok"]
@@ -1,19 +1,23 @@
 import requests
 import json
+import os
 import re
 
 
 class OpenAISummary:
-    def __init__(self, api_key):
-        self.openai_url = "https://api.openai.com/v1/chat/completions"
+    def __init__(
+        self, api_key, base_url="https://api.openai.com/v1", model="gpt-4.1-mini"
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.openai_url = f"{self.base_url}/chat/completions"
         self.api_key = api_key
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.api_key}",
-        }
+        self.headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            # local OpenAI compatible servers usually need no key
+            self.headers["Authorization"] = f"Bearer {self.api_key}"
         self.openai_session = requests.Session()
         self.openai_session.headers.update(self.headers)
-        self.model = "gpt-4.1-mini"
+        self.model = model
         self.temperature = 0.7
         self.max_tokens = 150
         self.top_p = 1
@@ -22,17 +26,15 @@ class OpenAISummary:
         self.stop = None
 
     def list_models(self):
-        response = requests.get(
-            "https://api.openai.com/v1/models", headers=self.headers
-        )
+        response = requests.get(f"{self.base_url}/models", headers=self.headers)
         return response.json()
 
     def get_memory_summary_prompt(self, text):
         return f"Please summarize the following conversation messages:\n\n{text}"
 
-    def summarize(self, text):
+    def chat_payload(self, text):
         content = self.get_memory_summary_prompt(text)
-        payload = {
+        return {
             "model": self.model,
             "messages": [{"role": "user", "content": content}],
             "temperature": self.temperature,
@@ -42,10 +44,56 @@ class OpenAISummary:
             "presence_penalty": self.presence_penalty,
             "stop": self.stop,
         }
+
+    def summarize(self, text):
+        payload = self.chat_payload(text)
         response = self.openai_session.post(self.openai_url, json=payload, timeout=300)
         self.openai_session.close()
         return response.json()
 
+    def _check(self, response, what):
+        if response.status_code != 200:
+            raise Exception(
+                f"Error: {what} failed: {response.status_code} {response.text}"
+            )
+        return response
+
+    def upload_file(self, file, purpose="batch"):
+        """Upload a JSONL batch input file, returns the file object"""
+        with open(file, "rb") as f:
+            response = self.openai_session.post(
+                f"{self.base_url}/files",
+                data={"purpose": purpose},
+                files={"file": (os.path.basename(file), f, "application/jsonl")},
+                # let requests set the multipart content type
+                headers={"Content-Type": None},
+                timeout=300,
+            )
+        return self._check(response, "file upload").json()
+
+    def create_batch(self, input_file_id, completion_window="24h"):
+        payload = {
+            "input_file_id": input_file_id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": completion_window,
+        }
+        response = self.openai_session.post(
+            f"{self.base_url}/batches", json=payload, timeout=300
+        )
+        return self._check(response, "batch create").json()
+
+    def get_batch(self, batch_id):
+        response = self.openai_session.get(
+            f"{self.base_url}/batches/{batch_id}", timeout=300
+        )
+        return self._check(response, "batch get").json()
+
+    def file_content(self, file_id):
+        response = self.openai_session.get(
+            f"{self.base_url}/files/{file_id}/content", timeout=300
+        )
+        return self._check(response, "file content").text
+
 
 if __name__ == "__main__":
     api_key = None
@@ -0,0 +1,238 @@
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def standin_summary(payload):
+    """Deterministic stand-in summary: the first message line of the prompt"""
+    content = payload["messages"][-1]["content"]
+    lines = [line.strip() for line in content.split("\n\n", 1)[-1].splitlines()]
+    lines = [line for line in lines if line]
+    return f"Summary: {lines[0] if lines else ''}"[:200]
+
+
+def chat_completion(payload, id):
+    return {
+        "id": id,
+        "object": "chat.completion",
+        "model": payload.get("model"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": standin_summary(payload)},
+                "finish_reason": "stop",
+            }
+        ],
+    }
+
+
+def parse_multipart(content_type, body):
+    """Form fields of a multipart/form-data body, name -> bytes"""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+    )
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        fields[name] = part.get_payload(decode=True)
+    return fields
+
+
+class OpenAIStandIn:
+    """Local stand-in for the OpenAI chat completions, files and batches endpoints.
+
+    Batches run in memory: a submitted batch stays in_progress for
+    batch_delay_s, then every request line is answered with a stand-in
+    chat completion and the output file becomes available. Requests whose
+    custom_id is in fail_ids get an error result instead.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, batch_delay_s=0.0, fail_ids=()):
+        self.batch_delay_s = batch_delay_s
+        self.fail_ids = set(fail_ids)
+        self.lock = threading.RLock()
+        self.ids = itertools.count(1)
+        self.files = {}  # key: file id, value: bytes
+        self.batches = {}  # key: batch id, value: batch object
+        self.batch_ready = {}  # key: batch id, value: monotonic completion time
+        self.requests = []  # (method, path) of every request served
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _new_id(self, prefix):
+        with self.lock:
+            return f"{prefix}-{next(self.ids)}"
+
+    def _run_batch(self, batch):
+        lines = []
+        for line in self.files[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            custom_id = request["custom_id"]
+            if custom_id in self.fail_ids:
+                result = {
+                    "custom_id": custom_id,
+                    "response": {"status_code": 500, "body": {}},
+                    "error": {"message": "stand-in failure"},
+                }
+            else:
+                result = {
+                    "custom_id": custom_id,
+                    "response": {
+                        "status_code": 200,
+                        "body": chat_completion(
+                            request["body"], f"chatcmpl-{custom_id}"
+                        ),
+                    },
+                    "error": None,
+                }
+            lines.append(json.dumps(result))
+        output_file_id = self._new_id("file")
+        self.files[output_file_id] = ("\n".join(lines) + "\n").encode("utf-8")
+        batch["status"] = "completed"
+        batch["output_file_id"] = output_file_id
+        batch["request_counts"] = {"total": len(lines), "completed": len(lines)}
+
+    def get_batch(self, batch_id):
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            if (
+                batch["status"] == "in_progress"
+                and time.monotonic() >= self.batch_ready[batch_id]
+            ):
+                self._run_batch(batch)
+            return dict(batch)
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # headers and body go out in separate writes
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body, content_type="application/json"):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def do_POST(self):
+                standin.requests.append(("POST", self.path))
+                if self.path == "/v1/chat/completions":
+                    payload = json.loads(self._body())
+                    return self._reply(
+                        200, chat_completion(payload, standin._new_id("chatcmpl"))
+                    )
+                if self.path == "/v1/files":
+                    fields = parse_multipart(self.headers["Content-Type"], self._body())
+                    file_id = standin._new_id("file")
+                    standin.files[file_id] = fields["file"]
+                    return self._reply(
+                        200,
+                        {
+                            "id": file_id,
+                            "object": "file",
+                            "bytes": len(fields["file"]),
+                            "purpose": fields.get("purpose", b"").decode("utf-8"),
+                        },
+                    )
+                if self.path == "/v1/batches":
+                    payload = json.loads(self._body())
+                    if payload.get("input_file_id") not in standin.files:
+                        return self._reply(404, {"error": {"message": "no such file"}})
+                    batch_id = standin._new_id("batch")
+                    batch = {
+                        "id": batch_id,
+                        "object": "batch",
+                        "endpoint": payload["endpoint"],
+                        "input_file_id": payload["input_file_id"],
+                        "completion_window": payload.get("completion_window"),
+                        "status": "in_progress",
+                        "output_file_id": None,
+                        "error_file_id": None,
+                    }
+                    with standin.lock:
+                        standin.batches[batch_id] = batch
+                        standin.batch_ready[batch_id] = (
+                            time.monotonic() + standin.batch_delay_s
+                        )
+                    return self._reply(200, dict(batch))
+                self._reply(404, {"error": {"message": f"no route {self.path}"}})
+
+            def do_GET(self):
+                standin.requests.append(("GET", self.path))
+                parts = self.path.strip("/").split("/")
+                if parts[:2] == ["v1", "batches"] and len(parts) == 3:
+                    batch = standin.get_batch(parts[2])
+                    if batch is not None:
+                        return self._reply(200, batch)
+                if parts[:2] == ["v1", "files"] and parts[3:] == ["content"]:
+                    content = standin.files.get(parts[2])
+                    if content is not None:
+                        return self._reply(200, content, "application/jsonl")
+                self._reply(404, {"error": {"message": f"no route {self.path}"}})
+
+        return Handler
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the OpenAI chat, files and batches API"
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument(
+        "--batch_delay",
+        type=float,
+        default=0.0,
+        help="seconds a batch stays in progress",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    standin = OpenAIStandIn(args.host, args.port, batch_delay_s=args.batch_delay)
+    print(f"== OpenAI stand-in listening on {standin.url}")
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        standin.server.server_close()
@@ -6,7 +6,14 @@ import argparse
 import re
 import json
 import datetime
+import functools
 import traceback
+from collections import namedtuple
+
+# one loaded chat message: text plus the source metadata we keep for MemMachine
+# timestamp is secs since epoch, speaker the locomo speaker or openai author
+# role, source_id the locomo dia_id or openai mapping node id (None if unknown)
+Message = namedtuple("Message", ["text", "timestamp", "speaker", "source_id"])
 
 
 def timestamp_compare(ts1, ts2):
@@ -33,6 +40,98 @@ def timestamp_to_obj(ts):
     return t_obj
 
 
+def detect_chat_type(infile, peek_bytes=65536):
+    """Guess whether infile is a locomo or openai export, None if neither"""
+    with open(infile, "r", errors="ignore") as fp:
+        head = fp.read(peek_bytes)
+    mapping_pos = head.find('"mapping"')
+    conversation_pos = head.find('"conversation"')
+    if mapping_pos >= 0 and (conversation_pos < 0 or mapping_pos < conversation_pos):
+        return "openai"
+    if conversation_pos >= 0:
+        return "locomo"
+    # keys are beyond the peek window, fall back to a full parse
+    try:
+        with open(infile) as fp:
+            data = json.load(fp)
+    except Exception:
+        return None
+    for item in data if isinstance(data, list) else []:
+        if isinstance(item, dict) and "mapping" in item:
+            return "openai"
+        if isinstance(item, dict) and "conversation" in item:
+            return "locomo"
+    return None
+
+
+_LOCOMO_DATE_RE = re.compile(
+    r"^\s*(\d{1,2}):(\d{2})\s*([ap])\.?m\.?\s+on\s+(\d{1,2})\s+([a-z]+)\.?,?\s+(\d{4})\s*$",
+    re.IGNORECASE,
+)
+_MONTHS = {
+    name: num
+    for num, names in enumerate(
+        [
+            ("jan", "january"),
+            ("feb", "february"),
+            ("mar", "march"),
+            ("apr", "april"),
+            ("may",),
+            ("jun", "june"),
+            ("jul", "july"),
+            ("aug", "august"),
+            ("sep", "sept", "september"),
+            ("oct", "october"),
+            ("nov", "november"),
+            ("dec", "december"),
+        ],
+        start=1,
+    )
+    for name in names
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_locomo_date(date_str):
+    match = _LOCOMO_DATE_RE.match(date_str)
+    if not match:
+        return None
+    hour, minute, ampm, day, month, year = match.groups()
+    month = _MONTHS.get(month.lower())
+    hour = int(hour)
+    if month is None or not 1 <= hour <= 12:
+        return None
+    hour = hour % 12 + (12 if ampm.lower() == "p" else 0)
+    try:
+        return datetime.datetime(
+            int(year), month, int(day), hour, int(minute)
+        ).timestamp()
+    except ValueError:
+        return None
+
+
+def parse_locomo_date(date_str, date_stats=None):
+    """Secs since epoch of a locomo "1:56 pm on 8 May, 2023" session date.
+
+    Returns None when the date is missing or unparseable, and counts the
+    outcome in date_stats when given, see new_locomo_date_stats(). Locale
+    independent and memoized, sessions of a conversation repeat dates.
+    """
+    if not date_str:
+        if date_stats is not None:
+            date_stats["missing"] += 1
+        return None
+    ts = _parse_locomo_date(date_str)
+    if date_stats is not None:
+        date_stats["parsed" if ts is not None else "failed"] += 1
+    return ts
+
+
+def new_locomo_date_stats():
+    """Counts of parsed, failed and missing locomo session dates, per caller"""
+    return {"parsed": 0, "failed": 0, "missing": 0}
+
+
 def locomo_count_conversations(infile, verbose=False):
     if verbose:
         print(f"lcc: loading locomo input file {infile}", file=sys.stderr)
@@ -66,8 +165,15 @@ def locomo_count_conversations(infile, verbose=False):
 
 
 def load_locomo(
-    infile, start_time=None, conv_num=None, max_messages=None, verbose=False
+    infile,
+    start_time=None,
+    conv_num=None,
+    max_messages=None,
+    verbose=False,
+    records=False,
+    date_stats=None,
 ):
+    # date_stats: new_locomo_date_stats() counts of the session dates read
     if not start_time:
         start_time = 0
     if not conv_num:
@@ -123,26 +229,9 @@ def load_locomo(
                             file=sys.stderr,
                         )
                     messages = conversation[session_name]
-                    session_date_str = ""
-                    session_date_obj = None
-                    if not session_date_obj:
-                        try:
-                            session_date_str = conversation[session_date_name]
-                            session_date_obj = datetime.datetime.strptime(
-                                session_date_str, "%I:%M %p on %d %b, %Y"
-                            )
-                        except Exception:
-                            pass
-                    if not session_date_obj:
-                        try:
-                            session_date_str = conversation[session_date_name]
-                            session_date_obj = datetime.datetime.strptime(
-                                session_date_str, "%I:%M %p on %d %B, %Y"
-                            )
-                        except Exception:
-                            pass
-                    try:
-                        session_time = session_date_obj.timestamp()
+                    session_date_str = conversation.get(session_date_name)
+                    session_time = parse_locomo_date(session_date_str, date_stats)
+                    if session_time is not None:
                         if start_time:
                             if timestamp_compare(start_time, session_time) > 0:
                                 if verbose:
@@ -151,7 +240,7 @@ def load_locomo(
                                         file=sys.stderr,
                                     )
                                 break
-                    except Exception:
+                    else:
                         if verbose:
                             print(
                                 f"ll: ERROR: cannot read timestamp of conversation {conv_count} session {num} date={session_date_str}",
@@ -159,7 +248,17 @@ def load_locomo(
                             )
                     for message in messages:
                         if "text" in message:
-                            lines.append(message["text"])
+                            if records:
+                                lines.append(
+                                    Message(
+                                        message["text"],
+                                        session_time,
+                                        message.get("speaker"),
+                                        message.get("dia_id"),
+                                    )
+                                )
+                            else:
+                                lines.append(message["text"])
                             msg_count += 1
                             if max_messages and msg_count >= max_messages:
                                 # user asked to do this many messages only
@@ -187,6 +286,97 @@ def load_locomo(
     return lines
 
 
+# default openai selection: what the user typed
+OPENAI_ROLES = ("user",)
+OPENAI_CONTENT_TYPES = ("text",)
+
+
+def openai_content_text(content):
+    """Text of an openai message content, "" when it has none"""
+    parts = content.get("parts")
+    if parts:
+        texts = []
+        for part in parts:
+            if isinstance(part, str):
+                texts.append(part)
+            elif isinstance(part, dict) and isinstance(part.get("text"), str):
+                # e.g. audio_transcription parts of multimodal_text
+                texts.append(part["text"])
+        return "".join(texts)
+    # code, execution_output, tether_quote, ... keep their text here
+    text = content.get("text")
+    if isinstance(text, str):
+        return text
+    return ""
+
+
+def _openai_node_time(node):
+    message = node.get("message") or {}
+    return message.get("create_time") or 0
+
+
+def openai_thread_order(mapping, current_node=None, branches=False):
+    """Node ids of an openai chat in conversation order.
+
+    Without branches this is the path from the root to current_node (or to
+    the most recent leaf when current_node is unknown), which skips prompts
+    that were edited or regenerated. With branches every node is listed in
+    depth-first reply order. Returns None when the mapping has no
+    parent/children links to walk.
+    """
+    if not any(node.get("parent") or node.get("children") for node in mapping.values()):
+        return None
+    if branches:
+        roots = [
+            id
+            for id, node in mapping.items()
+            if not node.get("parent") or node["parent"] not in mapping
+        ]
+        order = []
+        seen = set()
+        stack = roots[::-1]
+        while stack:
+            id = stack.pop()
+            if id in seen or id not in mapping:
+                continue
+            seen.add(id)
+            order.append(id)
+            stack.extend(reversed(mapping[id].get("children") or []))
+        return order
+    if current_node not in mapping:
+        leaves = [id for id, node in mapping.items() if not node.get("children")]
+        if not leaves:
+            return None
+        current_node = max(leaves, key=lambda id: _openai_node_time(mapping[id]))
+    path = []
+    seen = set()
+    id = current_node
+    while id is not None and id in mapping and id not in seen:
+        seen.add(id)
+        path.append(id)
+        id = mapping[id].get("parent")
+    path.reverse()
+    return path
+
+
+def merge_consecutive_messages(chat_data, roles=None):
+    """Merge runs of same role messages into the first message of the run.
+
+    chat_data is the whole thread: a message of a role outside roles ends a
+    run and is then dropped, roles None keeps every role.
+    """
+    merged = []
+    last_role = None
+    for message in chat_data:
+        if roles is None or message["role"] in roles:
+            if merged and last_role == message["role"]:
+                merged[-1]["text"] += "\n" + message["text"]
+            else:
+                merged.append(message)
+        last_role = message["role"]
+    return merged
+
+
 def openai_count_conversations(infile, verbose=False):
     if verbose:
         print(f"occ: loading openai input file {infile}", file=sys.stderr)
@@ -206,6 +396,11 @@ def load_openai(
     max_messages=None,
     verbose=False,
     chat_title=None,
+    records=False,
+    roles=OPENAI_ROLES,
+    content_types=OPENAI_CONTENT_TYPES,
+    merge_consecutive=False,
+    branches=False,
 ):
     if not start_time:
         start_time = 0
@@ -252,7 +447,14 @@ def load_openai(
         if verbose:
             print(f"lo: loading chat title={chat_title_actual}", file=sys.stderr)
         chat_data = []
-        for id, chat_map in chat["mapping"].items():
+        mapping = chat["mapping"]
+        # walk the reply tree, fall back to a timestamp sort without tree links
+        thread_order = openai_thread_order(
+            mapping, chat.get("current_node"), branches=branches
+        )
+        node_ids = mapping.keys() if thread_order is None else thread_order
+        for id in node_ids:
+            chat_map = mapping[id]
             # validate
             if "message" not in chat_map:
                 continue
@@ -277,20 +479,29 @@ def load_openai(
                 msg_ts = message["create_time"]
                 msg_content = message["content"]
                 msg_type = msg_content["content_type"]
-                if msg_role == "user" and msg_type == "text":
-                    msg_str = "".join(msg_content["parts"])
-                    if not msg_ts:
-                        if verbose:
-                            print(
-                                f"lo: ERROR: chat {chat_count} user message {msg_str} has no timestamp",
-                                file=sys.stderr,
-                            )
-                    else:
-                        datapoint = {
-                            "timestamp": msg_ts,
-                            "text": msg_str,
-                        }
-                        chat_data.append(datapoint)
+                if msg_role in roles and msg_type in content_types:
+                    msg_str = openai_content_text(msg_content)
+                    if not msg_str:
+                        continue
+                elif merge_consecutive and msg_role not in roles:
+                    # kept until merged, a turn of another role ends a run
+                    msg_str = ""
+                else:
+                    continue
+                if not msg_ts and thread_order is None:
+                    if verbose:
+                        print(
+                            f"lo: ERROR: chat {chat_count} {msg_role} message {msg_str} has no timestamp",
+                            file=sys.stderr,
+                        )
+                else:
+                    datapoint = {
+                        "timestamp": msg_ts,
+                        "text": msg_str,
+                        "role": msg_role,
+                        "id": id,
+                    }
+                    chat_data.append(datapoint)
             except Exception as ex:
                 if verbose:
                     print(
@@ -298,11 +509,26 @@ def load_openai(
                         file=sys.stderr,
                     )
                     print(traceback.format_exc(), file=sys.stderr)
-        # sort messages
-        chat_sorted = sorted(chat_data, key=lambda x: x["timestamp"])
+        if thread_order is None:
+            # sort messages
+            chat_sorted = sorted(chat_data, key=lambda x: x["timestamp"])
+        else:
+            chat_sorted = chat_data
+        if merge_consecutive:
+            chat_sorted = merge_consecutive_messages(chat_sorted, roles)
         # save messages
         for message in chat_sorted:
-            lines.append(message["text"])
+            if records:
+                lines.append(
+                    Message(
+                        message["text"],
+                        message["timestamp"],
+                        message["role"],
+                        message["id"],
+                    )
+                )
+            else:
+                lines.append(message["text"])
             msg_count += 1
             if max_messages and msg_count >= max_messages:
                 # user asked to do this many messages only
@@ -347,6 +573,28 @@ def get_args():
         help="only read this many messages",
     )
     parser.add_argument("--openai_chat", action="store", help="load only this chat")
+    parser.add_argument(
+        "--roles",
+        action="store",
+        default=",".join(OPENAI_ROLES),
+        help="openai author roles to load, comma separated: user,assistant,tool",
+    )
+    parser.add_argument(
+        "--content_types",
+        action="store",
+        default=",".join(OPENAI_CONTENT_TYPES),
+        help="openai content types to load, comma separated: text,code,multimodal_text",
+    )
+    parser.add_argument(
+        "--merge_consecutive",
+        action="store_true",
+        help="merge consecutive openai messages of the same role",
+    )
+    parser.add_argument(
+        "--branches",
+        action="store_true",
+        help="load edited / regenerated openai branches too, not just the current thread",
+    )
     parser.add_argument(
         "--conversation",
         action="store",
@@ -384,6 +632,10 @@ def get_args():
             except Exception:
                 pass
         args.start_time = ts
+    args.roles = tuple(r.strip() for r in args.roles.split(",") if r.strip())
+    args.content_types = tuple(
+        t.strip() for t in args.content_types.split(",") if t.strip()
+    )
     return args
 
 
@@ -391,7 +643,7 @@ def usage(args):
     prog = os.path.basename(sys.argv[0])
     # print(f'Usage: {prog} [--src <src>] [--infile <chat_history>] [--outfile <parsed_chat>] [--summarize_every <n_messages>] [--start_time <timestamp>')
     print(
-        f"Usage: {prog} [--src <src>] --infile <chat_history> [--outfile <parsed_chat>] [--start_time <timestamp> [--num_messages <n>] [--openai_chat <title>] [--conversation <n>] [--how_many_conversations]"
+        f"Usage: {prog} [--src <src>] --infile <chat_history> [--outfile <parsed_chat>] [--start_time <timestamp> [--num_messages <n>] [--openai_chat <title>] [--roles <r1,r2>] [--content_types <t1,t2>] [--merge_consecutive] [--branches] [--conversation <n>] [--how_many_conversations]"
     )
     print("")
     print("src: input file format, either locomo or openai")
@@ -401,6 +653,10 @@ def usage(args):
     print("    either YYYY-MM-DDTHH:MM:SS or secs since epoch")
     print("num_messages: read only this many messages")
     print("openai_chat: if input is openai, load only this chat title")
+    print("roles: if input is openai, author roles to load, default is user")
+    print("content_types: if input is openai, content types to load, default is text")
+    print("merge_consecutive: if input is openai, merge same role messages in a row")
+    print("branches: if input is openai, also load abandoned edit/regenerate branches")
     print("conversation: load only this conversation number")
     print("how_many_conversations: how many conversations are in the input file")
 
@@ -414,13 +670,20 @@ if __name__ == "__main__":
             count = locomo_count_conversations(args.infile, args.verbose)
             lines = [f"{count}"]
         else:
+            date_stats = new_locomo_date_stats()
             lines = load_locomo(
                 args.infile,
                 args.start_time,
                 args.conversation,
                 args.max_messages,
                 args.verbose,
+                date_stats=date_stats,
             )
+            if date_stats["failed"] or date_stats["missing"]:
+                print(
+                    f"WARNING: session dates failed={date_stats['failed']} missing={date_stats['missing']}, start_time not applied to those sessions",
+                    file=sys.stderr,
+                )
     elif args.src == "openai":
         if args.how_many_conversations:
             count = openai_count_conversations(args.infile, args.verbose)
@@ -433,6 +696,10 @@ if __name__ == "__main__":
                 args.max_messages,
                 args.verbose,
                 args.openai_chat,
+                roles=args.roles,
+                content_types=args.content_types,
+                merge_consecutive=args.merge_consecutive,
+                branches=args.branches,
             )
     else:
         print(f"ERROR: unknown input source {args.src}", file=sys.stderr)
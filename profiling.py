@@ -0,0 +1,161 @@
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+
+_WORKER_SUFFIX_RE = re.compile(r"_\d+$")
+
+
+class StageTimer:
+    """Wall and CPU time of named migration stages.
+
+    Stages are dotted names like "load.parse", timed with
+    `with timer.stage(name):` from any thread. CPU time is the calling
+    thread's, so for stages run on a thread pool the summed wall and CPU
+    times can exceed the elapsed time of the enclosing stage.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}  # key: stage name, value: [count, wall_s, cpu_s]
+
+    @contextmanager
+    def stage(self, name):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.thread_time() - cpu)
+
+    def add(self, name, wall_s, cpu_s, count=1):
+        with self.lock:
+            totals = self.stages.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += count
+            totals[1] += wall_s
+            totals[2] += cpu_s
+
+    def report(self):
+        with self.lock:
+            return {
+                name: {"count": c, "wall_s": wall, "cpu_s": cpu}
+                for name, (c, wall, cpu) in sorted(self.stages.items())
+            }
+
+
+def timed(name):
+    """Method decorator timing every call as stage name on self.timer"""
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.timer.stage(name):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def print_stage_table(report, title="Stage timings"):
+    print(f"== {title}")
+    print(f"   {'stage':<28} {'count':>8} {'wall_s':>10} {'cpu_s':>10} {'cpu%':>6}")
+    for name, s in report.items():
+        indent = "  " * name.count(".")
+        cpu_pct = s["cpu_s"] / s["wall_s"] * 100 if s["wall_s"] else 0.0
+        print(
+            f"   {indent + name.rsplit('.', 1)[-1]:<28} {s['count']:>8} "
+            f"{s['wall_s']:>10.3f} {s['cpu_s']:>10.3f} {cpu_pct:>5.0f}%"
+        )
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}.{code.co_name}"
+
+
+class SamplingProfiler:
+    """Sample the stacks of every thread and count them as collapsed stacks.
+
+    A background thread wakes up every interval seconds and records the
+    stack of each other thread as "thread;outer;...;inner". Thread pool
+    workers are merged under their pool name. write() produces the folded
+    format read by flamegraph.pl, speedscope and similar tools.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _sample(self):
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            thread_name = _WORKER_SUFFIX_RE.sub("", names.get(ident, str(ident)))
+            stack.append(thread_name)
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self._run, name="SamplingProfiler", daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, collapsed_file):
+        collapsed_dir = os.path.dirname(collapsed_file)
+        if collapsed_dir:
+            os.makedirs(collapsed_dir, exist_ok=True)
+        with open(collapsed_file, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profiled(name, profile_dir="output", interval=0.005, timer=None, enabled=True):
+    """Run a SamplingProfiler over the with block when enabled.
+
+    Writes {profile_dir}/profile_{name}.folded and, with a StageTimer, the
+    stage timings next to it as profile_{name}_stages.json.
+    """
+    if not enabled:
+        yield None
+        return
+    profiler = SamplingProfiler(interval).start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        collapsed_file = os.path.join(profile_dir, f"profile_{name}.folded")
+        profiler.write(collapsed_file)
+        print(f"== Profile: {profiler.samples} samples in {collapsed_file}")
+        if timer is not None:
+            stages_file = os.path.join(profile_dir, f"profile_{name}_stages.json")
+            with open(stages_file, "w") as f:
+                json.dump(timer.report(), f, indent=2)
+            print(f"== Profile: stage timings in {stages_file}")
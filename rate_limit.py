@@ -0,0 +1,198 @@
+import json
+import os
+import re
+import threading
+import time
+
+from collections import OrderedDict
+
+ENDPOINTS = ("episodic", "episodic/search")
+SCOPES = ENDPOINTS + ("group_id", "user_id")
+_KEY_RE = re.compile(r"[^A-Za-z0-9_.-]+")
+
+
+class TokenBucket:
+    """Token bucket refilled at rate tokens/s up to burst tokens.
+
+    acquire(n) takes n tokens right away and sleeps off any deficit, so a
+    request larger than the burst still passes, it just waits longer and
+    leaves the bucket in debt for the next caller.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def take(self, n):
+        """Take n tokens, return the seconds to wait before using them"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            return max(0.0, -self.tokens / self.rate)
+
+    def full(self):
+        """True once the bucket has refilled, dropping it then loses nothing"""
+        with self.lock:
+            refill = (time.monotonic() - self.last) * self.rate
+            return self.tokens + refill >= self.burst
+
+    def acquire(self, n=1):
+        wait = self.take(n)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class FileTokenBucket(TokenBucket):
+    """TokenBucket whose state lives in a file shared by several processes.
+
+    Every take opens the file, locks it with flock, reads tokens and the
+    wall clock time of the last update, refills, writes them back and
+    closes it, so sharded worker processes draw from one bucket and no
+    descriptor stays open between requests.
+    """
+
+    def __init__(self, state_file, rate, burst):
+        import fcntl
+
+        super().__init__(rate, burst)
+        self.fcntl = fcntl
+        self.state_file = state_file
+        state_dir = os.path.dirname(state_file)
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+
+    def take(self, n):
+        fd = os.open(self.state_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # closing the fd releases the flock
+            self.fcntl.flock(fd, self.fcntl.LOCK_EX)
+            now = time.time()
+            state = os.pread(fd, 64, 0).split()
+            tokens, last = self.burst, now
+            if len(state) == 2:
+                tokens, last = float(state[0]), float(state[1])
+            tokens = min(self.burst, tokens + max(0.0, now - last) * self.rate)
+            tokens -= n
+            os.pwrite(fd, f"{tokens:.6f} {now:.6f}".encode("utf-8").ljust(64), 0)
+            return max(0.0, -tokens / self.rate)
+        finally:
+            os.close(fd)
+
+    def full(self):
+        # the state is in the file, a new bucket for it picks it up again
+        return True
+
+
+class RateLimiter:
+    """Request and byte rate limits per endpoint and per group_id / user_id.
+
+    rules maps a scope to its limits, e.g.
+        {"episodic": {"requests_per_s": 50, "bytes_per_s": 2000000},
+         "episodic/search": {"requests_per_s": 20},
+         "user_id": {"requests_per_s": 10, "burst_s": 2}}
+    An endpoint scope is one bucket for all requests to that endpoint, a
+    group_id or user_id scope is one bucket per distinct id. burst_s is
+    how many seconds of rate a bucket holds (default 1). With state_dir the
+    buckets are files in that directory shared by every process using it.
+    At most max_buckets buckets are kept, the least recently used full one
+    is dropped first; a bucket still in debt is kept until it has refilled,
+    a file bucket keeps its state in the file.
+    """
+
+    def __init__(self, rules, state_dir=None, max_buckets=4096):
+        for scope, limits in rules.items():
+            if scope not in SCOPES:
+                raise Exception(f"Error: Invalid rate limit scope: {scope}")
+            for name in limits:
+                if name not in ("requests_per_s", "bytes_per_s", "burst_s"):
+                    raise Exception(f"Error: Invalid rate limit {scope}.{name}")
+        self.rules = rules
+        self.state_dir = state_dir
+        self.max_buckets = max_buckets
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()  # key: (scope, id, unit), value: TokenBucket
+
+    @classmethod
+    def from_file(cls, rules_file, state_dir=None):
+        with open(rules_file, "r") as f:
+            return cls(json.load(f), state_dir=state_dir)
+
+    def _bucket(self, scope, key, unit, rate, burst_s):
+        bucket_key = (scope, key, unit)
+        with self.lock:
+            bucket = self.buckets.get(bucket_key)
+            if bucket is not None:
+                self.buckets.move_to_end(bucket_key)
+                return bucket
+            burst = max(1.0, rate * burst_s)
+            if self.state_dir:
+                name = _KEY_RE.sub("_", f"{scope}_{key}_{unit}")
+                bucket = FileTokenBucket(
+                    os.path.join(self.state_dir, f"{name}.bucket"), rate, burst
+                )
+            else:
+                bucket = TokenBucket(rate, burst)
+            self.buckets[bucket_key] = bucket
+            excess = len(self.buckets) - self.max_buckets
+            if excess > 0:
+                # dropping a bucket in debt would hand its id a fresh burst
+                evict = []
+                for key, old in self.buckets.items():
+                    if len(evict) == excess or key == bucket_key:
+                        break
+                    if old.full():
+                        evict.append(key)
+                for key in evict:
+                    del self.buckets[key]
+            return bucket
+
+    def acquire(self, endpoint, session, nbytes=0):
+        """Wait until a request of nbytes to endpoint for session is allowed,
+        returns the seconds waited.
+
+        Tokens are taken from every matching bucket first, then the caller
+        sleeps once for the largest deficit.
+        """
+        wait = 0.0
+        for scope, limits in self.rules.items():
+            if scope in ENDPOINTS:
+                if scope != endpoint:
+                    continue
+                key = ""
+            else:
+                key = session.get(scope)
+                if key is None:
+                    continue
+                if isinstance(key, list):
+                    key = ",".join(str(k) for k in key)
+            burst_s = limits.get("burst_s", 1.0)
+            if limits.get("requests_per_s"):
+                bucket = self._bucket(
+                    scope, key, "requests", limits["requests_per_s"], burst_s
+                )
+                wait = max(wait, bucket.take(1))
+            if limits.get("bytes_per_s") and nbytes:
+                bucket = self._bucket(
+                    scope, key, "bytes", limits["bytes_per_s"], burst_s
+                )
+                wait = max(wait, bucket.take(nbytes))
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def make_rate_limiter(rate_limits, state_dir=None):
+    """RateLimiter of a rules dict or JSON rules file, None without rules"""
+    if not rate_limits:
+        return None
+    if isinstance(rate_limits, RateLimiter):
+        return rate_limits
+    if isinstance(rate_limits, dict):
+        return RateLimiter(rate_limits, state_dir=state_dir)
+    return RateLimiter.from_file(rate_limits, state_dir=state_dir)
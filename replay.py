@@ -0,0 +1,310 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from loadgen import percentile
+
+RECORDING_VERSION = 1
+ENDPOINTS = ("memories/episodic", "memories/episodic/search")
+_FILLER = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do ".split()
+
+
+def payload_digest(payload):
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(body, digest_size=8).hexdigest(), len(body)
+
+
+class TrafficRecorder:
+    """Append the request stream of a MemMachineRestClient to a JSONL file.
+
+    The first line is a header, then one line per request with its offset
+    in seconds from the start of the recording, the endpoint, an index into
+    the sessions defined earlier in the file, and either the payload
+    without its session (bodies=True) or a digest plus the size, the
+    content length and the other fields of the payload, i.e. everything
+    but the message or query text. Every client call is recorded, searches
+    answered by the search cache included, so a replay sees the same demand.
+    """
+
+    def __init__(self, record_file, bodies=False):
+        self.record_file = record_file
+        self.bodies = bodies
+        self.lock = threading.Lock()
+        self.sessions = {}  # key: session json, value: session index
+        self.start = time.monotonic()
+        record_dir = os.path.dirname(record_file)
+        if record_dir:
+            os.makedirs(record_dir, exist_ok=True)
+        self.fp = open(record_file, "w")
+        self._write(
+            {
+                "version": RECORDING_VERSION,
+                "bodies": bodies,
+                "started": time.time(),
+            }
+        )
+
+    def _write(self, item):
+        self.fp.write(json.dumps(item, separators=(",", ":")) + "\n")
+
+    def record(self, endpoint, payload):
+        offset = round(time.monotonic() - self.start, 6)
+        payload = dict(payload)
+        session = payload.pop("session")
+        key = json.dumps(session, sort_keys=True)
+        if self.bodies:
+            item = {"t": offset, "ep": endpoint, "body": payload}
+        else:
+            digest, size = payload_digest(payload)
+            text_key = "query" if "query" in payload else "episode_content"
+            text = payload.pop(text_key, "")
+            item = {
+                "t": offset,
+                "ep": endpoint,
+                "digest": digest,
+                "bytes": size,
+                "chars": len(text),
+                # producer, metadata, limit, filter, ...: replayed as recorded
+                "fields": payload,
+            }
+        with self.lock:
+            index = self.sessions.get(key)
+            if index is None:
+                index = self.sessions[key] = len(self.sessions)
+                self._write({"s": index, "session": session})
+            item["s"] = index
+            self._write(item)
+            self.fp.flush()
+
+    def close(self):
+        with self.lock:
+            self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def filler_text(chars, seed):
+    """Deterministic stand-in text of a recorded length"""
+    words = []
+    n = 0
+    i = seed
+    # the joined words are n - 1 characters long
+    while n <= chars:
+        word = _FILLER[i % len(_FILLER)]
+        words.append(word)
+        n += len(word) + 1
+        i += 1
+    return " ".join(words)[:chars]
+
+
+def load_recording(record_file):
+    """List of (offset, endpoint, session, payload) of a recording.
+
+    Payloads recorded as digests are rebuilt from their recorded fields
+    and filler text of the recorded length, so the replayed request sizes
+    stay the same.
+    """
+    sessions = {}
+    requests = []
+    with open(record_file, "r") as f:
+        header = json.loads(f.readline())
+        if header.get("version") != RECORDING_VERSION:
+            raise Exception(f"Error: unsupported recording version in {record_file}")
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if "session" in item:
+                sessions[item["s"]] = item["session"]
+                continue
+            if item["ep"] not in ENDPOINTS:
+                raise Exception(
+                    f"Error: unknown endpoint {item['ep']} in {record_file}"
+                )
+            payload = item.get("body")
+            if payload is None:
+                payload = dict(item.get("fields", {}))
+                text = filler_text(item["chars"], len(requests))
+                if item["ep"] == "memories/episodic":
+                    payload["episode_content"] = text
+                else:
+                    payload["query"] = text
+                    payload.setdefault("limit", item.get("limit", 5))
+            requests.append((item["t"], item["ep"], sessions[item["s"]], payload))
+    return requests
+
+
+class TrafficReplayer:
+    """Re-issue a recording open-loop at speed x the recorded rate.
+
+    Request i is scheduled at its recorded offset / speed, speed 0 sends
+    every request as fast as the concurrency allows. Latency is measured
+    from the scheduled time like SearchLoadGenerator, lag is how late the
+    request actually left.
+    """
+
+    def __init__(self, client, requests, speed=1.0, concurrency=32):
+        if not requests:
+            raise Exception("Error: no requests to replay")
+        if speed < 0:
+            raise Exception(f"Error: Invalid replay speed: {speed}")
+        self.client = client
+        self.requests = requests
+        self.speed = speed
+        self.concurrency = concurrency
+        self.lock = threading.Lock()
+        self.latencies_ms = {endpoint: [] for endpoint in ENDPOINTS}
+        self.lag_ms = []
+        self.errors = 0
+        self.elapsed_s = 0.0
+
+    def _send(self, endpoint, session, payload, scheduled):
+        sent = time.perf_counter()
+        ok = True
+        try:
+            if endpoint == "memories/episodic":
+                self.client.post_episodic_memory(
+                    payload["episode_content"],
+                    session=session,
+                    producer=payload.get("producer"),
+                    produced_for=payload.get("produced_for"),
+                    metadata=payload.get("metadata"),
+                )
+            else:
+                self.client.search_episodic_memory(
+                    payload["query"],
+                    limit=payload.get("limit", 5),
+                    session=session,
+                    filter=payload.get("filter"),
+                )
+        except Exception:
+            ok = False
+        done = time.perf_counter()
+        with self.lock:
+            if not ok:
+                self.errors += 1
+            self.latencies_ms[endpoint].append((done - scheduled) * 1000)
+            self.lag_ms.append((sent - scheduled) * 1000)
+
+    def run(self):
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            start = time.perf_counter()
+            first = self.requests[0][0]
+            for offset, endpoint, session, payload in self.requests:
+                scheduled = start
+                if self.speed:
+                    scheduled += (offset - first) / self.speed
+                    delay = scheduled - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                futures.append(
+                    executor.submit(self._send, endpoint, session, payload, scheduled)
+                )
+            wait(futures)
+            self.elapsed_s = time.perf_counter() - start
+        return self.report()
+
+    def report(self):
+        sent = sum(len(v) for v in self.latencies_ms.values())
+        recorded_s = self.requests[-1][0] - self.requests[0][0]
+        lag = sorted(self.lag_ms)
+        return {
+            "sent": sent,
+            "errors": self.errors,
+            "speed": self.speed,
+            "recorded_s": recorded_s,
+            "elapsed_s": self.elapsed_s,
+            "achieved_rps": sent / self.elapsed_s if self.elapsed_s else 0.0,
+            "latency_ms": {
+                endpoint: {
+                    p: percentile(sorted(values), p) for p in (50, 90, 99, 99.9)
+                }
+                for endpoint, values in self.latencies_ms.items()
+                if values
+            },
+            "lag_ms": {p: percentile(lag, p) for p in (50, 99)},
+            "client": self.client.statistics(),
+        }
+
+
+def print_report(report):
+    speed = f"{report['speed']:g}x" if report["speed"] else "max speed"
+    print(
+        f"== replayed {report['sent']} requests at {speed}, {report['errors']} errors, "
+        f"{report['elapsed_s']:.2f}s (recorded {report['recorded_s']:.2f}s), "
+        f"{report['achieved_rps']:.1f} req/s"
+    )
+    for endpoint, latency in report["latency_ms"].items():
+        values = " ".join(f"p{p:g}={v:.1f}" for p, v in latency.items())
+        print(f"   {endpoint} latency_ms: {values}")
+    values = " ".join(f"p{p:g}={v:.1f}" for p, v in report["lag_ms"].items())
+    print(f"   send lag_ms: {values}")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Replay recorded MemMachine traffic")
+    parser.add_argument("--recording", type=str, required=True)
+    parser.add_argument("--base_url", type=str, default="http://127.0.0.1:8080")
+    parser.add_argument(
+        "--speed",
+        type=str,
+        default="1",
+        help="multiple of the recorded rate, or max",
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--standin",
+        default=False,
+        action="store_true",
+        help="replay against a local MemMachine stand-in instead of base_url",
+    )
+    parser.add_argument(
+        "--standin_latency_ms",
+        type=float,
+        default=0.0,
+        help="response delay of the stand-in",
+    )
+    parser.add_argument(
+        "--report", type=str, default=None, help="also write the report as JSON here"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_args()
+    from restcli import MemMachineRestClient
+
+    speed = 0.0 if args.speed == "max" else float(args.speed)
+    requests = load_recording(args.recording)
+    standin = None
+    base_url = args.base_url
+    if args.standin:
+        from memmachine_standin import MemMachineStandIn
+
+        standin = MemMachineStandIn(latency_ms=args.standin_latency_ms).start()
+        base_url = standin.base_url
+    client = MemMachineRestClient(base_url=base_url, pool_size=args.concurrency)
+    print(f"== Replaying {len(requests)} requests from {args.recording} to {base_url}")
+    try:
+        report = TrafficReplayer(
+            client, requests, speed=speed, concurrency=args.concurrency
+        ).run()
+    finally:
+        if standin is not None:
+            standin.stop()
+    print_report(report)
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report["errors"] else 0)
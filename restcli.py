@@ -1,12 +1,27 @@
-import requests
 import time
 import json
 import os
+import threading
 from datetime import datetime
 
 episodic_memory_path = "memories/episodic"
 
 
+def episodic_memory_contents(results):
+    """List the memory content strings of a search_episodic_memory response"""
+    contents = []
+    if not results or results.get("content") is None:
+        return contents
+    episodic_memory = results["content"].get("episodic_memory")
+    for memories in episodic_memory or []:
+        for memory in memories or []:
+            if isinstance(memory, dict) and "content" in memory:
+                contents.append(memory["content"])
+            elif isinstance(memory, str) and memory.strip():
+                contents.append(memory)
+    return contents
+
+
 class MemMachineRestClient:
     def __init__(
         self,
@@ -16,6 +31,10 @@ class MemMachineRestClient:
         produced_for=None,
         verbose=False,
         statistic_file=None,
+        pool_size=10,
+        search_cache=None,
+        recorder=None,
+        rate_limiter=None,
     ):
         self.base_url = base_url
         self.api_version = "v1"
@@ -38,14 +57,92 @@ class MemMachineRestClient:
         if self.statistic_file is None:
             timestamp = datetime.now().isoformat()
             self.statistic_file = f"output/statistic_{timestamp}.csv"
-        if not os.path.exists(self.statistic_file):
-            os.makedirs(os.path.dirname(self.statistic_file), exist_ok=True)
-        with open(self.statistic_file, "w") as f:
-            f.write("timestamp,method,url,latency_ms\n")
-        self.statistic_fp = open(self.statistic_file, "a")
+        # the statistic file and the connection pool are created on first use,
+        # a client that sends nothing costs no file and no requests import
+        self.statistic_fp = None
+        self.pool_size = pool_size
+        self._http = None
+        self.init_lock = threading.Lock()
+        # optional SearchCache for search_episodic_memory results
+        self.search_cache = search_cache
+        # optional replay.TrafficRecorder capturing every request
+        self.recorder = recorder
+        # optional rate_limit.RateLimiter every request waits on before it is sent
+        self.rate_limiter = rate_limiter
+        # running request statistics, updated from every thread using this client
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "latency_ms_total": 0.0,
+            "latency_ms_max": 0.0,
+            "throttled_ms_total": 0.0,
+        }
 
     def __del__(self):
-        self.statistic_fp.close()
+        if getattr(self, "statistic_fp", None) is not None:
+            self.statistic_fp.close()
+        if getattr(self, "_http", None) is not None:
+            self._http.close()
+
+    @property
+    def http(self):
+        """One keep-alive connection pool shared by every thread using this client"""
+        if self._http is None:
+            with self.init_lock:
+                if self._http is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    http = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=self.pool_size, pool_maxsize=self.pool_size
+                    )
+                    http.mount("http://", adapter)
+                    http.mount("https://", adapter)
+                    self._http = http
+        return self._http
+
+    def _write_statistic(self, method, url, latency_ms):
+        if self.statistic_fp is None:
+            with self.init_lock:
+                if self.statistic_fp is None:
+                    statistic_dir = os.path.dirname(self.statistic_file)
+                    if statistic_dir:
+                        os.makedirs(statistic_dir, exist_ok=True)
+                    with open(self.statistic_file, "w") as f:
+                        f.write("timestamp,method,url,latency_ms\n")
+                    self.statistic_fp = open(self.statistic_file, "a")
+        self.statistic_fp.write(
+            f"{datetime.now().isoformat()},{method},{url},{latency_ms}\n"
+        )
+
+    def _record(self, latency_ms, ok):
+        with self.stats_lock:
+            self.stats["requests"] += 1
+            if not ok:
+                self.stats["errors"] += 1
+            self.stats["latency_ms_total"] += latency_ms
+            if latency_ms > self.stats["latency_ms_max"]:
+                self.stats["latency_ms_max"] = latency_ms
+
+    def _throttle(self, endpoint, session, payload):
+        if self.rate_limiter is None:
+            return
+        nbytes = len(json.dumps(payload).encode("utf-8"))
+        waited = self.rate_limiter.acquire(endpoint, session, nbytes)
+        if waited:
+            with self.stats_lock:
+                self.stats["throttled_ms_total"] += waited * 1000
+
+    def statistics(self):
+        """Snapshot of request count, errors and latency so far"""
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats["latency_ms_avg"] = (
+            stats["latency_ms_total"] / stats["requests"] if stats["requests"] else 0.0
+        )
+        return stats
 
     def _get_url(self, path):
         return f"{self.base_url}/{self.api_version}/{path}"
@@ -98,21 +195,35 @@ class MemMachineRestClient:
     }'
     """
 
-    def post_episodic_memory(self, message, session_id=None):
+    def post_episodic_memory(
+        self,
+        message,
+        session_id=None,
+        session=None,
+        producer=None,
+        produced_for=None,
+        metadata=None,
+    ):
         episodic_memory_endpoint = self._get_url(episodic_memory_path)
+        # build the envelope per call, self.session is shared between threads
+        if session is None:
+            session = self.session
         if session_id is not None:
-            self.session["session_id"] = session_id
+            session = dict(session, session_id=session_id)
         payload = {
-            "session": self.session,
-            "producer": self.producer,
-            "produced_for": self.produced_for,
+            "session": session,
+            "producer": producer or self.producer,
+            "produced_for": produced_for or self.produced_for,
             "episode_content": message,
             "episode_type": "message",
-            "metadata": {},
+            "metadata": metadata or {},
         }
+        if self.recorder is not None:
+            self.recorder.record(episodic_memory_path, payload)
+        self._throttle("episodic", session, payload)
 
         start_time = time.time()
-        response = requests.post(episodic_memory_endpoint, json=payload, timeout=300)
+        response = self.http.post(episodic_memory_endpoint, json=payload, timeout=300)
         end_time = time.time()
 
         latency_ms = round((end_time - start_time) * 1000, 2)
@@ -122,10 +233,12 @@ class MemMachineRestClient:
                 "POST", episodic_memory_endpoint, payload, response, latency_ms
             )
         else:
-            self.statistic_fp.write(
-                f"{datetime.now().isoformat()},POST,{episodic_memory_endpoint},{latency_ms}\n"
-            )
+            self._write_statistic("POST", episodic_memory_endpoint, latency_ms)
 
+        self._record(latency_ms, response.status_code == 200)
+        if self.search_cache is not None:
+            # earlier searches of this session may now miss the new episode
+            self.search_cache.invalidate_session(session)
         if response.status_code != 200:
             raise Exception(f"Failed to post episodic memory: {response.text}")
         return response.json()
@@ -146,19 +259,32 @@ class MemMachineRestClient:
     }'
     """
 
-    def search_episodic_memory(self, query_str, limit=5):
+    def search_episodic_memory(self, query_str, limit=5, session=None, filter=None):
         search_episodic_memory_endpoint = self._get_url(
             f"{episodic_memory_path}/search"
         )
+        if session is None:
+            session = self.session
+        if filter is None:
+            filter = {}
         query = {
-            "session": self.session,
+            "session": session,
             "query": query_str,
-            "filter": {},
+            "filter": filter,
             "limit": limit,
         }
+        if self.recorder is not None:
+            self.recorder.record(f"{episodic_memory_path}/search", query)
+        cache_key = None
+        if self.search_cache is not None:
+            cache_key = self.search_cache.make_key(session, query_str, filter, limit)
+            cached = self.search_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        self._throttle("episodic/search", session, query)
 
         start_time = time.time()
-        response = requests.post(
+        response = self.http.post(
             search_episodic_memory_endpoint, json=query, timeout=300
         )
         end_time = time.time()
@@ -169,12 +295,13 @@ class MemMachineRestClient:
                 "POST", search_episodic_memory_endpoint, query, response, latency_ms
             )
         else:
-            self.statistic_fp.write(
-                f"{datetime.now().isoformat()},POST,{search_episodic_memory_endpoint},{latency_ms}\n"
-            )
+            self._write_statistic("POST", search_episodic_memory_endpoint, latency_ms)
 
+        self._record(latency_ms, response.status_code == 200)
         if response.status_code != 200:
             raise Exception(f"Failed to search episodic memory: {response.text}")
+        if cache_key is not None:
+            self.search_cache.put(cache_key, response.content, latency_ms)
         return response.json()
 
 
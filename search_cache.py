@@ -0,0 +1,103 @@
+import json
+import threading
+import time
+
+from collections import OrderedDict
+
+from dedup import normalize_text
+
+
+def session_key(session):
+    return json.dumps(session, sort_keys=True, separators=(",", ":"))
+
+
+class SearchCache:
+    """LRU + TTL cache of raw search_episodic_memory responses.
+
+    Entries are keyed on (session, normalized query, filter, limit) and
+    hold the response body bytes, so hits are decoded fresh and callers
+    cannot mutate cached results. Eviction happens on max_entries,
+    max_bytes or ttl_s, and posting an episode to a session drops every
+    cached search of that session.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 2**20, ttl_s=300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key: cache key, value: (expires, body)
+        self.by_session = {}  # key: session key, value: set of cache keys
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.miss_latency_ms = 0.0
+
+    def make_key(self, session, query_str, filter, limit):
+        return (
+            session_key(session),
+            normalize_text(query_str),
+            json.dumps(filter, sort_keys=True, separators=(",", ":")),
+            limit,
+        )
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            body = entry[1]
+        return json.loads(body)
+
+    def put(self, key, body, latency_ms=0.0):
+        with self.lock:
+            self.miss_latency_ms += latency_ms
+            if len(body) > self.max_bytes:
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + self.ttl_s, body)
+            self.by_session.setdefault(key[0], set()).add(key)
+            self.nbytes += len(body)
+            while len(self.entries) > self.max_entries or self.nbytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate_session(self, session):
+        with self.lock:
+            for key in self.by_session.pop(session_key(session), ()):
+                if key in self.entries:
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def _remove(self, key):
+        _, body = self.entries.pop(key)
+        self.nbytes -= len(body)
+        keys = self.by_session.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_session[key[0]]
+
+    def statistics(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            avg_miss_ms = self.miss_latency_ms / self.misses if self.misses else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.nbytes,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "saved_ms_estimate": self.hits * avg_miss_ms,
+            }
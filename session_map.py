@@ -0,0 +1,110 @@
+import fnmatch
+import glob
+import json
+import os
+
+SESSION_FIELDS = ("group_id", "agent_id", "user_id", "session_id")
+RULE_KEYS = ("file", "conversation", "session")
+
+
+def glob_base(pattern):
+    """Leading directories of a glob pattern before the first magic part"""
+    parts = []
+    for part in os.path.normpath(pattern).split(os.sep)[:-1]:
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or "."
+
+
+class SessionMapper:
+    """Session envelope per source file and conversation from a list of rules.
+
+    Each rule may match the source file ("file", a glob against the path,
+    its path relative to the migrated directory and its name) and the
+    conversation id ("conversation", a glob or a list of ids). The first
+    matching rule's "session" fields replace those of the default session.
+    String values are formatted with {file}, {stem}, {conversation},
+    {group_id} and {session_id} of the default session, e.g.
+        [{"file": "acme/*", "session": {"group_id": "acme", "user_id": ["{stem}"]}},
+         {"conversation": ["1", "2"], "session": {"agent_id": ["support"]}}]
+    Conversations no rule matches keep the default session. root is the
+    migrated directory or glob in multi-file mode; a single file run, the
+    sharded mode included, has no root and matches "file" against the path
+    and the file name only.
+    """
+
+    def __init__(self, rules, root=None):
+        if isinstance(rules, dict):
+            rules = [rules]
+        for rule in rules:
+            for key in rule:
+                if key not in RULE_KEYS:
+                    raise Exception(f"Error: Invalid session map rule key: {key}")
+            for field in rule.get("session", {}):
+                if field not in SESSION_FIELDS:
+                    raise Exception(f"Error: Invalid session map field: {field}")
+        self.rules = rules
+        # root: migrated directory or glob, "file" globs also see paths
+        # relative to it (to the glob's base directory)
+        self.root = root
+
+    @classmethod
+    def from_file(cls, rules_file, root=None):
+        with open(rules_file, "r") as f:
+            return cls(json.load(f), root=root)
+
+    def _file_names(self, chat_file):
+        names = [chat_file, os.path.basename(chat_file)]
+        if self.root and os.path.isdir(self.root):
+            names.append(os.path.relpath(chat_file, self.root))
+        elif self.root and glob.has_magic(self.root):
+            names.append(os.path.relpath(chat_file, glob_base(self.root)))
+        return names
+
+    def _matches(self, rule, chat_file, conv_id):
+        if "file" in rule and not any(
+            fnmatch.fnmatch(name, rule["file"]) for name in self._file_names(chat_file)
+        ):
+            return False
+        if "conversation" in rule:
+            pattern = rule["conversation"]
+            if isinstance(pattern, list):
+                return str(conv_id) in [str(p) for p in pattern]
+            return fnmatch.fnmatch(str(conv_id), str(pattern))
+        return True
+
+    def __call__(self, chat_file, conv_id, session):
+        for rule in self.rules:
+            if not self._matches(rule, chat_file, conv_id):
+                continue
+            values = {
+                "file": chat_file,
+                "stem": os.path.splitext(os.path.basename(chat_file))[0],
+                "conversation": conv_id,
+                "group_id": session.get("group_id"),
+                "session_id": session.get("session_id"),
+            }
+            mapped = dict(session)
+            for field, value in rule.get("session", {}).items():
+                try:
+                    if isinstance(value, list):
+                        value = [v.format(**values) for v in value]
+                    else:
+                        value = value.format(**values)
+                except KeyError as e:
+                    raise Exception(f"Error: Unknown session map placeholder: {e}")
+                mapped[field] = value
+            return mapped
+        return session
+
+
+def make_session_mapper(session_map, root=None):
+    """Session mapper of a callable, rules list or JSON rules file, None without"""
+    if not session_map:
+        return None
+    if callable(session_map):
+        return session_map
+    if isinstance(session_map, (list, dict)):
+        return SessionMapper(session_map, root=root)
+    return SessionMapper.from_file(session_map, root=root)
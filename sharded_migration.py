@@ -0,0 +1,288 @@
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+import zlib
+
+from tqdm import tqdm
+
+
+def shard_of(key, num_shards):
+    """Stable shard index for a conversation / session id"""
+    return zlib.crc32(key.encode("utf-8")) % num_shards
+
+
+class ShardCheckpoint:
+    """Per shard record of how many messages of each session were posted.
+
+    The file is rewritten atomically every flush_every updates and at the
+    end of every conversation, so a restarted shard re-posts at most
+    flush_every messages per session.
+    """
+
+    def __init__(self, checkpoint_file, flush_every=100):
+        self.checkpoint_file = checkpoint_file
+        self.flush_every = flush_every
+        self.lock = threading.Lock()
+        self.offsets = {}  # key: session id, value: messages posted
+        self.pending = 0
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file, "r") as f:
+                self.offsets = json.load(f)["offsets"]
+
+    def offset(self, session_id):
+        with self.lock:
+            return self.offsets.get(session_id, 0)
+
+    def update(self, session_id, posted):
+        with self.lock:
+            self.offsets[session_id] = posted
+            self.pending += 1
+            if self.pending >= self.flush_every:
+                self._write()
+
+    def flush(self):
+        with self.lock:
+            if self.pending:
+                self._write()
+
+    def _write(self):
+        tmp_file = f"{self.checkpoint_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"offsets": self.offsets}, f)
+        os.replace(tmp_file, self.checkpoint_file)
+        self.pending = 0
+
+
+def _run_shard(
+    shard, num_shards, hack_kwargs, migrate_kwargs, checkpoint_file, events
+):
+    """Worker process entry point: migrate the conversations of one shard"""
+    from migration import MigrationHack
+    from profiling import print_stage_table
+    from rate_limit import make_rate_limiter
+    from restcli import MemMachineRestClient
+
+    recorder = None
+    try:
+        statistic_dir = os.path.dirname(checkpoint_file)
+        if hack_kwargs.get("record_file"):
+            from replay import TrafficRecorder
+
+            # one recording per shard, replay.py replays them one at a time
+            root, ext = os.path.splitext(hack_kwargs["record_file"])
+            recorder = TrafficRecorder(
+                f"{root}_shard_{shard}_of_{num_shards}{ext}",
+                bodies=hack_kwargs.get("record_bodies", False),
+            )
+        # shards share file backed buckets, the limits hold across processes
+        rate_limiter = make_rate_limiter(
+            hack_kwargs.get("rate_limits"),
+            hack_kwargs.get("rate_limit_dir")
+            or os.path.join(statistic_dir, "rate_limits"),
+        )
+        client = MemMachineRestClient(
+            base_url=hack_kwargs["base_url"],
+            verbose=False,
+            pool_size=hack_kwargs.get("max_workers", 10),
+            statistic_file=os.path.join(
+                statistic_dir, f"statistic_shard_{shard}_of_{num_shards}.csv"
+            ),
+            recorder=recorder,
+            rate_limiter=rate_limiter,
+        )
+        pending = [0]
+        pending_lock = threading.Lock()
+
+        def on_progress(conv_id, n):
+            # batch progress events to keep queue traffic low, called from
+            # every insert thread
+            with pending_lock:
+                pending[0] += n
+                if pending[0] < 50:
+                    return
+                n, pending[0] = pending[0], 0
+            events.put(("progress", shard, n))
+
+        hack = MigrationHack(
+            client=client,
+            progress=False,
+            checkpoint=ShardCheckpoint(checkpoint_file),
+            on_progress=on_progress,
+            shard_name=f"shard_{shard}_of_{num_shards}",
+            **hack_kwargs,
+        )
+        hack.conv_filter = lambda conv_id: (
+            shard_of(hack.session_for(conv_id)["session_id"], num_shards) == shard
+        )
+        with hack.profiling(f"shard_{shard}_of_{num_shards}"):
+            hack.load()
+            if hack.dedup:
+                hack.dedup_messages()
+            if migrate_kwargs["summarize"]:
+                hack.summarize_messages(migrate_kwargs["summarize_every"])
+            contents = hack.insert_contents(migrate_kwargs["summarize"])
+            remaining = 0
+            conv_ids = set()
+            for level, store in contents:
+                for conv_id, messages in store.items():
+                    conv_ids.add(conv_id)
+                    remaining += len(messages) - hack.checkpoint.offset(
+                        hack.checkpoint_key(conv_id, level)
+                    )
+            events.put(("total", shard, remaining))
+            start_time = time.time()
+            hack.insert_memories(migrate_kwargs["summarize"])
+            with pending_lock:
+                n, pending[0] = pending[0], 0
+            events.put(("progress", shard, n))
+            stats = client.statistics()
+            stats["conversations"] = len(conv_ids)
+            stats["elapsed_s"] = time.time() - start_time
+            if hack.verify:
+                verify_report = hack.verify_memories(migrate_kwargs["summarize"])
+                stats["verify_checked"] = verify_report["checked"]
+                stats["verify_hits"] = verify_report["hits"]
+        stats["stages"] = hack.timer.report()
+        print_stage_table(stats["stages"], f"Stage timings of shard {shard}")
+        events.put(("done", shard, stats))
+    except Exception as e:
+        events.put(("error", shard, f"{e}\n{traceback.format_exc()}"))
+        raise
+    finally:
+        if recorder is not None:
+            recorder.close()
+
+
+class ShardedMigration:
+    """Coordinator for a shared-nothing multi-process migration.
+
+    Conversations are sharded by a stable hash of their session id over
+    num_shards worker processes. Each worker has its own MigrationHack,
+    client connection pool and checkpoint file, and streams progress and
+    statistics back to the coordinator over a queue. A single shard can be
+    rerun alone with shards=[i], resuming from its checkpoint.
+    """
+
+    def __init__(
+        self,
+        num_shards,
+        checkpoint_dir="checkpoints",
+        shards=None,
+        **hack_kwargs,
+    ):
+        self.num_shards = num_shards
+        self.checkpoint_dir = checkpoint_dir
+        self.shards = shards if shards is not None else list(range(num_shards))
+        self.hack_kwargs = hack_kwargs
+        self.results = {}  # key: shard, value: statistics dict or error string
+
+    def checkpoint_file(self, shard, summarize=False, summarize_every=20):
+        from migration import MigrationHack
+
+        # keyed like the caches, a run with other roles, branches, merge,
+        # dedup or summary options never resumes from these offsets
+        content_name = MigrationHack(**self.hack_kwargs).content_name(
+            summarize, summarize_every
+        )
+        return os.path.join(
+            self.checkpoint_dir,
+            f"{content_name}_shard_{shard}_of_{self.num_shards}.json",
+        )
+
+    def migrate(self, summarize=False, summarize_every=20):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        migrate_kwargs = {"summarize": summarize, "summarize_every": summarize_every}
+        events = multiprocessing.Queue()
+        workers = {}
+        for shard in self.shards:
+            worker = multiprocessing.Process(
+                target=_run_shard,
+                args=(
+                    shard,
+                    self.num_shards,
+                    self.hack_kwargs,
+                    migrate_kwargs,
+                    self.checkpoint_file(shard, summarize, summarize_every),
+                    events,
+                ),
+                name=f"shard-{shard}",
+            )
+            worker.start()
+            workers[shard] = worker
+        print(f"== Started {len(workers)} of {self.num_shards} shard workers")
+
+        pbar = tqdm(total=0, desc="Migrated", unit="msg")
+        while True:
+            try:
+                kind, shard, value = events.get(timeout=0.5)
+            except queue.Empty:
+                if not any(w.is_alive() for w in workers.values()):
+                    break
+                continue
+            if kind == "total":
+                pbar.total += value
+                pbar.refresh()
+            elif kind == "progress":
+                pbar.update(value)
+            else:
+                self.results[shard] = value
+        pbar.close()
+        # drain anything sent just before the last worker exited
+        while True:
+            try:
+                kind, shard, value = events.get_nowait()
+            except queue.Empty:
+                break
+            if kind in ("done", "error"):
+                self.results[shard] = value
+        for shard, worker in workers.items():
+            worker.join()
+            if shard not in self.results:
+                self.results[shard] = f"worker exited with code {worker.exitcode}"
+        self.report()
+        return self.results
+
+    def failed_shards(self):
+        return [s for s, r in sorted(self.results.items()) if not isinstance(r, dict)]
+
+    def report(self):
+        done = {s: r for s, r in self.results.items() if isinstance(r, dict)}
+        requests_total = sum(r["requests"] for r in done.values())
+        errors = sum(r["errors"] for r in done.values())
+        latency_total = sum(r["latency_ms_total"] for r in done.values())
+        latency_max = max([r["latency_ms_max"] for r in done.values()] or [0.0])
+        elapsed = max([r["elapsed_s"] for r in done.values()] or [0.0])
+        for shard in sorted(done):
+            r = done[shard]
+            print(
+                f"   shard {shard}: {r['conversations']} conversations, "
+                f"{r['requests']} requests, {r['errors']} errors, "
+                f"avg {r['latency_ms_avg']:.1f} ms in {r['elapsed_s']:.1f}s"
+                + (
+                    f", throttled {r['throttled_ms_total'] / 1000:.1f}s"
+                    if r.get("throttled_ms_total")
+                    else ""
+                )
+            )
+        avg = latency_total / requests_total if requests_total else 0.0
+        rate = requests_total / elapsed if elapsed else 0.0
+        print(
+            f"== Sharded migration: {len(done)} of {len(self.results)} shards done, "
+            f"{requests_total} requests, {errors} errors, avg {avg:.1f} ms, "
+            f"max {latency_max:.1f} ms, {rate:.1f} req/s"
+        )
+        checked = sum(r.get("verify_checked", 0) for r in done.values())
+        if checked:
+            hits = sum(r.get("verify_hits", 0) for r in done.values())
+            print(
+                f"== Verify: hit-rate {hits * 100.0 / checked:.1f}% ({hits}/{checked})"
+            )
+        for shard in self.failed_shards():
+            print(f"   shard {shard} failed: {self.results[shard]}")
+            print(
+                f"   restart it alone with --workers {self.num_shards} --shard {shard}"
+            )
@@ -0,0 +1,276 @@
+import json
+import os
+import re
+import time
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class SummaryBackend:
+    """Interface used by MigrationHack.summarize_messages.
+
+    summarize(text) returns the summary string of one batch of messages or
+    raises an Exception. name tags the summary cache files of the backend.
+    summarize_all() is what summarize_messages calls, backends that submit
+    many batches at once override it.
+    """
+
+    name = "base"
+
+    def summarize(self, text):
+        raise NotImplementedError
+
+    def summarize_all(self, batches, job_name=None):
+        """Yield the summary of every (custom_id, text) batch in order, "" on error.
+
+        job_name is a path prefix for any work files of the backend.
+        """
+        for custom_id, text in batches:
+            try:
+                yield self.summarize(text)
+            except Exception as e:
+                print(f"Error processing batch {custom_id}: {e}")
+                yield ""
+
+
+class OpenAIBackend(SummaryBackend):
+    """Chat completions summary through the OpenAI API"""
+
+    name = "openai"
+
+    def __init__(self, api_key, base_url="https://api.openai.com/v1", model=None):
+        from openai import OpenAISummary
+
+        self.openai_summary = OpenAISummary(api_key=api_key, base_url=base_url)
+        if model:
+            self.openai_summary.model = model
+
+    def summarize(self, text):
+        response = self.openai_summary.summarize(text)
+        if "choices" in response and len(response["choices"]) > 0:
+            return response["choices"][0]["message"]["content"]
+        raise Exception(f"No summary generated, response: {response}")
+
+
+class OpenAICompatibleBackend(OpenAIBackend):
+    """Chat completions summary through any OpenAI compatible endpoint,
+    e.g. a local vLLM, llama.cpp or Ollama server"""
+
+    name = "compatible"
+
+    def __init__(self, base_url, model, api_key=None):
+        super().__init__(api_key, base_url=base_url, model=model)
+
+
+class OpenAIBatchBackend(OpenAIBackend):
+    """Summaries through the OpenAI Batch API file workflow.
+
+    All pending batches are written to {job_name}_requests.jsonl, uploaded
+    and submitted as one batch job, which is polled until it ends. The
+    output file is merged back by custom_id. The job id is kept in
+    {job_name}_state.json so an interrupted run polls the same job again
+    instead of submitting a new one. Summaries share the openai cache.
+    """
+
+    name = "openai"
+    final_statuses = ("completed", "failed", "expired", "cancelled")
+
+    def __init__(
+        self,
+        api_key,
+        base_url="https://api.openai.com/v1",
+        model=None,
+        poll_interval=30.0,
+        timeout=24 * 3600.0,
+    ):
+        super().__init__(api_key, base_url=base_url, model=model)
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def write_requests(self, batches, request_file):
+        custom_ids = []
+        with open(request_file, "w") as f:
+            for custom_id, text in batches:
+                request = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": self.openai_summary.chat_payload(text),
+                }
+                f.write(json.dumps(request) + "\n")
+                custom_ids.append(custom_id)
+        return custom_ids
+
+    def submit(self, request_file, state_file):
+        if os.path.exists(state_file):
+            with open(state_file, "r") as f:
+                batch_id = json.load(f)["batch_id"]
+            print(f"== Resuming summary batch {batch_id}")
+            return batch_id
+        input_file = self.openai_summary.upload_file(request_file)
+        batch = self.openai_summary.create_batch(input_file["id"])
+        with open(state_file, "w") as f:
+            json.dump({"batch_id": batch["id"], "input_file_id": input_file["id"]}, f)
+        print(f"== Submitted summary batch {batch['id']}")
+        return batch["id"]
+
+    def wait(self, batch_id):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            batch = self.openai_summary.get_batch(batch_id)
+            if batch["status"] in self.final_statuses:
+                return batch
+            if time.monotonic() > deadline:
+                raise Exception(
+                    f"Error: summary batch {batch_id} still {batch['status']} after {self.timeout}s"
+                )
+            time.sleep(self.poll_interval)
+
+    def results(self, batch):
+        """custom_id -> summary of the completed requests of a batch"""
+        summaries = {}
+        if batch.get("output_file_id"):
+            content = self.openai_summary.file_content(batch["output_file_id"])
+            for line in content.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get("response") or {}
+                choices = (response.get("body") or {}).get("choices")
+                if response.get("status_code") == 200 and choices:
+                    summaries[result["custom_id"]] = choices[0]["message"]["content"]
+                else:
+                    print(
+                        f"Error processing batch {result['custom_id']}: {result.get('error') or response}"
+                    )
+        return summaries
+
+    def summarize_all(self, batches, job_name=None):
+        job_name = job_name or "summary_batch"
+        request_file = f"{job_name}_requests.jsonl"
+        state_file = f"{job_name}_state.json"
+        custom_ids = self.write_requests(batches, request_file)
+        if not custom_ids:
+            return
+        batch = self.wait(self.submit(request_file, state_file))
+        summaries = self.results(batch)
+        if batch["status"] != "completed":
+            print(f"Error: summary batch {batch['id']} {batch['status']}")
+        # the caller caches the summaries, a rerun submits only what is missing
+        try:
+            os.remove(state_file)
+        except FileNotFoundError:
+            pass
+        for custom_id in custom_ids:
+            if custom_id not in summaries:
+                print(f"Error processing batch {custom_id}: no result")
+            yield summaries.get(custom_id, "")
+
+
+class ExtractiveSummarizer(SummaryBackend):
+    """Offline extractive summary: the top TextRank (or TF-IDF) sentences.
+
+    Sentences are ranked on a TF-IDF matrix built with NumPy, by PageRank
+    over their cosine similarity graph (textrank) or by the norm of their
+    TF-IDF vector (tfidf), and the best max_sentences are returned in
+    their original order. Runs on CPU with no network access.
+    """
+
+    name = "extractive"
+
+    def __init__(
+        self, max_sentences=3, method="textrank", damping=0.85, iterations=30
+    ):
+        try:
+            import numpy
+        except ImportError:
+            raise Exception(
+                "Error: the extractive summarizer needs numpy, pip install numpy"
+            )
+        if method not in ("textrank", "tfidf"):
+            raise Exception(f"Error: Invalid extractive method: {method}")
+        self.np = numpy
+        self.max_sentences = max_sentences
+        self.method = method
+        self.damping = damping
+        self.iterations = iterations
+
+    def split_sentences(self, text):
+        return [s.strip() for s in _SENTENCE_RE.split(text) if s and s.strip()]
+
+    def _tfidf(self, sentences):
+        np = self.np
+        vocab = {}
+        rows = []
+        cols = []
+        for row, sentence in enumerate(sentences):
+            for token in _TOKEN_RE.findall(sentence.lower()):
+                rows.append(row)
+                cols.append(vocab.setdefault(token, len(vocab)))
+        tf = np.zeros((len(sentences), max(1, len(vocab))), dtype=np.float32)
+        np.add.at(
+            tf, (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)), 1.0
+        )
+        df = np.count_nonzero(tf, axis=0)
+        idf = np.log((1.0 + len(sentences)) / (1.0 + df)) + 1.0
+        return tf * idf
+
+    def rank(self, sentences):
+        """Score of every sentence, higher is more central"""
+        np = self.np
+        tfidf = self._tfidf(sentences)
+        norms = np.linalg.norm(tfidf, axis=1)
+        if self.method == "tfidf":
+            return norms
+        unit = tfidf / np.maximum(norms, 1e-12)[:, None]
+        similarity = unit @ unit.T
+        np.fill_diagonal(similarity, 0.0)
+        out_weight = similarity.sum(axis=1)
+        # sentences with no similar sentence link to every sentence
+        transition = np.where(
+            out_weight[:, None] > 0,
+            similarity / np.maximum(out_weight, 1e-12)[:, None],
+            1.0 / len(sentences),
+        )
+        n = len(sentences)
+        scores = np.full(n, 1.0 / n, dtype=np.float32)
+        for _ in range(self.iterations):
+            scores = (1.0 - self.damping) / n + self.damping * (transition.T @ scores)
+        return scores
+
+    def summarize(self, text):
+        sentences = self.split_sentences(text)
+        if len(sentences) <= self.max_sentences:
+            return " ".join(sentences)
+        scores = self.rank(sentences)
+        best = self.np.argsort(-scores, kind="stable")[: self.max_sentences]
+        return " ".join(sentences[i] for i in sorted(best))
+
+
+SUMMARY_BACKENDS = ("openai", "batch", "compatible", "extractive")
+
+
+def make_summary_backend(name, api_key=None, base_url=None, model=None):
+    """Build a SummaryBackend from its name and endpoint options"""
+    if name == "openai":
+        if not api_key:
+            raise Exception("Error: API key not found, please configure api_key.json")
+        return OpenAIBackend(
+            api_key, base_url=base_url or "https://api.openai.com/v1", model=model
+        )
+    if name == "batch":
+        if not api_key:
+            raise Exception("Error: API key not found, please configure api_key.json")
+        return OpenAIBatchBackend(
+            api_key, base_url=base_url or "https://api.openai.com/v1", model=model
+        )
+    if name == "compatible":
+        if not base_url:
+            raise Exception("Error: the compatible summarizer needs --summarizer_url")
+        return OpenAICompatibleBackend(
+            base_url, model or "gpt-4.1-mini", api_key=api_key
+        )
+    if name == "extractive":
+        return ExtractiveSummarizer()
+    raise Exception(f"Error: Invalid summarizer: {name}")
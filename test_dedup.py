@@ -0,0 +1,30 @@
+from dedup import MessageDeduplicator, exact_fingerprint, simhash
+
+
+def test_exact_duplicates_removed_per_session():
+    dedup = MessageDeduplicator()
+    kept = dedup.filter(["Hello there", "hello   there", "How are you?"], 1)
+    assert kept == ["Hello there", "How are you?"]
+    # a different session keeps its own fingerprints
+    assert dedup.filter(["Hello there"], 2) == ["Hello there"]
+    assert dedup.exact_removed == 1
+
+
+def test_user_scope_shares_fingerprints():
+    dedup = MessageDeduplicator(scope="user")
+    dedup.filter(["Hello there"], 1)
+    assert dedup.filter(["Hello there"], 2) == []
+
+
+def test_near_duplicates_within_window():
+    text = "I went hiking in the mountains with my sister last weekend and it was great"
+    near = text.replace("great", "awesome")
+    dedup = MessageDeduplicator(near=True)
+    assert exact_fingerprint(text) != exact_fingerprint(near)
+    assert (simhash(text) ^ simhash(near)).bit_count() <= dedup.max_distance
+    assert dedup.filter([text, near, "Something unrelated entirely"], 1) == [
+        text,
+        "Something unrelated entirely",
+    ]
+    assert dedup.near_removed == 1
+    assert "removed 1 of 3" in dedup.report()
@@ -0,0 +1,90 @@
+from loadgen import SearchLoadGenerator, load_query_file, percentile
+
+
+class FakeSearchClient:
+    session = {"group_id": "g", "user_id": ["u"], "session_id": "s"}
+
+    def __init__(self):
+        self.sessions = []
+
+    def search_episodic_memory(self, query_str, limit=5, session=None):
+        self.sessions.append(session)
+        if query_str == "fail":
+            raise Exception("server error")
+        return {"status": 0, "content": {"episodic_memory": [[{"content": "m"}]]}}
+
+    def statistics(self):
+        return {}
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) == 0.0
+
+
+def test_query_file(tmp_path):
+    query_file = tmp_path / "queries.txt"
+    query_file.write_text('plain query\n\n{"query": "q2", "session_id": "conversation_3"}\n')
+    assert load_query_file(str(query_file)) == [
+        ("plain query", None),
+        ("q2", "conversation_3"),
+    ]
+
+
+def test_open_loop_run_counts_errors():
+    client = FakeSearchClient()
+    generator = SearchLoadGenerator(
+        client,
+        [("ok", "conversation_1"), ("fail", None)],
+        qps=200,
+        duration=0.1,
+        arrival="uniform",
+    )
+    report = generator.run()
+    assert report["sent"] == 20
+    assert report["errors"] == 10
+    assert report["results_avg"] == 1.0
+    assert {"group_id": "g", "user_id": ["u"], "session_id": "conversation_1"} in (
+        client.sessions
+    )
+
+
+def test_derived_queries_use_migrated_sessions(tmp_path):
+    import json
+
+    from loadgen import derive_queries
+    from migration import MigrationHack
+
+    user_session_file = tmp_path / "user_session.json"
+    user_session_file.write_text(
+        json.dumps(
+            {
+                "group_id": "g",
+                "agent_id": ["a"],
+                "user_id": ["u"],
+                "session_id": "s",
+            }
+        )
+    )
+    (tmp_path / "alice_extracted_conv_2.txt").write_text("we went hiking on sunday\n")
+    hack = MigrationHack(
+        user_session_file=str(user_session_file),
+        chat_history_file="export/alice.json",
+        extract_dir=str(tmp_path),
+        identity="alice",
+        session_map=[{"conversation": "2", "session": {"group_id": "acme"}}],
+    )
+    queries = derive_queries([hack], num_queries=3, query_words=2)
+    assert queries == [
+        (
+            "we went",
+            {
+                "group_id": "acme",
+                "agent_id": ["a"],
+                "user_id": ["alice"],
+                "session_id": "alice_conversation_2",
+            },
+        )
+    ] * 3
@@ -0,0 +1,69 @@
+import pytest
+
+from message_store import read_extract_file, write_extract_file
+from process_chat_history import Message
+from message_store import MessageStore
+
+
+def test_store_round_trip_and_views():
+    store = MessageStore()
+    store[1] = ["hello", "wörld", ""]
+    store[2] = (m for m in ["a", "b", "c", "d"])
+    assert len(store) == 2 and store.total_messages() == 7
+    assert list(store[1]) == ["hello", "wörld", ""]
+    view = store[2]
+    assert len(view) == 4 and view[-1] == "d"
+    assert list(view[1:3]) == ["b", "c"]
+    assert "\n".join(view[2:10]) == "c\nd"
+    assert [k for k, _ in store.items()] == [1, 2]
+
+
+def test_append_to_last_conversation():
+    store = MessageStore()
+    store[1] = []
+    store.append(1, "x")
+    store.append(1, "y")
+    assert store[1] == ["x", "y"]
+    store.append(2, "z")
+    with pytest.raises(Exception, match="only append to the last stored conversation 2"):
+        store.append(1, "late")
+
+
+def test_records_keep_metadata(tmp_path):
+    store = MessageStore()
+    store[1] = [
+        Message("hi", 1700000000.0, "user", "node-1"),
+        "plain",
+        Message("line\nbreak", None, "Alice", "D1:2"),
+    ]
+    records = list(store[1].records())
+    assert records[0] == Message("hi", 1700000000.0, "user", "node-1")
+    assert records[1] == Message("plain", None, None, None)
+    assert list(store[1][2:].records())[0].speaker == "Alice"
+
+    extract_file = str(tmp_path / "x_extracted_conv_1.txt")
+    write_extract_file(extract_file, records)
+    reread = list(read_extract_file(extract_file))
+    assert reread[0] == records[0] and reread[1] == records[1]
+    assert reread[2] == Message("line break", None, "Alice", "D1:2")
+
+
+def test_spill_to_disk_matches_in_memory(tmp_path):
+    messages = [f"message {i} " + "x" * (i % 50) for i in range(2000)]
+    records = [Message(m, float(i), "Alice", f"D{i}") for i, m in enumerate(messages)]
+    memory = MessageStore()
+    spill = MessageStore(max_memory=4096, spill_dir=str(tmp_path / "spill"))
+    for store in (memory, spill):
+        store[1] = records[:1500]
+        store[2] = []
+        for record in records[1500:]:
+            store.append(2, record)
+    assert spill.spilled_bytes() > 0
+    assert spill.nbytes() < memory.nbytes()
+    # the text buffers never hold more than the ceiling plus one message
+    assert len(spill._buffer.memory) <= 4096 + 100
+    for conv_id in (1, 2):
+        assert spill[conv_id] == memory[conv_id]
+        assert list(spill[conv_id].records()) == list(memory[conv_id].records())
+    assert list(spill[1][10:13]) == messages[10:13]
+    assert spill[2][-1] == messages[-1]
@@ -0,0 +1,127 @@
+import json
+import os
+import sys
+
+import pytest
+
+from multi_migration import discover_chat_files, file_identity, is_multi_file
+from process_chat_history import detect_chat_type
+
+
+def test_discover_and_detect(tmp_path):
+    locomo = tmp_path / "user a.json"
+    locomo.write_text(json.dumps([{"conversation": {"session_1": []}}]))
+    os.makedirs(tmp_path / "sub")
+    openai = tmp_path / "sub" / "b.json"
+    openai.write_text(json.dumps([{"title": "t", "mapping": {}}]))
+    (tmp_path / "notes.txt").write_text("not a chat")
+
+    assert is_multi_file(str(tmp_path)) and is_multi_file(str(tmp_path / "*.json"))
+    assert not is_multi_file(str(locomo))
+    files = discover_chat_files(str(tmp_path))
+    assert files == [str(tmp_path / "sub" / "b.json"), str(locomo)]
+    assert detect_chat_type(str(locomo)) == "locomo"
+    assert detect_chat_type(str(openai)) == "openai"
+    assert file_identity(str(openai), str(tmp_path)) == "sub_b"
+    assert file_identity(str(locomo), str(tmp_path)) == "user_a"
+
+
+def test_count_conversations_uses_file_index(tmp_path):
+    from multi_migration import MultiFileMigration
+
+    chat_dir = tmp_path / "chats"
+    os.makedirs(chat_dir)
+    for name, count in (("a", 2), ("b", 3)):
+        (chat_dir / f"{name}.json").write_text(
+            json.dumps([{"conversation": {"session_1": []}}] * count)
+        )
+    # no api_key.json: a dry run must not need it
+    multi = MultiFileMigration(
+        str(chat_dir),
+        extract_dir=str(tmp_path / "extracted"),
+        api_key_file=str(tmp_path / "missing_api_key.json"),
+    )
+    files = [str(chat_dir / "a.json"), str(chat_dir / "b.json")]
+    assert multi.count_conversations() == dict(zip(files, [2, 3]))
+    index_file = tmp_path / "extracted" / "a_index.json"
+    assert json.loads(index_file.read_text())["conversations"] == 2
+
+    # an index matching size and mtime is trusted without parsing the file
+    index = json.loads(index_file.read_text())
+    index_file.write_text(json.dumps(dict(index, conversations=7)))
+    assert multi.count_conversations()[files[0]] == 7
+    (chat_dir / "a.json").write_text(json.dumps([{"conversation": {}}] * 4))
+    assert multi.count_conversations()[files[0]] == 4
+
+
+def test_glob_identity_keeps_same_named_files_apart(tmp_path):
+    import pytest
+    from multi_migration import MultiFileMigration
+
+    for user in ("alice", "bob"):
+        os.makedirs(tmp_path / "export" / user)
+        (tmp_path / "export" / user / "conversations.json").write_text(
+            json.dumps([{"title": "t", "mapping": {}}])
+        )
+    pattern = str(tmp_path / "export" / "*" / "conversations.json")
+    multi = MultiFileMigration(pattern, extract_dir=str(tmp_path / "extracted"))
+    files = multi.chat_files()
+    assert [file_identity(f, pattern) for f in files] == [
+        "alice_conversations",
+        "bob_conversations",
+    ]
+
+    # a name collision left after sanitizing fails before anything runs
+    (tmp_path / "export" / "bob_conversations.json").write_text("[]")
+    multi = MultiFileMigration(
+        str(tmp_path / "export" / "**" / "*.json"),
+        extract_dir=str(tmp_path / "extracted"),
+    )
+    with pytest.raises(Exception, match="share identity bob_conversations"):
+        multi.chat_files()
+
+
+def test_unreadable_index_is_recounted(tmp_path):
+    from migration import MigrationHack
+
+    chat_file = tmp_path / "chat.json"
+    chat_file.write_text(json.dumps([{"conversation": {"session_1": []}}] * 3))
+    hack = MigrationHack(
+        chat_history_file=str(chat_file),
+        chat_type="locomo",
+        extract_dir=str(tmp_path / "extracted"),
+    )
+    os.makedirs(tmp_path / "extracted")
+    # what a reader saw of an index being written in place
+    (tmp_path / "extracted" / "chat_index.json").write_text("")
+    assert hack.count_conversations() == 3
+    index = json.loads((tmp_path / "extracted" / "chat_index.json").read_text())
+    assert index["conversations"] == 3
+    assert not list((tmp_path / "extracted").glob("*.tmp"))
+
+
+def test_discover_skips_migration_output(tmp_path):
+    chat = tmp_path / "chat.json"
+    chat.write_text(json.dumps([{"conversation": {"session_1": []}}]))
+    for name in (
+        "chat_index.json",
+        "chat_summarized_batch_state.json",
+        "chat_messages_shard_0_of_2.json",
+    ):
+        (tmp_path / name).write_text("{}")
+    os.makedirs(tmp_path / "extracted")
+    (tmp_path / "extracted" / "other.json").write_text("{}")
+    files = discover_chat_files(
+        str(tmp_path), exclude_dirs=[str(tmp_path / "extracted")]
+    )
+    assert files == [str(chat)]
+
+
+def test_workers_rejected_for_multi_file_input(tmp_path, monkeypatch):
+    from migration import get_args
+
+    monkeypatch.setattr(
+        sys, "argv", ["migration.py", "--chat_history", str(tmp_path), "--workers", "2"]
+    )
+    with pytest.raises(SystemExit):
+        get_args()
@@ -0,0 +1,144 @@
+import datetime
+import json
+
+from process_chat_history import (
+    Message,
+    load_openai,
+    new_locomo_date_stats,
+    parse_locomo_date,
+)
+
+
+def openai_node(node_id, role, ts, content, parent=None, children=()):
+    return {
+        "id": node_id,
+        "parent": parent,
+        "children": list(children),
+        "message": {
+            "id": node_id,
+            "author": {"role": role},
+            "create_time": ts,
+            "content": content,
+        },
+    }
+
+
+def write_openai_chat(tmp_path, nodes, current_node=None):
+    chat = {
+        "title": "chat",
+        "create_time": 1700000000,
+        "current_node": current_node,
+        "mapping": {node["id"]: node for node in nodes},
+    }
+    path = tmp_path / "conversations.json"
+    path.write_text(json.dumps([chat]))
+    return str(path)
+
+
+def test_openai_role_and_content_type_selection(tmp_path):
+    infile = write_openai_chat(
+        tmp_path,
+        [
+            openai_node("a", "user", 1, {"content_type": "text", "parts": ["hello"]}),
+            openai_node("b", "assistant", 2, {"content_type": "text", "parts": ["hi"]}),
+            openai_node(
+                "c",
+                "assistant",
+                3,
+                {"content_type": "code", "language": "python", "text": "print(1)"},
+            ),
+            openai_node(
+                "d",
+                "user",
+                4,
+                {
+                    "content_type": "multimodal_text",
+                    "parts": [
+                        {"content_type": "image_asset_pointer"},
+                        "what is this?",
+                        {"content_type": "audio_transcription", "text": " said aloud"},
+                    ],
+                },
+            ),
+            openai_node("e", "tool", 5, {"content_type": "text", "parts": ["42"]}),
+        ],
+    )
+    assert load_openai(infile) == ["hello"]
+    assert load_openai(
+        infile,
+        roles=("user", "assistant", "tool"),
+        content_types=("text", "code", "multimodal_text"),
+    ) == ["hello", "hi", "print(1)", "what is this? said aloud", "42"]
+    records = load_openai(
+        infile,
+        roles=("user", "assistant"),
+        content_types=("text", "code"),
+        merge_consecutive=True,
+        records=True,
+    )
+    assert records == [
+        Message("hello", 1, "user", "a"),
+        Message("hi\nprint(1)", 2, "assistant", "b"),
+    ]
+
+
+def test_merge_consecutive_with_default_roles_keeps_separate_turns(tmp_path):
+    text = lambda t: {"content_type": "text", "parts": [t]}
+    infile = write_openai_chat(
+        tmp_path,
+        [
+            openai_node("q1", "user", 1, text("Q1")),
+            openai_node("a1", "assistant", 2, text("A1")),
+            openai_node("q2", "user", 3, text("Q2")),
+            openai_node("q2b", "user", 4, text("Q2 again")),
+            openai_node("a2", "assistant", 5, text("A2")),
+        ],
+    )
+    # assistant turns are filtered out but still end a run of user turns
+    assert load_openai(infile, merge_consecutive=True) == ["Q1", "Q2\nQ2 again"]
+
+
+def test_openai_thread_order_skips_abandoned_branches(tmp_path):
+    def text(t):
+        return {"content_type": "text", "parts": [t]}
+
+    # q1 was edited into q1b; timestamps tie or are missing on purpose
+    nodes = [
+        {"id": "root", "parent": None, "children": ["q1", "q1b"], "message": None},
+        openai_node("q1", "user", 5, text("first try"), "root", ["a1"]),
+        openai_node("a1", "assistant", 6, text("answer 1"), "q1"),
+        openai_node("q1b", "user", 5, text("edited"), "root", ["a1b"]),
+        openai_node("a1b", "assistant", None, text("answer 1b"), "q1b", ["q2"]),
+        openai_node("q2", "user", 4, text("follow up"), "a1b"),
+    ]
+    roles = ("user", "assistant")
+    infile = write_openai_chat(tmp_path, nodes, current_node="q2")
+    assert load_openai(infile, roles=roles) == ["edited", "answer 1b", "follow up"]
+    assert load_openai(infile, roles=roles, branches=True) == [
+        "first try",
+        "answer 1",
+        "edited",
+        "answer 1b",
+        "follow up",
+    ]
+    # without current_node the most recent leaf wins
+    infile = write_openai_chat(tmp_path, nodes)
+    assert load_openai(infile, roles=roles) == ["first try", "answer 1"]
+
+
+def test_parse_locomo_date_matches_strptime_and_counts_failures():
+    date_stats = new_locomo_date_stats()
+    for date_str, fmt in [
+        ("1:56 pm on 8 May, 2023", "%I:%M %p on %d %B, %Y"),
+        ("12:09 am on 13 September, 2023", "%I:%M %p on %d %B, %Y"),
+        ("12:00 pm on 1 Jan, 2024", "%I:%M %p on %d %b, %Y"),
+    ]:
+        expected = datetime.datetime.strptime(date_str, fmt).timestamp()
+        assert parse_locomo_date(date_str, date_stats) == expected
+    assert parse_locomo_date("last tuesday", date_stats) is None
+    assert parse_locomo_date("13:00 pm on 1 Jan, 2024", date_stats) is None
+    assert parse_locomo_date(None, date_stats) is None
+    assert date_stats == {"parsed": 3, "failed": 2, "missing": 1}
+    # without date_stats nothing is counted anywhere
+    assert parse_locomo_date(None) is None
+    assert new_locomo_date_stats() == {"parsed": 0, "failed": 0, "missing": 0}
@@ -0,0 +1,87 @@
+import json
+import threading
+import time
+
+from profiling import SamplingProfiler, StageTimer
+
+
+def busy_wait(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_stage_timer_wall_and_cpu():
+    timer = StageTimer()
+    with timer.stage("load"):
+        with timer.stage("load.parse"):
+            busy_wait(0.02)
+        time.sleep(0.02)
+    report = timer.report()
+    assert list(report) == ["load", "load.parse"]
+    assert report["load"]["wall_s"] >= 0.04
+    assert report["load.parse"]["cpu_s"] >= 0.01
+    # sleeping costs wall time but no cpu time
+    assert report["load"]["cpu_s"] < report["load"]["wall_s"] - 0.01
+
+
+def test_sampling_profiler_collapsed_stacks(tmp_path):
+    profiler = SamplingProfiler(interval=0.001).start()
+    worker = threading.Thread(target=busy_wait, args=(0.1,), name="worker_3")
+    worker.start()
+    worker.join()
+    profiler.stop()
+    collapsed_file = str(tmp_path / "profile.folded")
+    profiler.write(collapsed_file)
+    lines = open(collapsed_file).read().splitlines()
+    stacks = dict(line.rsplit(" ", 1) for line in lines)
+    worker_stacks = [s for s in stacks if s.startswith("worker;")]
+    assert worker_stacks, stacks
+    assert any(s.endswith("test_profiling.busy_wait") for s in worker_stacks)
+    assert sum(int(c) for c in stacks.values()) >= profiler.samples > 0
+
+
+def test_migrate_profile_output(tmp_path):
+    from migration import MigrationHack
+
+    chat_file = tmp_path / "profiled.json"
+    chat_file.write_text(
+        json.dumps(
+            [
+                {
+                    "conversation": {
+                        "speaker_a": "A",
+                        "speaker_b": "B",
+                        "session_1_date_time": "1:56 pm on 8 May, 2023",
+                        "session_1": [
+                            {"speaker": "A", "dia_id": "D1:1", "text": "hello"},
+                            {"speaker": "B", "dia_id": "D1:2", "text": "hi there"},
+                        ],
+                    }
+                }
+            ]
+        )
+    )
+
+    class Client:
+        def post_episodic_memory(self, message, **kwargs):
+            time.sleep(0.005)
+
+    hack = MigrationHack(
+        chat_history_file=str(chat_file),
+        extract_dir=str(tmp_path / "extracted"),
+        client=Client(),
+        progress=False,
+        profile=True,
+        profile_interval=0.001,
+        profile_dir=str(tmp_path / "output"),
+    )
+    hack.migrate()
+    stages = hack.timer.report()
+    assert stages["insert.post"]["count"] == 2
+    for name in ("load", "load.count", "load.parse", "load.cache_write", "insert"):
+        assert name in stages
+    assert (tmp_path / "output" / "profile_profiled.folded").stat().st_size > 0
+    saved = tmp_path / "output" / "profile_profiled_stages.json"
+    saved = json.loads(saved.read_text())
+    assert saved["insert.post"]["count"] == 2
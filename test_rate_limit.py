@@ -0,0 +1,136 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from memmachine_standin import MemMachineStandIn
+from rate_limit import FileTokenBucket, RateLimiter, TokenBucket
+from restcli import MemMachineRestClient
+
+
+def test_token_bucket_rate_across_threads():
+    bucket = TokenBucket(rate=100, burst=1)
+    start = time.monotonic()
+    threads = [
+        threading.Thread(target=lambda: [bucket.acquire() for _ in range(5)])
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # 20 tokens, 1 from the burst, 19 refilled at 100/s
+    assert time.monotonic() - start >= 0.17
+
+
+def test_token_bucket_oversized_request_goes_into_debt():
+    bucket = TokenBucket(rate=1000, burst=100)
+    assert bucket.acquire(50) == 0
+    start = time.monotonic()
+    bucket.acquire(150)
+    assert 0.08 <= time.monotonic() - start < 1.0
+
+
+def _drain(state_file, n):
+    bucket = FileTokenBucket(state_file, rate=50, burst=1)
+    for _ in range(n):
+        bucket.acquire()
+
+
+def test_file_token_bucket_shared_by_processes(tmp_path):
+    state_file = str(tmp_path / "bucket")
+    start = time.monotonic()
+    procs = [
+        multiprocessing.Process(target=_drain, args=(state_file, 5))
+        for _ in range(2)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert all(p.exitcode == 0 for p in procs)
+    # 10 tokens from one bucket at 50/s, separate buckets would take 0.08s
+    assert time.monotonic() - start >= 0.17
+
+
+def test_rate_limiter_scopes():
+    limiter = RateLimiter(
+        {
+            "episodic/search": {"requests_per_s": 10, "burst_s": 0.1},
+            "user_id": {"requests_per_s": 10, "bytes_per_s": 1000, "burst_s": 0.1},
+        }
+    )
+    alice = {"group_id": "g", "user_id": ["alice"]}
+    bob = {"group_id": "g", "user_id": ["bob"]}
+    assert limiter.acquire("episodic", alice, 100) == 0
+    # alice's request bucket is empty, bob has his own
+    assert limiter.acquire("episodic", alice, 100) > 0
+    assert limiter.acquire("episodic", bob, 100) == 0
+    assert limiter.acquire("episodic/search", bob, 100) > 0
+    with pytest.raises(Exception, match="Invalid rate limit scope: agent_id"):
+        RateLimiter({"agent_id": {"requests_per_s": 1}})
+
+
+def test_client_throttles_posts(tmp_path):
+    limiter = RateLimiter({"episodic": {"requests_per_s": 50, "burst_s": 0.02}})
+    with MemMachineStandIn() as standin:
+        client = MemMachineRestClient(
+            base_url=standin.base_url,
+            statistic_file=str(tmp_path / "statistic.csv"),
+            rate_limiter=limiter,
+        )
+        start = time.monotonic()
+        for i in range(11):
+            client.post_episodic_memory(f"message {i}")
+        elapsed = time.monotonic() - start
+    assert elapsed >= 0.18
+    assert client.statistics()["throttled_ms_total"] > 100
+
+
+def test_rate_limiter_sleeps_once_for_the_largest_deficit():
+    limiter = RateLimiter(
+        {
+            "episodic": {"requests_per_s": 10, "burst_s": 0.1},
+            "user_id": {"requests_per_s": 10, "bytes_per_s": 1000, "burst_s": 0.1},
+        }
+    )
+    session = {"user_id": ["alice"]}
+    limiter.acquire("episodic", session, 100)
+    # three buckets each 0.1s short, one sleep for the largest deficit
+    waited = limiter.acquire("episodic", session, 100)
+    assert 0.08 <= waited <= 0.12
+
+
+def test_file_buckets_keep_no_descriptors_open(tmp_path):
+    import os
+
+    limiter = RateLimiter(
+        {"user_id": {"requests_per_s": 1000, "bytes_per_s": 10**6}},
+        state_dir=str(tmp_path),
+        max_buckets=8,
+    )
+    open_fds = len(os.listdir("/proc/self/fd"))
+    for i in range(100):
+        limiter.acquire("episodic", {"user_id": [f"user_{i}"]}, 10)
+    assert len(os.listdir("/proc/self/fd")) == open_fds
+    assert len(limiter.buckets) == 8
+    assert len(list(tmp_path.glob("user_id_*.bucket"))) == 200
+
+
+def test_eviction_keeps_buckets_in_debt():
+    limiter = RateLimiter(
+        {"user_id": {"requests_per_s": 10, "burst_s": 0.1}}, max_buckets=2
+    )
+    alice = {"user_id": ["alice"]}
+    limiter.acquire("episodic", alice)
+    # alice owes 0.1s, new users must not push her bucket out
+    for i in range(3):
+        limiter.acquire("episodic", {"user_id": [f"user_{i}"]})
+    assert ("user_id", "alice", "requests") in limiter.buckets
+    assert limiter.buckets[("user_id", "alice", "requests")].take(1) > 0
+    time.sleep(0.25)
+    # refilled buckets are dropped again, least recently used first
+    limiter.acquire("episodic", {"user_id": ["bob"]})
+    assert len(limiter.buckets) == 2
+    assert ("user_id", "alice", "requests") not in limiter.buckets
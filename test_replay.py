@@ -0,0 +1,110 @@
+import json
+import time
+
+from memmachine_standin import MemMachineStandIn
+from replay import TrafficRecorder, TrafficReplayer, load_recording
+from restcli import MemMachineRestClient
+
+SESSION = {"group_id": "g", "agent_id": ["a"], "user_id": ["u"], "session_id": "s1"}
+
+
+def record_traffic(standin, record_file, bodies):
+    recorder = TrafficRecorder(record_file, bodies=bodies)
+    client = MemMachineRestClient(
+        base_url=standin.base_url,
+        session=SESSION,
+        statistic_file=record_file + ".csv",
+        recorder=recorder,
+    )
+    client.post_episodic_memory("we went hiking", metadata={"speaker": "Alice"})
+    time.sleep(0.1)
+    client.post_episodic_memory("the dog likes the beach", session_id="s2")
+    client.search_episodic_memory("hiking", limit=3)
+    recorder.close()
+
+
+def test_record_and_replay_bodies(tmp_path):
+    record_file = str(tmp_path / "traffic.jsonl")
+    with MemMachineStandIn() as standin:
+        record_traffic(standin, record_file, bodies=True)
+    lines = [json.loads(l) for l in open(record_file)]
+    # header, then each session is written once before its first request
+    assert [("session" in l, l.get("s")) for l in lines[1:]] == [
+        (True, 0),
+        (False, 0),
+        (True, 1),
+        (False, 1),
+        (False, 0),
+    ]
+    requests = load_recording(record_file)
+    assert [r[1] for r in requests] == [
+        "memories/episodic",
+        "memories/episodic",
+        "memories/episodic/search",
+    ]
+    assert requests[1][0] - requests[0][0] >= 0.1
+    assert requests[0][3]["metadata"] == {"speaker": "Alice"}
+
+    with MemMachineStandIn() as target:
+        client = MemMachineRestClient(
+            base_url=target.base_url, statistic_file=str(tmp_path / "replay.csv")
+        )
+        report = TrafficReplayer(client, requests, speed=2.0).run()
+        assert target.episodes == {
+            "s1": ["we went hiking"],
+            "s2": ["the dog likes the beach"],
+        }
+    assert report["sent"] == 3 and report["errors"] == 0
+    # 0.1s recorded gap at 2x speed
+    assert 0.05 <= report["elapsed_s"] < 1.0
+
+
+def test_digest_recording_keeps_sizes(tmp_path):
+    record_file = str(tmp_path / "traffic.jsonl")
+    with MemMachineStandIn() as standin:
+        record_traffic(standin, record_file, bodies=False)
+    assert "hiking" not in open(record_file).read()
+    requests = load_recording(record_file)
+    assert len(requests[0][3]["episode_content"]) == len("we went hiking")
+    assert requests[0][3]["metadata"] == {"speaker": "Alice"}
+    assert requests[2][3]["limit"] == 3
+    rerecord_file = str(tmp_path / "replayed.jsonl")
+    with MemMachineStandIn() as target:
+        client = MemMachineRestClient(
+            base_url=target.base_url,
+            statistic_file=str(tmp_path / "replay.csv"),
+            recorder=TrafficRecorder(rerecord_file),
+        )
+        report = TrafficReplayer(client, requests, speed=0).run()
+        client.recorder.close()
+        assert sorted(target.episodes) == ["s1", "s2"]
+    assert report["sent"] == 3 and report["elapsed_s"] < 1.0
+
+    # the replayed payloads are exactly as large as the recorded ones
+    def sizes(recording):
+        lines = [json.loads(l) for l in open(recording)][1:]
+        return sorted((l["ep"], l["bytes"]) for l in lines if "bytes" in l)
+
+    assert sizes(rerecord_file) == sizes(record_file)
+
+
+def test_migration_closes_its_recording(tmp_path):
+    from migration import MigrationHack
+
+    record_file = str(tmp_path / "migration.jsonl")
+    with MemMachineStandIn() as standin:
+        hack = MigrationHack(
+            base_url=standin.base_url,
+            chat_history_file="recorded.json",
+            extract_dir=str(tmp_path),
+            progress=False,
+            record_file=record_file,
+        )
+        hack.client.statistic_file = str(tmp_path / "statistic.csv")
+        hack.client.post_episodic_memory("hello")
+        recorder = hack.recorder
+        hack.close()
+        assert recorder.fp.closed and hack.recorder is None
+        # the client keeps working, unrecorded
+        hack.client.post_episodic_memory("again")
+    assert len(load_recording(record_file)) == 1
@@ -0,0 +1,57 @@
+import json
+import time
+
+from search_cache import SearchCache
+
+SESSION_1 = {"group_id": "g", "session_id": "conversation_1"}
+SESSION_2 = {"group_id": "g", "session_id": "conversation_2"}
+
+
+def body(n):
+    return json.dumps({"status": 0, "content": {"n": n}}).encode("utf-8")
+
+
+def test_hit_miss_and_normalized_key():
+    cache = SearchCache()
+    key = cache.make_key(SESSION_1, "Main  Character", {}, 5)
+    assert cache.get(key) is None
+    cache.put(key, body(1), latency_ms=40.0)
+    assert cache.get(cache.make_key(SESSION_1, "main character", {}, 5)) == {
+        "status": 0,
+        "content": {"n": 1},
+    }
+    assert cache.get(cache.make_key(SESSION_1, "main character", {}, 10)) is None
+    stats = cache.statistics()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+    assert stats["saved_ms_estimate"] == 20.0
+
+
+def test_lru_bytes_and_ttl_eviction():
+    cache = SearchCache(max_entries=2)
+    keys = [cache.make_key(SESSION_1, f"q{i}", {}, 5) for i in range(3)]
+    cache.put(keys[0], body(0))
+    cache.put(keys[1], body(1))
+    cache.get(keys[0])
+    cache.put(keys[2], body(2))
+    assert cache.get(keys[1]) is None and cache.get(keys[0]) is not None
+
+    cache = SearchCache(max_bytes=len(body(0)) * 2)
+    for i, key in enumerate(keys):
+        cache.put(key, body(i))
+    assert cache.statistics()["entries"] == 2 and cache.get(keys[0]) is None
+
+    cache = SearchCache(ttl_s=0.01)
+    cache.put(keys[0], body(0))
+    time.sleep(0.02)
+    assert cache.get(keys[0]) is None
+
+
+def test_post_invalidates_only_that_session():
+    cache = SearchCache()
+    key_1 = cache.make_key(SESSION_1, "q", {}, 5)
+    key_2 = cache.make_key(SESSION_2, "q", {}, 5)
+    cache.put(key_1, body(1))
+    cache.put(key_2, body(2))
+    cache.invalidate_session(dict(SESSION_1))
+    assert cache.get(key_1) is None and cache.get(key_2) is not None
+    assert cache.statistics()["invalidations"] == 1
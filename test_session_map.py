@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+from message_store import MessageStore
+from migration import MigrationHack
+from process_chat_history import Message
+from session_map import SessionMapper
+
+SESSION = {
+    "group_id": "default_group",
+    "agent_id": ["default_agent"],
+    "user_id": ["default_user"],
+    "session_id": "conversation_1",
+}
+
+
+class RecordingClient:
+    def __init__(self):
+        self.posts = []
+
+    def post_episodic_memory(self, message, session=None, producer=None, **kwargs):
+        self.posts.append((session, producer, message))
+
+
+def test_session_mapper_rules(tmp_path):
+    root = tmp_path / "export"
+    mapper = SessionMapper(
+        [
+            {
+                "file": "acme/*",
+                "conversation": ["2"],
+                "session": {"agent_id": ["support"], "user_id": ["{stem}_vip"]},
+            },
+            {
+                "file": "acme/*",
+                "session": {
+                    "group_id": "acme",
+                    "user_id": ["{stem}"],
+                    "session_id": "{stem}_{conversation}",
+                },
+            },
+        ],
+        root=str(root),
+    )
+    root.mkdir()
+    chat_file = str(root / "acme" / "alice.json")
+    assert mapper(chat_file, 1, SESSION) == {
+        "group_id": "acme",
+        "agent_id": ["default_agent"],
+        "user_id": ["alice"],
+        "session_id": "alice_1",
+    }
+    # first matching rule wins, unset fields keep the default
+    assert mapper(chat_file, 2, SESSION) == dict(
+        SESSION, agent_id=["support"], user_id=["alice_vip"]
+    )
+    assert mapper(str(root / "other" / "bob.json"), 1, SESSION) == SESSION
+    with pytest.raises(Exception, match="Invalid session map rule key: speaker"):
+        SessionMapper([{"speaker": "x"}])
+    with pytest.raises(Exception, match="Invalid session map field: producer"):
+        SessionMapper([{"session": {"producer": "x"}}])
+
+    # in glob mode file globs match relative to the glob's base directory
+    mapper = SessionMapper(
+        [{"file": "acme/*", "session": {"group_id": "acme"}}],
+        root=str(root / "*" / "*.json"),
+    )
+    assert mapper(chat_file, 1, SESSION)["group_id"] == "acme"
+
+
+def test_migration_posts_with_mapped_sessions(tmp_path):
+    rules_file = tmp_path / "session_map.json"
+    rules_file.write_text(
+        json.dumps(
+            [
+                {"conversation": "1", "session": {"user_id": ["alice"]}},
+                {"session": {"user_id": ["bob"], "group_id": "team_{conversation}"}},
+            ]
+        )
+    )
+    user_session_file = tmp_path / "user_session.json"
+    user_session_file.write_text(json.dumps(SESSION))
+    client = RecordingClient()
+    hack = MigrationHack(
+        user_session_file=str(user_session_file),
+        chat_history_file="tenant.json",
+        extract_dir=str(tmp_path),
+        client=client,
+        progress=False,
+        max_workers=1,
+        session_map=str(rules_file),
+        dedup=True,
+        dedup_scope="user",
+    )
+    hack.messages = MessageStore()
+    hack.messages[1] = [Message("hello", None, "user", None)]
+    hack.messages[2] = [Message("hello", None, "user", None)]
+    hack.messages[3] = [Message("hello", None, "user", None)]
+    hack.num_conversations = 3
+    hack.dedup_messages()
+    hack.insert_memories()
+    posts = sorted(
+        (s["session_id"], s["group_id"], s["user_id"], producer)
+        for s, producer, _ in client.posts
+    )
+    # user scoped dedup drops bob's second hello, not alice's
+    assert posts == [
+        ("conversation_1", "default_group", ["alice"], "alice"),
+        ("conversation_2", "team_2", ["bob"], "bob"),
+    ]
@@ -0,0 +1,47 @@
+from sharded_migration import ShardCheckpoint, ShardedMigration, shard_of
+
+
+def test_shard_of_is_stable_and_in_range():
+    shards = [shard_of(f"conversation_{i}", 4) for i in range(100)]
+    assert shards == [shard_of(f"conversation_{i}", 4) for i in range(100)]
+    assert set(shards) == {0, 1, 2, 3}
+
+
+def test_checkpoint_resumes_offsets(tmp_path):
+    checkpoint_file = str(tmp_path / "shard_0_of_2.json")
+    checkpoint = ShardCheckpoint(checkpoint_file, flush_every=2)
+    checkpoint.update("conversation_1", 1)
+    checkpoint.update("conversation_1", 2)
+    checkpoint.update("conversation_2", 1)
+    # the last update is not flushed yet, a crash would lose only it
+    assert ShardCheckpoint(checkpoint_file).offset("conversation_2") == 0
+    checkpoint.flush()
+    restarted = ShardCheckpoint(checkpoint_file)
+    assert restarted.offset("conversation_1") == 2
+    assert restarted.offset("conversation_2") == 1
+    assert restarted.offset("conversation_3") == 0
+
+
+def test_checkpoint_file_is_keyed_on_the_migrated_content(tmp_path):
+    def checkpoint_file(summarize=False, **hack_kwargs):
+        sharded = ShardedMigration(
+            2,
+            checkpoint_dir=str(tmp_path),
+            chat_history_file="export.json",
+            chat_type="openai",
+            extract_dir=str(tmp_path),
+            **hack_kwargs,
+        )
+        return sharded.checkpoint_file(0, summarize)
+
+    files = [
+        checkpoint_file(),
+        checkpoint_file(openai_roles=("user", "assistant")),
+        checkpoint_file(merge_consecutive=True),
+        checkpoint_file(openai_branches=True),
+        checkpoint_file(dedup=True),
+        checkpoint_file(summarize=True),
+        checkpoint_file(summarize=True, summarizer="extractive"),
+    ]
+    assert len(set(files)) == len(files)
+    assert checkpoint_file() == checkpoint_file()
@@ -0,0 +1,291 @@
+import json
+
+import pytest
+
+from summarizer import ExtractiveSummarizer, SummaryBackend, make_summary_backend
+
+
+def test_extractive_keeps_central_sentences_in_order():
+    text = "\n".join(
+        [
+            "We planned a hiking trip to the mountains.",
+            "The weather was sunny.",
+            "The hiking trip to the mountains took all weekend.",
+            "My cat likes fish.",
+            "Next year we want another hiking trip to the mountains.",
+        ]
+    )
+    summary = ExtractiveSummarizer(max_sentences=2).summarize(text)
+    assert "My cat likes fish." not in summary
+    assert summary.count("hiking trip") == 2
+
+
+def test_extractive_short_text_and_tfidf():
+    text = "Just one. And two."
+    assert ExtractiveSummarizer().summarize(text) == text
+    summary = ExtractiveSummarizer(max_sentences=1, method="tfidf").summarize(
+        "ok.\nThe long sentence about gardens and painting and music.\nyes."
+    )
+    assert summary == "The long sentence about gardens and painting and music."
+
+
+def test_backend_factory():
+    assert make_summary_backend("extractive").name == "extractive"
+    for name, error in [
+        ("openai", "API key not found"),
+        ("compatible", "needs --summarizer_url"),
+        ("nope", "Invalid summarizer: nope"),
+    ]:
+        with pytest.raises(Exception, match=error):
+            make_summary_backend(name)
+    backend = make_summary_backend(
+        "compatible", base_url="http://localhost:11434/v1/", model="llama3"
+    )
+    url = backend.openai_summary.openai_url
+    assert url == "http://localhost:11434/v1/chat/completions"
+    assert "Authorization" not in backend.openai_summary.headers
+
+
+def test_offline_backends_need_no_api_key(tmp_path):
+    from migration import MigrationHack
+
+    missing = str(tmp_path / "missing_api_key.json")
+    hack = MigrationHack(
+        chat_history_file="offline.json",
+        api_key_file=missing,
+        summarizer="extractive",
+    )
+    assert hack.summary_backend().name == "extractive"
+    hack = MigrationHack(
+        chat_history_file="offline.json",
+        api_key_file=missing,
+        summarizer="compatible",
+        summarizer_url="http://localhost:11434/v1",
+    )
+    backend = hack.summary_backend()
+    assert "Authorization" not in backend.openai_summary.headers
+    hack = MigrationHack(
+        chat_history_file="offline.json", api_key_file=missing, summarizer="openai"
+    )
+    with pytest.raises(FileNotFoundError):
+        hack.summary_backend()
+
+
+class CountingBackend(SummaryBackend):
+    name = "counting"
+
+    def __init__(self):
+        self.calls = 0
+
+    def summarize(self, text):
+        self.calls += 1
+        return f"[{len(text.splitlines())}]"
+
+
+class RecordingClient:
+    def __init__(self):
+        self.posts = []
+
+    def post_episodic_memory(self, message, session=None, metadata=None, **kwargs):
+        self.posts.append((session["session_id"], message, metadata))
+
+
+def test_hierarchical_summaries_and_levels(tmp_path):
+    from migration import MigrationHack
+    from message_store import MessageStore
+
+    def make_hack(summarizer, summary_levels="top"):
+        hack = MigrationHack(
+            chat_history_file="hier.json",
+            extract_dir=str(tmp_path),
+            client=RecordingClient(),
+            progress=False,
+            summarizer=summarizer,
+            summary_fanout=3,
+            summary_levels=summary_levels,
+        )
+        hack.messages = MessageStore()
+        hack.messages[1] = [f"message {i}" for i in range(10)]
+        hack.messages[2] = ["only message"]
+        hack.num_conversations = 2
+        return hack
+
+    backend = CountingBackend()
+    hack = make_hack(backend)
+    hack.summarize_messages(summarize_every=1)
+    tree = hack.summary_tree
+    assert sorted(tree) == [1, 2, 3, 4]
+    assert list(tree[2][1]) == ["[3]", "[3]", "[3]", "[1]"]
+    assert list(tree[3][1]) == ["[3]", "[1]"]
+    assert list(tree[4][1]) == ["[2]"]
+    assert 2 not in tree[2]
+    # 11 batches, 3 + 1 + 1 combined groups, lone summaries are not resummarized
+    assert backend.calls == 16
+
+    hack.insert_memories(summary=True)
+    posts = sorted(hack.client.posts)
+    assert posts == [
+        ("conversation_1", "[2]", {"summary_level": 4}),
+        ("conversation_2", "[1]", {"summary_level": 1}),
+    ]
+
+    # every level is cached, a second run does not summarize again
+    backend = CountingBackend()
+    hack = make_hack(backend, summary_levels="2,4")
+    hack.summarize_messages(summarize_every=1)
+    assert backend.calls == 0
+    hack.insert_memories(summary=True)
+    levels = [metadata["summary_level"] for _, _, metadata in hack.client.posts]
+    assert sorted(levels) == [2, 2, 2, 2, 4]
+
+
+class FailFirstGroupBackend(CountingBackend):
+    failed = False
+
+    def summarize(self, text):
+        if len(text.splitlines()) > 1 and not self.failed:
+            self.failed = True
+            raise Exception("unavailable")
+        return super().summarize(text)
+
+
+def test_failed_hierarchy_group_is_not_cached(tmp_path):
+    from migration import MigrationHack
+    from message_store import MessageStore
+
+    def run(backend):
+        hack = MigrationHack(
+            chat_history_file="flaky.json",
+            extract_dir=str(tmp_path),
+            client=RecordingClient(),
+            progress=False,
+            summarizer=backend,
+            summary_fanout=3,
+        )
+        hack.messages = MessageStore()
+        hack.messages[1] = [f"message {i}" for i in range(4)]
+        hack.messages[2] = [f"other {i}" for i in range(3)]
+        hack.num_conversations = 2
+        hack.summarize_messages(summarize_every=1)
+        hack.insert_memories(summary=True)
+        return hack
+
+    # the first level 2 group fails: that conversation gets no level files
+    # and is not inserted, the other one is
+    hack = run(FailFirstGroupBackend())
+    assert len(hack.summary_failed) == 1
+    failed = hack.summary_failed.pop()
+    assert not list(tmp_path.glob(f"flaky_summarized_counting_f3_L*_conv_{failed}.txt"))
+    assert {session for session, _, _ in hack.client.posts} == {
+        f"conversation_{3 - failed}"
+    }
+
+    # a rerun summarizes the failed conversation's levels again
+    backend = CountingBackend()
+    hack = run(backend)
+    assert not hack.summary_failed
+    assert backend.calls > 0
+    assert {session for session, _, _ in hack.client.posts} == {
+        "conversation_1",
+        "conversation_2",
+    }
+
+
+def test_batch_backend_against_standin(tmp_path):
+    from migration import MigrationHack
+    from message_store import MessageStore
+    from openai_standin import OpenAIStandIn
+    from summarizer import OpenAIBatchBackend
+
+    with OpenAIStandIn(batch_delay_s=0.05, fail_ids={"conv-1-batch-2", "conv-2-batch-1"}) as standin:
+        backend = OpenAIBatchBackend(
+            "sk-test", base_url=standin.url, poll_interval=0.01
+        )
+        hack = MigrationHack(
+            chat_history_file="batch.json",
+            extract_dir=str(tmp_path),
+            client=RecordingClient(),
+            summarizer=backend,
+        )
+        hack.messages = MessageStore()
+        hack.messages[1] = [f"first {i}" for i in range(5)]
+        hack.messages[2] = ["second"]
+        hack.summarize_messages(summarize_every=2)
+        # one failed batch fails its whole conversation, nothing is cached
+        assert len(hack.summaries[1]) == 0
+        assert len(hack.summaries[2]) == 0
+        assert hack.summary_failed == {1, 2}
+        assert not list(tmp_path.glob("batch_summarized_conv_*.txt"))
+        # one upload and one batch for all conversations, then polling
+        posts = [path for method, path in standin.requests if method == "POST"]
+        assert posts == ["/v1/files", "/v1/batches"]
+        request_file = tmp_path / "batch_summarized_batch_requests.jsonl"
+        custom_ids = [json.loads(l)["custom_id"] for l in request_file.open()]
+        assert custom_ids == [
+            "conv-1-batch-1",
+            "conv-1-batch-2",
+            "conv-1-batch-3",
+            "conv-2-batch-1",
+        ]
+        assert not (tmp_path / "batch_summarized_batch_state.json").exists()
+
+        # rerun: both conversations are resubmitted and cached
+        standin.fail_ids.clear()
+        hack.summaries = MessageStore()
+        hack.summarize_messages(summarize_every=2)
+        assert list(hack.summaries[1]) == [
+            "Summary: first 0",
+            "Summary: first 2",
+            "Summary: first 4",
+        ]
+        assert list(hack.summaries[2]) == ["Summary: second"]
+        assert len(request_file.read_text().splitlines()) == 4
+
+        # third run: everything is cached, no batch is submitted
+        hack.summaries = MessageStore()
+        hack.summarize_messages(summarize_every=2)
+        assert list(hack.summaries[1])[1] == "Summary: first 2"
+        posts = [path for method, path in standin.requests if method == "POST"]
+        assert len(posts) == 4
+
+
+def test_batch_jobs_of_shards_stay_apart(tmp_path):
+    import threading
+
+    from migration import MigrationHack
+    from message_store import MessageStore
+    from openai_standin import OpenAIStandIn
+    from summarizer import OpenAIBatchBackend
+
+    def run_shard(shard, standin):
+        hack = MigrationHack(
+            chat_history_file="sharded.json",
+            extract_dir=str(tmp_path),
+            client=RecordingClient(),
+            summarizer=OpenAIBatchBackend(
+                "sk-test", base_url=standin.url, poll_interval=0.01
+            ),
+            shard_name=f"shard_{shard}_of_2",
+        )
+        hack.messages = MessageStore()
+        hack.messages[shard + 1] = [f"shard {shard} message {i}" for i in range(4)]
+        hack.summarize_messages(summarize_every=2)
+        results[shard] = list(hack.summaries[shard + 1])
+
+    results = {}
+    with OpenAIStandIn(batch_delay_s=0.05) as standin:
+        threads = [
+            threading.Thread(target=run_shard, args=(shard, standin))
+            for shard in range(2)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert results == {
+        0: ["Summary: shard 0 message 0", "Summary: shard 0 message 2"],
+        1: ["Summary: shard 1 message 0", "Summary: shard 1 message 2"],
+    }
+    for shard in range(2):
+        request_file = tmp_path / f"sharded_summarized_batch_shard_{shard}_of_2_requests.jsonl"
+        assert len(request_file.read_text().splitlines()) == 2
@@ -0,0 +1,49 @@
+import random
+
+from message_store import MessageStore
+from verify import MigrationVerifier, stratified_sample
+
+
+class FakeMemoryClient:
+    """Returns a stored memory only when it equals the query"""
+
+    def __init__(self, stored):
+        self.stored = stored
+
+    def search_episodic_memory(self, query_str, limit=5, session=None):
+        found = [{"content": m} for m in self.stored.get(session["session_id"], [])]
+        found = [m for m in found if m["content"] == query_str]
+        return {"status": 0, "content": {"episodic_memory": [found[:limit]]}}
+
+
+def session_for(conv_id):
+    return {"session_id": f"conversation_{conv_id}"}
+
+
+def test_stratified_sample_covers_every_stratum():
+    indexes = stratified_sample(100, 10, random.Random(1))
+    assert [i // 10 for i in indexes] == list(range(10))
+    assert stratified_sample(3, 10, random.Random(1)) == [0, 1, 2]
+
+
+def test_hit_rate_sampled_and_exhaustive():
+    contents = MessageStore()
+    contents[1] = [f"message {i}" for i in range(40)]
+    contents[2] = [f"other {i}" for i in range(40)]
+    # conversation 2 lost every odd message
+    client = FakeMemoryClient(
+        {
+            "conversation_1": list(contents[1]),
+            "conversation_2": [m for i, m in enumerate(contents[2]) if i % 2 == 0],
+        }
+    )
+    report = MigrationVerifier(client, session_for, exhaustive=True).run(contents)
+    assert report["checked"] == 80 and report["hits"] == 60
+    assert report["per_conversation"][1]["hit_rate"] == 1.0
+    assert report["per_conversation"][2]["hit_rate"] == 0.5
+
+    report = MigrationVerifier(
+        client, session_for, samples_per_conversation=8
+    ).run(contents)
+    assert report["checked"] == 16
+    assert report["per_conversation"][1]["hits"] == 8
@@ -0,0 +1,140 @@
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from dedup import normalize_text
+from loadgen import percentile
+from restcli import episodic_memory_contents
+
+
+def stratified_sample(count, samples, rng):
+    """Pick up to samples indexes out of range(count), one per equal-size stratum"""
+    if samples <= 0 or count <= samples:
+        return list(range(count))
+    indexes = []
+    for s in range(samples):
+        lo = s * count // samples
+        hi = (s + 1) * count // samples
+        indexes.append(rng.randrange(lo, hi))
+    return indexes
+
+
+class MigrationVerifier:
+    """Search back migrated messages and measure hit-rate@k.
+
+    Each checked message is used as the query against its own session and
+    counts as a hit when it comes back among the top k results. Sampling
+    is stratified by position inside every conversation; exhaustive mode
+    checks every message while keeping at most max_inflight searches
+    queued at a time.
+    """
+
+    def __init__(
+        self,
+        client,
+        session_for,
+        k=5,
+        samples_per_conversation=10,
+        exhaustive=False,
+        concurrency=16,
+        seed=0,
+    ):
+        self.client = client
+        self.session_for = session_for
+        self.k = k
+        self.samples_per_conversation = samples_per_conversation
+        self.exhaustive = exhaustive
+        self.concurrency = concurrency
+        self.max_inflight = concurrency * 4
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.per_conversation = {}  # key: conversation id, value: [checked, hits, errors]
+        self.latencies_ms = []
+
+    def _tasks(self, contents):
+        for conv_id, messages in contents.items():
+            if self.exhaustive:
+                indexes = range(len(messages))
+            else:
+                indexes = stratified_sample(
+                    len(messages), self.samples_per_conversation, self.rng
+                )
+            for i in indexes:
+                yield conv_id, messages[i]
+
+    def _check(self, conv_id, message):
+        start = time.perf_counter()
+        hit = False
+        error = False
+        try:
+            results = self.client.search_episodic_memory(
+                message, limit=self.k, session=self.session_for(conv_id)
+            )
+            wanted = normalize_text(message)
+            hit = any(
+                normalize_text(content) == wanted
+                for content in episodic_memory_contents(results)[: self.k]
+            )
+        except Exception:
+            error = True
+        latency_ms = (time.perf_counter() - start) * 1000
+        with self.lock:
+            counts = self.per_conversation.setdefault(conv_id, [0, 0, 0])
+            counts[0] += 1
+            counts[1] += hit
+            counts[2] += error
+            self.latencies_ms.append(latency_ms)
+
+    def run(self, contents):
+        start = time.perf_counter()
+        inflight = set()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for conv_id, message in self._tasks(contents):
+                if len(inflight) >= self.max_inflight:
+                    _, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                inflight.add(executor.submit(self._check, conv_id, message))
+            wait(inflight)
+        return self.report(time.perf_counter() - start)
+
+    def report(self, elapsed_s=0.0):
+        checked = sum(c[0] for c in self.per_conversation.values())
+        hits = sum(c[1] for c in self.per_conversation.values())
+        errors = sum(c[2] for c in self.per_conversation.values())
+        latencies = sorted(self.latencies_ms)
+        return {
+            "mode": "exhaustive" if self.exhaustive else "sampled",
+            "k": self.k,
+            "checked": checked,
+            "hits": hits,
+            "errors": errors,
+            "hit_rate": hits / checked if checked else 0.0,
+            "elapsed_s": elapsed_s,
+            "searches_per_s": checked / elapsed_s if elapsed_s else 0.0,
+            "latency_ms": {p: percentile(latencies, p) for p in (50, 90, 99)},
+            "per_conversation": {
+                conv_id: {
+                    "checked": c[0],
+                    "hits": c[1],
+                    "errors": c[2],
+                    "hit_rate": c[1] / c[0] if c[0] else 0.0,
+                }
+                for conv_id, c in sorted(self.per_conversation.items())
+            },
+        }
+
+
+def print_report(report):
+    print(
+        f"== Verify ({report['mode']}): hit-rate@{report['k']} "
+        f"{report['hit_rate'] * 100:.1f}% ({report['hits']}/{report['checked']}), "
+        f"{report['errors']} errors, {report['searches_per_s']:.1f} searches/s"
+    )
+    latency = " ".join(f"p{p:g}={v:.1f}" for p, v in report["latency_ms"].items())
+    print(f"   latency_ms: {latency}")
+    for conv_id, c in report["per_conversation"].items():
+        print(
+            f"   conv {conv_id}: hit-rate {c['hit_rate'] * 100:.1f}% "
+            f"({c['hits']}/{c['checked']}), {c['errors']} errors"
+        )